@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+
+        from .authentication import user_deleted, user_saved
+        from .profiling import install_db_wrapper
+        connection_created.connect(install_db_wrapper, dispatch_uid="heart_db_wrapper")
+        # thay đổi User ghi đè claim cũ trong cache xác thực
+        post_save.connect(user_saved, sender=self.get_model("User"), dispatch_uid="heart_user_saved")
+        post_delete.connect(user_deleted, sender=self.get_model("User"), dispatch_uid="heart_user_deleted")
+
+        if getattr(settings, "MODEL_PRELOAD", False):
+            from .registry import preload
+            preload()
@@ -0,0 +1,170 @@
+# ===============================
+# async_views.py – đường dự đoán async cho ASGI (uvicorn backend.asgi:application)
+# ===============================
+#
+# DRF APIView chỉ chạy sync nên endpoint này là async view thuần Django:
+#   - xác thực JWT + INSERT History chạy qua sync_to_async / async ORM, không chặn event loop
+#   - chấm điểm (CPU) chạy trong pool giới hạn PREDICT_EXECUTOR_WORKERS luồng (hoặc tiến trình)
+#   - PREDICT_ASYNC_DEFER_HISTORY=True: trả kết quả ngay, ghi History ở task nền
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from . import drift, metrics, shadow, writebehind
+from .authentication import ClaimsJWTAuthentication
+from .models import History
+from .personalize import personalize_recommendations, risk_tier
+from .profiling import stage
+from .registry import get_model
+from .serializers import PredictSerializer
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("heart_async_inflight", "gauge", "Async prediction requests currently being handled")
+metrics.describe("heart_async_queue_depth", "gauge", "Scoring jobs waiting for a free executor worker")
+metrics.describe("heart_async_executor_workers", "gauge", "Size of the async scoring executor")
+metrics.describe("heart_async_requests_total", "counter", "Async prediction requests by status code")
+
+_jwt = ClaimsJWTAuthentication()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = set()   # task ghi History đang chạy nền (giữ tham chiếu để không bị GC)
+
+
+def _get_executor():
+    # pool không sống qua fork(): mỗi worker tự tạo pool của mình
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                workers = getattr(settings, "PREDICT_EXECUTOR_WORKERS", 4)
+                if getattr(settings, "PREDICT_EXECUTOR", "thread") == "process":
+                    _executor = ProcessPoolExecutor(max_workers=workers)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="predict")
+                _executor_pid = os.getpid()
+                metrics.set_gauge("heart_async_executor_workers", workers)
+    return _executor
+
+
+def score(data, model=None):
+    """Chấm điểm + khuyến nghị cho 1 bệnh nhân; chạy trong executor (luồng hoặc tiến trình con)"""
+    model = model or get_model()
+    p = float(model.predict_positive([data])[0])
+    risk = risk_tier(p)
+    return model.version, p, risk, personalize_recommendations(data, tier=risk)
+
+
+def _observe(model, data, p):
+    """drift + shadow; phải chạy trong tiến trình phục vụ request (sketch/queue nằm trong RAM của nó)"""
+    drift.observe(model, [data])
+    shadow.submit(model, [data], [p])
+
+
+def _authenticate(request):
+    try:
+        result = _jwt.authenticate(request)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+async def _run_scoring(data):
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    if isinstance(executor, ProcessPoolExecutor):
+        # tiến trình con không cập nhật được metric / drift / shadow của tiến trình cha:
+        # ghi nhận ở đây trên kết quả trả về
+        result = await loop.run_in_executor(executor, score, dict(data))
+        model = get_model()
+        if model.version == result[0]:   # khác: vừa hot-swap giữa lúc chấm, bỏ mẫu này
+            _observe(model, data, result[1])
+        return result
+
+    started = False
+
+    def job():
+        nonlocal started
+        started = True
+        metrics.inc("heart_async_queue_depth", -1)
+        model = get_model()
+        result = score(data, model)
+        _observe(model, data, result[1])
+        return result
+
+    metrics.inc("heart_async_queue_depth", 1)
+    try:
+        return await loop.run_in_executor(executor, job)
+    finally:
+        if not started:   # bị huỷ trước khi tới lượt
+            metrics.inc("heart_async_queue_depth", -1)
+
+
+async def _save_history_later(history):
+    try:
+        await history.asave()
+    except Exception:
+        logger.exception("Deferred History insert failed")
+
+
+def _respond(body, status):
+    metrics.inc("heart_async_requests_total", status=status)
+    return JsonResponse(body, status=status, json_dumps_params={"ensure_ascii": False})
+
+
+@csrf_exempt
+@require_POST
+async def predict_async(request):
+    metrics.inc("heart_async_inflight", 1)
+    try:
+        # ClaimsJWTAuthentication tự đo giai đoạn "auth"
+        user = await sync_to_async(_authenticate)(request)
+        if user is None or not user.is_authenticated:
+            return _respond({"detail": "Authentication credentials were not provided or are invalid."}, 401)
+
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return _respond({"detail": "JSON parse error"}, 400)
+        with stage("validate"):
+            serializer = PredictSerializer(data=payload)
+            valid = serializer.is_valid()
+        if not valid:
+            return _respond(serializer.errors, 400)
+        data = serializer.validated_data
+
+        # gồm cả thời gian chờ trong hàng đợi executor
+        with stage("predict"):
+            version, p, risk, recommendations = await _run_scoring(data)
+
+        history = History(user_id=user.pk, input_data=data, probability=p, risk=risk,
+                          recommendations=recommendations, model_version=version)
+        body = {"probability": p, "risk": risk, "recommendations": recommendations,
+                "model_version": version, "history_id": None, "history_uid": str(history.uid)}
+        if writebehind.enabled():
+            # chỉ append journal + buffer, không chạm DB
+            writebehind.save_histories([history])
+        elif getattr(settings, "PREDICT_ASYNC_DEFER_HISTORY", False):
+            task = asyncio.ensure_future(_save_history_later(history))
+            _pending.add(task)
+            task.add_done_callback(_pending.discard)
+        else:
+            with stage("history"):
+                await history.asave()
+            body["history_id"] = history.id
+        return _respond(body, 200)
+    finally:
+        metrics.inc("heart_async_inflight", -1)
@@ -0,0 +1,188 @@
+# ===============================
+# authentication.py – xác thực JWT không truy vấn DB trên đường predict
+# ===============================
+#
+# JWTAuthentication mặc định SELECT api_user cho mọi request có token chỉ để gắn
+# request.user. Token cấp từ /api/login/ (ClaimsTokenObtainPairSerializer) đã mang sẵn
+# các claim username / full_name / is_active / is_staff / is_superuser đã ký, nên
+# ClaimsJWTAuthentication dựng request.user (ClaimsUser, không phải model User) trực
+# tiếp từ claim: 0 câu SQL cho xác thực.
+#
+# Thứ tự tra cứu theo user_id:
+#   1. bản ghi đè trong Django cache dùng chung (CACHES[AUTH_USER_CACHE_ALIAS])
+#   2. UserCache cục bộ (TTL AUTH_USER_CACHE_TTL)
+#   3. claim trong token (xem claims_trusted())
+#   4. DB (token cũ chưa có claim) -> lưu vào UserCache
+# Khi User được lưu / xoá (signal post_save / post_delete) trạng thái mới được ghi vào
+# cache dùng chung và giữ tới khi mọi access token cũ hết hạn, nên hạ quyền admin / khoá
+# tài khoản có hiệu lực ngay ở mọi worker. Cache đó chỉ thật sự dùng chung khi không phải
+# locmem / dummy; nếu không, claim trong token chỉ được tin trong AUTH_USER_CACHE_TTL
+# giây kể từ lúc cấp (iat), token cũ hơn thì đọc lại DB (bước 4), nên worker khác thấy
+# thay đổi chậm nhất sau AUTH_USER_CACHE_TTL thay vì tới khi token hết hạn.
+# /api/token/refresh/ (ClaimsTokenRefreshSerializer) đọc lại User từ DB nên access token
+# mới không mang lại quyền cũ của refresh token. View chỉ dành cho admin dùng
+# IsAdminUserFromDB: is_staff / is_active luôn lấy từ DB, không từ claim hay cache.
+#
+# request.user không phải instance User: view ghi khoá ngoại bằng user_id=request.user.pk.
+
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from . import metrics
+from .profiling import TimedJWTAuthentication
+
+CLAIMS = ("username", "full_name", "is_active", "is_staff", "is_superuser")
+
+metrics.describe("heart_auth_user_lookups_total", "counter",
+                 "Authenticated user resolutions by source (override, cache, claims, db)")
+
+
+def user_claims(user):
+    """Các claim gắn vào token / lưu trong UserCache cho 1 User"""
+    claims = {name: getattr(user, name) for name in CLAIMS}
+    claims[api_settings.USER_ID_CLAIM] = getattr(user, api_settings.USER_ID_FIELD)
+    return claims
+
+
+class ClaimsUser(TokenUser):
+    """request.user dựng từ claim (token hoặc cache), không có dòng DB đi kèm"""
+
+    @property
+    def is_active(self):
+        return self.token.get("is_active", True)
+
+    def __str__(self):
+        return self.username or f"ClaimsUser {self.id}"
+
+
+# -------------------------------
+# Cache user cục bộ
+# -------------------------------
+class UserCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # user_id -> (hết hạn lúc, claims)
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, claims = entry
+        if expires < time.monotonic():
+            with self._lock:
+                if self._entries.get(user_id) is entry:
+                    del self._entries[user_id]
+            return None
+        return claims
+
+    def put(self, user_id, claims, ttl):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + ttl, claims)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache()
+
+
+def cache_ttl():
+    return float(getattr(settings, "AUTH_USER_CACHE_TTL", 300))
+
+
+def _override_ttl():
+    # thay đổi từ signal phải sống lâu hơn mọi access token mang claim cũ
+    return max(cache_ttl(), api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def shared_cache():
+    return caches[getattr(settings, "AUTH_USER_CACHE_ALIAS", "default")]
+
+
+def cache_is_shared():
+    """locmem chỉ có trong tiến trình ghi, dummy không lưu gì: bản ghi đè không tới worker khác"""
+    return not isinstance(shared_cache(), (LocMemCache, DummyCache))
+
+
+def claims_trusted(validated_token):
+    """Claim trong token có dùng được thay cho DB không"""
+    if not all(name in validated_token for name in CLAIMS):
+        return False
+    if cache_is_shared():
+        return True
+    return time.time() - validated_token.get("iat", 0) <= cache_ttl()
+
+
+def _override_key(user_id):
+    return f"heart:auth:user:{user_id}"
+
+
+def _put_override(claims):
+    shared_cache().set(_override_key(claims[api_settings.USER_ID_CLAIM]), claims, _override_ttl())
+
+
+def user_saved(sender, instance, **kwargs):
+    """post_save của User: trạng thái mới thắng claim cũ trong token ở mọi worker"""
+    _put_override(user_claims(instance))
+
+
+def user_deleted(sender, instance, **kwargs):
+    _put_override(dict(user_claims(instance), is_active=False))
+
+
+class ClaimsJWTAuthentication(TimedJWTAuthentication):
+    """JWT + request.user từ claim/cache thay vì SELECT api_user mỗi request"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        source = "override"
+        claims = shared_cache().get(_override_key(user_id))
+        if claims is None:
+            source = "cache"
+            claims = user_cache.get(user_id)
+        if claims is None and claims_trusted(validated_token):
+            source = "claims"
+            claims = {name: validated_token[name] for name in CLAIMS}
+            claims[api_settings.USER_ID_CLAIM] = user_id
+        elif claims is None:
+            # token cấp trước khi có claim / claim quá cũ: tra DB 1 lần rồi cache
+            source = "db"
+            claims = user_claims(super().get_user(validated_token))
+            user_cache.put(user_id, claims, cache_ttl())
+        metrics.inc("heart_auth_user_lookups_total", source=source)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not claims.get("is_active", True):
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return ClaimsUser(claims)
+
+
+def staff_in_db(user):
+    """is_staff + is_active của `user` đọc thẳng từ DB (không tin claim / cache)"""
+    if not (user and user.is_authenticated and user.is_staff):
+        return False
+    return get_user_model().objects.filter(pk=user.pk, is_staff=True, is_active=True).exists()
+
+
+class IsAdminUserFromDB(BasePermission):
+    """IsAdminUser nhưng kiểm tra lại quyền admin trong DB cho mỗi request"""
+
+    def has_permission(self, request, view):
+        return staff_in_db(request.user)
@@ -0,0 +1,141 @@
+# ===============================
+# cache.py – cache kết quả dự đoán theo vector đặc trưng đã chuẩn hoá
+# ===============================
+#
+# Người dùng hay gửi lại đúng form cũ (retry, sửa trường không liên quan, frontend
+# post lại sau khi refresh token). Kết quả (probability, risk, recommendations) chỉ
+# phụ thuộc 13 biến theo feature_order + phiên bản mô hình, nên được cache theo:
+#     khóa = hash(model_version, giá trị chuẩn hoá của feature_order)
+# Chuẩn hoá: số nguyên/số thực cùng giá trị (1 và 1.0) cho cùng khóa, thiếu -> "nan".
+# `variant` tách các dạng kết quả khác nhau của cùng 1 input (vd. "severity").
+#
+# PREDICT_CACHE:
+#   "local"  – LRU trong tiến trình, tối đa PREDICT_CACHE_SIZE phần tử (mặc định)
+#   "django" – dùng Django cache framework (CACHES[PREDICT_CACHE_ALIAS]: locmem, file, ...)
+#   None     – tắt
+# Phiên bản mô hình nằm trong khóa nên không cần xoá cache khi đổi mô hình: trong lúc
+# hot-swap các request còn giữ mô hình cũ vẫn dùng khóa của nó, khóa của phiên bản cũ
+# không còn được đọc sẽ bị LRU đẩy ra dần (pin/rollback về bản cũ vẫn còn kết quả cũ).
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+metrics.describe("heart_predict_cache_hits_total", "counter", "Prediction cache hits")
+metrics.describe("heart_predict_cache_misses_total", "counter", "Prediction cache misses")
+metrics.describe("heart_predict_cache_evictions_total", "counter", "Prediction cache evictions (local LRU only)")
+metrics.describe("heart_predict_cache_size", "gauge", "Entries in the local prediction cache")
+
+
+def cache_key(version, data, feature_order, variant=None):
+    parts = [str(version)] if variant is None else [str(version), variant]
+    for f in feature_order:
+        v = data.get(f)
+        parts.append("nan" if v is None else repr(float(v)))
+    if data.get("site"):
+        # site chọn mô hình cohort: cùng input khác site có thể khác kết quả
+        parts.append(str(data["site"]))
+    return "heart:predict:" + hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+
+
+class LocalCache:
+    """LRU giới hạn số phần tử, an toàn đa luồng"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, version, value):
+        evicted = 0
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+            size = len(self._data)
+        if evicted:
+            metrics.inc("heart_predict_cache_evictions_total", evicted)
+        metrics.set_gauge("heart_predict_cache_size", size)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        metrics.set_gauge("heart_predict_cache_size", 0)
+
+
+class DjangoCache:
+    """Bọc Django cache framework (locmem/file/redis... theo CACHES)"""
+
+    def __init__(self, alias="default", timeout=None):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key, version):
+        return self.cache.get(key)
+
+    def set(self, key, version, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Cache theo cấu hình PREDICT_CACHE, None nếu tắt"""
+    global _cache
+    kind = getattr(settings, "PREDICT_CACHE", "local")
+    if not kind:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if kind == "django":
+                    _cache = DjangoCache(
+                        alias=getattr(settings, "PREDICT_CACHE_ALIAS", "default"),
+                        timeout=getattr(settings, "PREDICT_CACHE_TTL", None),
+                    )
+                else:
+                    _cache = LocalCache(maxsize=getattr(settings, "PREDICT_CACHE_SIZE", 10000))
+    return _cache
+
+
+def history_on_hit():
+    """Cache hit có tạo dòng History hay không (PREDICT_CACHE_HISTORY_ON_HIT)"""
+    return getattr(settings, "PREDICT_CACHE_HISTORY_ON_HIT", True)
+
+
+def cached_predict(model, data, compute, variant=None):
+    """
+    Trả về (result, hit). compute() -> dict {probability, risk, recommendations}
+    chỉ được gọi khi chưa có trong cache.
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute(), False
+    key = cache_key(model.version, data, model.feature_order, variant)
+    result = cache.get(key, model.version)
+    if result is not None:
+        metrics.inc("heart_predict_cache_hits_total")
+        return result, True
+    metrics.inc("heart_predict_cache_misses_total")
+    result = compute()
+    cache.set(key, model.version, result)
+    return result, False
@@ -0,0 +1,82 @@
+# ===============================
+# cohorts.py – chọn mô hình theo cơ sở (site) cho dữ liệu nhiều nơi
+# ===============================
+#
+# 4 file processed.* đến từ 4 cơ sở với mức thiếu ca / thal / slope rất khác nhau
+# (Cleveland gần như đủ; Hungarian, Switzerland, VA thiếu ca ở hầu hết các dòng).
+# Ngoài mô hình chung (fit trên dữ liệu gộp), train() fit thêm 1 LR đã calibrate cho
+# từng cơ sở trên CÙNG ma trận của bước "pre" dùng chung (make_preprocess()), và chỉ
+# giữ mô hình cơ sở nào có AUC out-of-fold trên chính cơ sở đó không kém mô hình chung.
+#
+# Mỗi dòng input được gán 1 chỉ số route: 0 = mô hình chung, c = cohort thứ c (1..C):
+#   - input có "site": dùng mô hình của cơ sở đó (chưa có mô hình riêng -> mô hình chung)
+#   - không có: tra bảng route_table theo mẫu thiếu của ROUTE_FEATURES (bit j bật nếu
+#     biến j thiếu). Bảng dựng lúc train: mẫu thiếu nào có đa số (>= ROUTE_MIN_SHARE)
+#     các dòng huấn luyện thuộc 1 cơ sở có mô hình riêng thì route về cơ sở đó.
+# Các mô hình cohort được xếp chồng vào cùng các mảng fold của api/engine.py, nên thêm
+# cohort chỉ thêm vài dòng coef / điểm isotonic: 1 lần transform, 1 phép nhân ma trận,
+# 1 lần np.interp cho cả batch dù có bao nhiêu cohort.
+# Module này chỉ dùng NumPy (engine import được).
+
+import numpy as np
+
+SITES = ("cleveland", "hungarian", "switzerland", "va")
+GLOBAL = "global"
+ROUTE_FEATURES = ("ca", "thal", "slope")
+ROUTE_MIN_SHARE = 0.6   # tỉ lệ dòng tối thiểu của cơ sở chiếm đa số trong 1 mẫu thiếu
+ROUTE_MIN_ROWS = 20     # mẫu thiếu có ít dòng huấn luyện hơn -> mô hình chung
+
+
+def site_of(source):
+    """tên file (vd. processed.cleveland.data) -> "cleveland"; None nếu không thuộc SITES"""
+    name = str(source).rsplit("/", 1)[-1]
+    for part in name.split("."):
+        if part in SITES:
+            return part
+    return None
+
+
+_BITS = 1 << np.arange(16, dtype=np.intp)
+
+
+def patterns(X, route_index):
+    """(n, n_features) -> mã mẫu thiếu (n,): bit j bật nếu biến route_index[j] là NaN"""
+    missing = np.isnan(np.asarray(X, dtype=float)[:, route_index])
+    return missing @ _BITS[:missing.shape[1]]
+
+
+def build_route_table(X, sites, names, route_index, min_share=ROUTE_MIN_SHARE, min_rows=ROUTE_MIN_ROWS):
+    """Bảng mẫu thiếu -> route từ dữ liệu huấn luyện (sites: nhãn cơ sở của từng dòng)"""
+    codes = patterns(X, route_index)
+    sites = np.asarray(sites, dtype=object)
+    table = np.zeros(1 << len(route_index), dtype=np.intp)
+    for code in range(len(table)):
+        rows = sites[codes == code]
+        if len(rows) < min_rows:
+            continue
+        values, counts = np.unique(rows.astype(str), return_counts=True)
+        best = int(np.argmax(counts))
+        if values[best] in names and counts[best] >= min_share * len(rows):
+            table[code] = list(names).index(values[best]) + 1
+    return table
+
+
+def route(X, route_index, route_table, names, sites=None):
+    """Chỉ số route (n,) cho từng dòng; sites (list, phần tử None = không rõ) ưu tiên hơn bảng"""
+    routes = np.asarray(route_table)[patterns(X, route_index)]
+    if sites is not None and any(sites):
+        index = {name: c for c, name in enumerate(names, start=1)}
+        for i, site in enumerate(sites):
+            if site:
+                routes[i] = index.get(site, 0)
+    return routes
+
+
+def predict_routed(Z, routes, global_clf, models):
+    """Đường sklearn: Z đã transform 1 lần, mỗi route gọi predict_proba 1 lần cho các dòng của nó"""
+    p = np.empty(len(Z))
+    for c in np.unique(routes):
+        rows = routes == c
+        clf = global_clf if c == 0 else models[c - 1]
+        p[rows] = clf.predict_proba(Z[rows])[:, 1]
+    return p
@@ -0,0 +1,284 @@
+# ===============================
+# datasets.py – đọc dữ liệu UCI heart-disease theo từng chunk
+# ===============================
+#
+# Ba định dạng đầu vào:
+#   "processed" – processed.*.data: 14 cột (13 biến + num), không header, '?' = thiếu
+#                 (reprocessed.hungarian.data: cách nhau bởi khoảng trắng, -9 = thiếu)
+#   "csv"       – CSV có header chứa (ít nhất) các cột feature_order, '?' = thiếu
+#   "raw"       – cleveland.data, hungarian.data, ... new.data: mỗi bệnh nhân 76
+#                 thuộc tính (new.data: 90) trải trên nhiều dòng, kết thúc bằng từ
+#                 "name", -9 = thiếu
+# Xử lý giá trị thiếu giống final.ipynb: '?' -> NaN rồi pd.to_numeric(errors="coerce").
+# Mọi reader đều là generator trả về DataFrame từng chunk, bộ nhớ không tăng theo kích
+# thước file.
+#
+# File raw được parse 1 lần thành cache dạng cột (mỗi thuộc tính 1 file .npy float64,
+# -9 -> NaN) trong RAW_CACHE_DIR/<tên file>-<băm đường dẫn>/; manifest.json ghi sha256 của file nguồn,
+# file nguồn đổi thì cache tự dựng lại. load_raw() trả về các cột np.memmap: đọc
+# bất kỳ tập con thuộc tính nào mà không parse lại text, không copy.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ["age", "sex", "cp", "trestbps", "chol", "fbs", "restecg",
+            "thalach", "exang", "oldpeak", "slope", "ca", "thal"]
+TARGET = "num"
+
+# 76 thuộc tính theo thứ tự trong heart-disease.names (thuộc tính 76 "name" là chữ)
+RAW_ATTRIBUTES = [
+    "id", "ccf", "age", "sex", "painloc", "painexer", "relrest", "pncaden", "cp", "trestbps",
+    "htn", "chol", "smoke", "cigs", "years", "fbs", "dm", "famhist", "restecg", "ekgmo",
+    "ekgday", "ekgyr", "dig", "prop", "nitr", "pro", "diuretic", "proto", "thaldur", "thaltime",
+    "met", "thalach", "thalrest", "tpeakbps", "tpeakbpd", "dummy", "trestbpd", "exang", "xhypo", "oldpeak",
+    "slope", "rldv5", "rldv5e", "ca", "restckm", "exerckm", "restef", "restwm", "exeref", "exerwm",
+    "thal", "thalsev", "thalpul", "earlobe", "cmo", "cday", "cyr", "num", "lmt", "ladprox",
+    "laddist", "diag", "cxmain", "ramus", "om1", "om2", "rcaprox", "rcadist", "lvx1", "lvx2",
+    "lvx3", "lvx4", "lvf", "cathef", "junk", "name",
+]
+# định danh bệnh nhân (ccf = số an sinh xã hội trong new.data) không đưa vào cache
+RAW_IDENTIFIERS = ("ccf", "name")
+RAW_MIN_FIELDS = 75      # 75 số + tên (new.data có thêm 14 số)
+RAW_MISSING = -9.0
+
+RAW_CACHE_DIR = os.environ.get(
+    "HEART_RAW_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "var", "raw_cache"),
+)
+RAW_CACHE_FORMAT = 1
+
+
+def detect_format(path):
+    name = os.path.basename(path)
+    if name.startswith(("processed.", "reprocessed.")):
+        return "processed"
+    if name.endswith(".data"):
+        return "raw"
+    return "csv"
+
+
+def _coerce(df):
+    return df.replace("?", np.nan).apply(pd.to_numeric, errors="coerce")
+
+
+def read_processed(path, chunksize=10000):
+    if os.path.basename(path).startswith("reprocessed."):
+        options = {"sep": r"\s+", "na_values": ["?", "-9"]}
+    else:
+        options = {"sep": ",", "na_values": "?"}
+    for chunk in pd.read_csv(path, header=None, names=FEATURES + [TARGET], chunksize=chunksize, **options):
+        yield _coerce(chunk)
+
+
+def read_csv(path, chunksize=10000, feature_order=FEATURES):
+    for chunk in pd.read_csv(path, na_values="?", chunksize=chunksize):
+        missing = [f for f in feature_order if f not in chunk.columns]
+        if missing:
+            raise ValueError(f"{path}: missing columns {', '.join(missing)}")
+        extra = [c for c in chunk.columns if c not in feature_order]
+        chunk[feature_order] = _coerce(chunk[feature_order])
+        yield chunk[list(feature_order) + extra]
+
+
+def iter_raw_records(path):
+    """Từng bản ghi thô (list[float]) của file 76 thuộc tính; bản ghi hỏng bị bỏ qua"""
+    fields, skipped = [], 0
+    with open(path, encoding="latin-1") as f:
+        for line in f:
+            for token in line.split():
+                try:
+                    fields.append(float(token))
+                except ValueError:
+                    # token chữ (thường là "name") kết thúc 1 bản ghi
+                    if len(fields) >= RAW_MIN_FIELDS:
+                        yield fields
+                    elif fields:
+                        skipped += 1
+                    fields = []
+    if fields:
+        skipped += 1
+    if skipped:
+        # cleveland.data bị hỏng một phần (xem file WARNING)
+        logger.warning("%s: skipped %d malformed raw records", path, skipped)
+
+
+def read_raw(path, chunksize=10000, cache_dir=None):
+    """DataFrame từng chunk (13 biến + num) đọc từ cache cột của file raw"""
+    columns = FEATURES + [TARGET]
+    arrays = load_raw(path, columns, cache_dir=cache_dir)
+    n = len(arrays[TARGET])
+    for start in range(0, n, chunksize):
+        yield pd.DataFrame({c: np.asarray(arrays[c][start:start + chunksize]) for c in columns})
+
+
+# ===============================
+# Cache dạng cột cho file raw 76 thuộc tính
+# ===============================
+
+def file_sha256(path, block=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def raw_cache_path(path, cache_dir=None):
+    # tên file + băm đường dẫn: 2 file cùng tên ở 2 thư mục không dùng chung cache
+    tag = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir or RAW_CACHE_DIR, f"{os.path.basename(path)}-{tag}")
+
+
+def _read_manifest(target):
+    try:
+        with open(os.path.join(target, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def raw_cache_valid(path, cache_dir=None):
+    """Cache còn khớp file nguồn? (size+mtime khớp thì khỏi băm lại)"""
+    manifest = _read_manifest(raw_cache_path(path, cache_dir))
+    if manifest is None or manifest.get("format") != RAW_CACHE_FORMAT:
+        return False
+    st = os.stat(path)
+    if manifest["size"] == st.st_size and manifest["mtime_ns"] == st.st_mtime_ns:
+        return True
+    return manifest["size"] == st.st_size and manifest["sha256"] == file_sha256(path)
+
+
+def build_raw_cache(path, cache_dir=None):
+    """
+    Parse file raw (2 lượt, bộ nhớ phẳng): lượt 1 đếm bản ghi, lượt 2 ghi thẳng vào
+    các file .npy mở bằng open_memmap. Ghi vào thư mục tạm rồi đổi tên.
+    """
+    target = raw_cache_path(path, cache_dir)
+    st = os.stat(path)
+    digest = file_sha256(path)
+    # số trường phổ biến nhất là độ dài chuẩn của file; bản ghi dài khác (các bản ghi
+    # bị dính vào nhau trong cleveland.data hỏng) bị bỏ qua
+    lengths = Counter(len(fields) for fields in iter_raw_records(path))
+    if not lengths:
+        raise ValueError(f"{path}: no raw records found")
+    n_fields, n_records = lengths.most_common(1)[0]
+    if len(lengths) > 1:
+        logger.warning("%s: skipped %d raw records with unexpected length",
+                       path, sum(lengths.values()) - n_records)
+
+    # new.data có 89 trường số: 14 trường cuối không có tên trong heart-disease.names
+    names = list(RAW_ATTRIBUTES[:-1]) + [f"extra{i}" for i in range(1, n_fields - RAW_MIN_FIELDS + 1)]
+    keep = [(i, name) for i, name in enumerate(names) if name not in RAW_IDENTIFIERS]
+
+    tmp = target + f".tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = {
+        name: np.lib.format.open_memmap(os.path.join(tmp, f"{name}.npy"), mode="w+",
+                                        dtype=np.float64, shape=(n_records,))
+        for _, name in keep
+    }
+    index = [i for i, _ in keep]
+    block, start = [], 0
+
+    def write_block():
+        X = np.array(block, dtype=np.float64)[:, index]
+        X[X == RAW_MISSING] = np.nan
+        for j, (_, name) in enumerate(keep):
+            columns[name][start:start + len(block)] = X[:, j]
+
+    for fields in iter_raw_records(path):
+        if len(fields) != n_fields:
+            continue
+        block.append(fields)
+        if len(block) >= 10000:
+            write_block()
+            start += len(block)
+            block = []
+    if block:
+        write_block()
+    for col in columns.values():
+        col.flush()
+
+    manifest = {
+        "format": RAW_CACHE_FORMAT,
+        "source": os.path.abspath(path),
+        "sha256": digest,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "n_records": n_records,
+        "n_fields": n_fields,
+        "columns": [name for _, name in keep],
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    logger.info("Cached %d raw records of %s in %s", n_records, path, target)
+    return manifest
+
+
+def load_raw(path, columns=None, cache_dir=None, mmap=True):
+    """
+    {thuộc tính: mảng float64 (NaN = thiếu)} của file raw, dựng cache nếu cần.
+    mmap=True: np.memmap read-only (zero-copy, dùng chung page cache giữa tiến trình).
+    """
+    target = raw_cache_path(path, cache_dir)
+    if not raw_cache_valid(path, cache_dir):
+        build_raw_cache(path, cache_dir)
+    manifest = _read_manifest(target)
+    columns = manifest["columns"] if columns is None else list(columns)
+    unknown = [c for c in columns if c not in manifest["columns"]]
+    if unknown:
+        raise ValueError(f"{path}: unknown raw attributes {', '.join(unknown)}")
+    return {
+        c: np.load(os.path.join(target, f"{c}.npy"), mmap_mode="r" if mmap else None)
+        for c in columns
+    }
+
+
+def raw_frame(path, columns=None, cache_dir=None):
+    """DataFrame (copy) các thuộc tính đã chọn của file raw"""
+    return pd.DataFrame(load_raw(path, columns, cache_dir=cache_dir, mmap=False))
+
+
+def iter_chunks(path, fmt=None, chunksize=10000, feature_order=FEATURES):
+    """DataFrame từng chunk, các cột feature_order là float (NaN = thiếu)"""
+    fmt = fmt or detect_format(path)
+    if fmt == "processed":
+        return read_processed(path, chunksize)
+    if fmt == "raw":
+        return read_raw(path, chunksize)
+    if fmt == "csv":
+        return read_csv(path, chunksize, feature_order)
+    raise ValueError(f"Unknown input format {fmt!r}")
+
+
+PROCESSED_FILES = ["processed.cleveland.data", "processed.hungarian.data",
+                   "processed.switzerland.data", "processed.va.data"]
+
+
+def load_processed(data_dir, names=PROCESSED_FILES, columns=None):
+    """
+    Gộp các file dữ liệu thành 1 DataFrame (thêm cột source = tên file).
+    File processed đọc từ text; file raw đọc các cột đã chọn từ cache .npy.
+    """
+    columns = columns or FEATURES + [TARGET]
+    frames = []
+    for name in names:
+        path = os.path.join(data_dir, name)
+        if detect_format(path) == "raw":
+            frames.append(raw_frame(path, columns).assign(source=name))
+            continue
+        for chunk in read_processed(path):
+            frames.append(chunk[columns].assign(source=name))
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,529 @@
+# ===============================
+# drift.py – theo dõi input drift so với phân bố dữ liệu huấn luyện
+# ===============================
+#
+# Mỗi phiên bản mô hình có drift_reference.json cạnh meta.json (ghi lúc train, hoặc
+# `manage.py drift_report --write-reference` cho mô hình đóng gói sẵn): sketch của dữ
+# liệu huấn luyện + cách chia bin của từng biến trong feature_order.
+#
+# Sketch có kích thước cố định, không phụ thuộc số lượt dự đoán:
+#   - moment: số dòng, số giá trị thiếu, tổng, tổng bình phương, min, max của từng biến
+#   - biến số: histogram theo các mốc cố định (phân vị 10%..90% của dữ liệu huấn luyện)
+#   - cp / thal / slope: đếm theo từng giá trị đã gặp lúc huấn luyện + 1 ô "khác"
+# Mọi trường đều cộng được với nhau, nên sketch của nhiều worker / nhiều khoảng thời
+# gian gộp lại bằng phép cộng.
+#
+# Mỗi request dự đoán chỉ append vector input vào 1 buffer nhỏ (FOLD_ROWS dòng, vài µs);
+# buffer đầy thì được gộp vào sketch trong RAM bằng 1 lần cập nhật vectorized. Cứ
+# DRIFT_FLUSH_SECONDS giây 1 luồng nền ghi sketch thành 1 dòng DriftSketch (theo giờ,
+# phiên bản) rồi làm mới: request không bao giờ chờ ghi DB. /api/drift/ và `manage.py drift_report` cộng các dòng trong khoảng
+# thời gian (+ phần chưa ghi của tiến trình hiện tại) và so với sketch tham chiếu bằng
+# PSI, KS (trên các bin) / total variation, độ lệch trung bình theo đơn vị độ lệch chuẩn.
+# Luồng ghi + lần ghi lúc thoát (atexit) dừng được bằng stop(); cả hai bỏ qua khi
+# DRIFT_MONITOR tắt hoặc bảng api_driftsketch chưa có / đã bị xoá (vd. DB test đã huỷ).
+
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_FORMAT = 1
+CATEGORICAL = ("cp", "thal", "slope")
+QUANTILES = np.linspace(0.1, 0.9, 9)
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+EPS = 1e-4   # tỉ lệ tối thiểu của 1 bin khi tính PSI (tránh log 0)
+FOLD_ROWS = 256   # số input đệm trước khi gộp vào sketch
+
+metrics.describe("heart_drift_observations_total", "counter", "Prediction inputs added to the drift sketches")
+metrics.describe("heart_drift_flushes_total", "counter", "Drift sketches written to the database")
+metrics.describe("heart_drift_psi", "gauge", "Population stability index of a feature at the last drift report")
+
+
+def enabled():
+    return getattr(settings, "DRIFT_MONITOR", True)
+
+
+# ===============================
+# Bố cục bin + sketch
+# ===============================
+class Layout:
+    """Cách chia bin của từng biến: biến số -> mốc (edges), biến phân loại -> giá trị"""
+
+    def __init__(self, feature_order, features):
+        self.feature_order = list(feature_order)
+        self.features = features   # {tên: {"kind": "numeric", "edges": [...]} | {"kind": "categorical", "values": [...]}}
+        self.kinds = [features[f]["kind"] for f in self.feature_order]
+        self.edges = [features[f].get("edges") for f in self.feature_order]
+        self.values = [features[f].get("values") for f in self.feature_order]
+        sizes = [len(e) + 1 if kind == "numeric" else len(v) + 1
+                 for kind, e, v in zip(self.kinds, self.edges, self.values)]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.intp)
+
+    @classmethod
+    def fit(cls, X, feature_order):
+        """Chia bin từ ma trận dữ liệu huấn luyện (n, n_features), NaN = thiếu"""
+        features = {}
+        for j, f in enumerate(feature_order):
+            col = X[:, j][~np.isnan(X[:, j])]
+            if f in CATEGORICAL:
+                features[f] = {"kind": "categorical", "values": sorted(float(v) for v in np.unique(col))}
+            else:
+                edges = np.unique(np.quantile(col, QUANTILES)) if len(col) else np.array([])
+                features[f] = {"kind": "numeric", "edges": [round(float(e), 6) for e in edges]}
+        return cls(feature_order, features)
+
+    def bins(self, j, col):
+        """cột không thiếu -> chỉ số bin toàn cục"""
+        if self.kinds[j] == "numeric":
+            return self.offsets[j] + np.searchsorted(self.edges[j], col, side="right")
+        values = np.asarray(self.values[j], dtype=float)
+        if not len(values):
+            return np.full(len(col), self.offsets[j], dtype=np.intp)
+        pos = np.minimum(np.searchsorted(values, col), len(values) - 1)
+        return self.offsets[j] + np.where(values[pos] == col, pos, len(values))
+
+    def labels(self, j):
+        """nhãn các bin của biến j (để hiển thị)"""
+        if self.kinds[j] == "categorical":
+            return [_fmt(v) for v in self.values[j]] + ["other"]
+        edges = self.edges[j]
+        if not edges:
+            return ["all"]
+        return ([f"<{_fmt(edges[0])}"] + [f"[{_fmt(a)},{_fmt(b)})" for a, b in zip(edges, edges[1:])]
+                + [f">={_fmt(edges[-1])}"])
+
+    def to_dict(self):
+        return {f: self.features[f] for f in self.feature_order}
+
+
+def _fmt(v):
+    return str(int(v)) if float(v).is_integer() else f"{v:g}"
+
+
+class Sketch:
+    """Sketch cộng được của 1 luồng input theo 1 Layout"""
+
+    def __init__(self, layout):
+        self.layout = layout
+        k = len(layout.feature_order)
+        self.n = 0
+        self.missing = np.zeros(k, dtype=np.int64)
+        self.total = np.zeros(k)
+        self.total_sq = np.zeros(k)
+        self.lo = np.full(k, np.inf)
+        self.hi = np.full(k, -np.inf)
+        self.counts = np.zeros(layout.offsets[-1], dtype=np.int64)
+
+    def update(self, X):
+        """ma trận (n, n_features) theo feature_order, NaN = thiếu"""
+        X = np.asarray(X, dtype=float).reshape(-1, len(self.layout.feature_order))
+        if not len(X):
+            return
+        present = ~np.isnan(X)
+        Z = np.where(present, X, 0.0)
+        self.n += len(X)
+        self.missing += (~present).sum(axis=0)
+        self.total += Z.sum(axis=0)
+        self.total_sq += (Z * Z).sum(axis=0)
+        self.lo = np.minimum(self.lo, np.where(present, X, np.inf).min(axis=0))
+        self.hi = np.maximum(self.hi, np.where(present, X, -np.inf).max(axis=0))
+        idx = np.concatenate([self.layout.bins(j, X[present[:, j], j]) for j in range(X.shape[1])])
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+
+    def merge(self, other):
+        self.n += other.n
+        self.missing += other.missing
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.lo = np.minimum(self.lo, other.lo)
+        self.hi = np.maximum(self.hi, other.hi)
+        self.counts += other.counts
+        return self
+
+    def to_dict(self):
+        return {
+            "n": self.n,
+            "missing": self.missing.tolist(),
+            "total": self.total.tolist(),
+            "total_sq": self.total_sq.tolist(),
+            "lo": [None if math.isinf(v) else v for v in self.lo.tolist()],
+            "hi": [None if math.isinf(v) else v for v in self.hi.tolist()],
+            "counts": self.counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, layout, data):
+        sketch = cls(layout)
+        if len(data["counts"]) != len(sketch.counts):
+            raise ValueError("sketch does not match the reference bin layout")
+        sketch.n = int(data["n"])
+        sketch.missing = np.asarray(data["missing"], dtype=np.int64)
+        sketch.total = np.asarray(data["total"], dtype=float)
+        sketch.total_sq = np.asarray(data["total_sq"], dtype=float)
+        sketch.lo = np.array([np.inf if v is None else v for v in data["lo"]], dtype=float)
+        sketch.hi = np.array([-np.inf if v is None else v for v in data["hi"]], dtype=float)
+        sketch.counts = np.asarray(data["counts"], dtype=np.int64)
+        return sketch
+
+
+# ===============================
+# Sketch tham chiếu (dữ liệu huấn luyện)
+# ===============================
+def build_reference(X, feature_order, source=None):
+    """ma trận dữ liệu huấn luyện -> dict ghi ra drift_reference.json"""
+    X = np.asarray(X, dtype=float)
+    layout = Layout.fit(X, feature_order)
+    sketch = Sketch(layout)
+    sketch.update(X)
+    return {
+        "format": REFERENCE_FORMAT,
+        "feature_order": list(feature_order),
+        "source": source,
+        "features": layout.to_dict(),
+        "sketch": sketch.to_dict(),
+    }
+
+
+def write_reference(path, reference):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(reference, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+class Reference:
+    def __init__(self, data):
+        if data.get("format") != REFERENCE_FORMAT:
+            raise ValueError(f"Unsupported drift reference format {data.get('format')!r}")
+        self.layout = Layout(data["feature_order"], data["features"])
+        self.sketch = Sketch.from_dict(self.layout, data["sketch"])
+        self.source = data.get("source")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+
+def load_reference(model_path, feature_order=None):
+    """Reference của 1 thư mục mô hình (drift_reference.json cạnh meta.json), None nếu không có"""
+    from .registry import DRIFT_REFERENCE_FILE
+    path = os.path.join(model_path, DRIFT_REFERENCE_FILE)
+    if not os.path.isfile(path):
+        return None
+    try:
+        reference = Reference.load(path)
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("Unreadable drift reference %s (%s); drift monitoring disabled", path, exc)
+        return None
+    if feature_order is not None and reference.layout.feature_order != list(feature_order):
+        logger.warning("Drift reference %s has a different feature_order; drift monitoring disabled", path)
+        return None
+    return reference
+
+
+# ===============================
+# Sketch trực tiếp theo tiến trình
+# ===============================
+class Monitor:
+    """Sketch chưa ghi DB của 1 phiên bản mô hình trong tiến trình này"""
+
+    def __init__(self, version, reference):
+        self.version = version
+        self.reference = reference
+        self._lock = threading.Lock()
+        self._sketch = Sketch(reference.layout)
+        self._rows = []   # input chưa gộp vào sketch, tối đa FOLD_ROWS dòng
+
+    def _fold(self):
+        # gọi khi đang giữ self._lock
+        if self._rows:
+            self._sketch.update(np.array(self._rows, dtype=float))
+            self._rows = []
+
+    def observe(self, records):
+        order = self.reference.layout.feature_order
+        rows = [[r.get(f) for f in order] for r in records]
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) >= FOLD_ROWS:
+                self._fold()
+
+    def pending(self):
+        with self._lock:
+            self._fold()
+            return Sketch(self.reference.layout).merge(self._sketch)
+
+    def flush(self):
+        """Ghi phần đã tích luỹ thành 1 dòng DriftSketch"""
+        from .models import DriftSketch
+        from .rollups import bucket_of
+
+        with self._lock:
+            self._fold()
+            sketch, self._sketch = self._sketch, Sketch(self.reference.layout)
+        if not sketch.n:
+            return 0
+        try:
+            DriftSketch.objects.create(bucket=bucket_of(timezone.now()), model_version=self.version,
+                                       count=sketch.n, sketch=sketch.to_dict())
+        except Exception:
+            # giữ lại để lần flush sau thử tiếp
+            with self._lock:
+                self._sketch.merge(sketch)
+            raise
+        metrics.inc("heart_drift_flushes_total")
+        return sketch.n
+
+
+_monitors = {}          # model_version -> Monitor | None (không có reference)
+_monitors_lock = threading.Lock()
+_monitors_pid = None
+_flusher = None
+
+
+class Flusher(threading.Thread):
+    """Ghi sketch mỗi DRIFT_FLUSH_SECONDS giây ngoài luồng request"""
+
+    def __init__(self, interval):
+        super().__init__(name="drift-flush", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                flush_all()
+            finally:
+                close_old_connections()
+
+
+def get_monitor(model):
+    global _monitors_pid, _flusher
+    if _monitors_pid != os.getpid():
+        # sau fork(): phần chưa ghi thuộc về tiến trình cha
+        with _monitors_lock:
+            if _monitors_pid != os.getpid():
+                _monitors.clear()
+                _monitors_pid = os.getpid()
+                # luồng nền không sống qua fork(): mỗi worker có luồng ghi riêng
+                _flusher = Flusher(max(float(getattr(settings, "DRIFT_FLUSH_SECONDS", 300)), 1.0))
+                _flusher.start()
+                atexit.register(flush_all)
+    monitor = _monitors.get(model.version, False)
+    if monitor is False:
+        with _monitors_lock:
+            monitor = _monitors.get(model.version, False)
+            if monitor is False:
+                reference = load_reference(model.path, model.feature_order)
+                monitor = _monitors[model.version] = Monitor(model.version, reference) if reference else None
+    return monitor
+
+
+def stop(flush=True):
+    """Dừng luồng ghi của tiến trình này và bỏ lần ghi lúc thoát; flush=False bỏ phần chưa ghi"""
+    global _monitors_pid, _flusher
+    atexit.unregister(flush_all)
+    flusher, _flusher = _flusher, None
+    if flusher is not None:
+        flusher.stopped.set()
+        flusher.join()
+    if flush:
+        flush_all()
+    with _monitors_lock:
+        _monitors.clear()
+        _monitors_pid = None
+
+
+def _table_ready():
+    from django.db import DatabaseError, connection
+    from .models import DriftSketch
+
+    try:
+        return DriftSketch._meta.db_table in connection.introspection.table_names()
+    except DatabaseError:
+        return False
+
+
+def flush_all():
+    if not enabled() or not any(_monitors.values()) or not _table_ready():
+        return 0
+    n = 0
+    for monitor in list(_monitors.values()):
+        if monitor is not None:
+            try:
+                n += monitor.flush()
+            except Exception:
+                logger.exception("Writing drift sketch for %s failed", monitor.version)
+    return n
+
+
+def observe(model, records):
+    """Thêm input (list[dict] đã validate) của 1 request vào sketch của `model`"""
+    if not enabled():
+        return
+    monitor = get_monitor(model)
+    if monitor is None:
+        return
+    monitor.observe(records)
+    metrics.inc("heart_drift_observations_total", len(records))
+
+
+def compact():
+    """Gộp các DriftSketch cùng (giờ, phiên bản) thành 1 dòng. Trả về (số dòng trước, số dòng sau)."""
+    from django.db import transaction
+    from .models import DriftSketch
+
+    with transaction.atomic():
+        groups = {}
+        for pk, bucket, version, count, data in DriftSketch.objects.order_by().values_list(
+                "id", "bucket", "model_version", "count", "sketch").iterator(chunk_size=500):
+            groups.setdefault((bucket, version), []).append((pk, count, data))
+        before = after = 0
+        for (bucket, version), rows in groups.items():
+            before += len(rows)
+            after += 1
+            if len(rows) == 1:
+                continue
+            merged = _merge_dicts([data for _, _, data in rows])
+            if merged is None:
+                after += len(rows) - 1   # layout khác nhau (reference đã đổi): giữ nguyên
+                continue
+            DriftSketch.objects.filter(id__in=[pk for pk, _, _ in rows]).delete()
+            DriftSketch.objects.create(bucket=bucket, model_version=version,
+                                       count=sum(count for _, count, _ in rows), sketch=merged)
+    return before, after
+
+
+def _merge_dicts(sketches):
+    """cộng các sketch dạng dict mà không cần Layout; None nếu khác số bin"""
+    if len({len(s["counts"]) for s in sketches}) != 1:
+        return None
+    out = {"n": sum(s["n"] for s in sketches)}
+    for key in ("missing", "total", "total_sq", "counts"):
+        out[key] = [sum(v) for v in zip(*(s[key] for s in sketches))]
+    out["lo"] = [min((v for v in vs if v is not None), default=None) for vs in zip(*(s["lo"] for s in sketches))]
+    out["hi"] = [max((v for v in vs if v is not None), default=None) for vs in zip(*(s["hi"] for s in sketches))]
+    return out
+
+
+# ===============================
+# So sánh với reference
+# ===============================
+def live_sketch(reference, version, start=None, end=None, include_pending=True):
+    """Cộng các DriftSketch của `version` trong [start, end) (+ phần chưa ghi của tiến trình này)"""
+    from .models import DriftSketch
+
+    rows = DriftSketch.objects.filter(model_version=version)
+    if start is not None:
+        rows = rows.filter(bucket__gte=start)
+    if end is not None:
+        rows = rows.filter(bucket__lt=end)
+    total = Sketch(reference.layout)
+    for data in rows.values_list("sketch", flat=True).iterator(chunk_size=500):
+        try:
+            total.merge(Sketch.from_dict(reference.layout, data))
+        except ValueError:
+            logger.warning("Skipping drift sketch with a different bin layout for %s", version)
+    monitor = _monitors.get(version) if _monitors_pid == os.getpid() else None
+    if include_pending and monitor is not None and monitor.reference.layout.offsets[-1] == len(total.counts):
+        total.merge(monitor.pending())
+    return total
+
+
+def _moments(sketch, j):
+    n = sketch.n - int(sketch.missing[j])
+    if n <= 0:
+        return 0, None, None
+    mean = sketch.total[j] / n
+    var = max(sketch.total_sq[j] / n - mean * mean, 0.0)
+    return n, mean, math.sqrt(var)
+
+
+def status_of(psi):
+    if psi is None:
+        return "insufficient_data"
+    if psi >= PSI_ALERT:
+        return "drift"
+    if psi >= PSI_WARN:
+        return "warn"
+    return "ok"
+
+
+def compare(reference, live, min_samples=None):
+    """PSI / KS / độ lệch moment của từng biến giữa sketch tham chiếu và sketch trực tiếp"""
+    if min_samples is None:
+        min_samples = getattr(settings, "DRIFT_MIN_SAMPLES", 100)
+    layout, ref = reference.layout, reference.sketch
+    features = {}
+    for j, f in enumerate(layout.feature_order):
+        lo, hi = layout.offsets[j], layout.offsets[j + 1]
+        e, a = ref.counts[lo:hi].astype(float), live.counts[lo:hi].astype(float)
+        n_ref, mean_ref, std_ref = _moments(ref, j)
+        n_live, mean_live, std_live = _moments(live, j)
+
+        psi = ks = tvd = None
+        if n_live >= min_samples and e.sum():
+            e, a = e / e.sum(), a / a.sum()
+            ec, ac = np.clip(e, EPS, None), np.clip(a, EPS, None)
+            psi = float(np.sum((ac - ec) * np.log(ac / ec)))
+            if layout.kinds[j] == "numeric":
+                ks = float(np.max(np.abs(np.cumsum(a) - np.cumsum(e))))
+            else:
+                tvd = float(0.5 * np.abs(a - e).sum())
+        features[f] = {
+            "kind": layout.kinds[j],
+            "psi": psi,
+            "ks": ks,
+            "tvd": tvd,
+            "status": status_of(psi),
+            "count": n_live,
+            "mean": mean_live,
+            "reference_mean": mean_ref,
+            "std": std_live,
+            "reference_std": std_ref,
+            "mean_shift": ((mean_live - mean_ref) / std_ref
+                           if mean_live is not None and mean_ref is not None and std_ref else None),
+            "missing_rate": float(live.missing[j] / live.n) if live.n else None,
+            "reference_missing_rate": float(ref.missing[j] / ref.n) if ref.n else None,
+            "min": None if math.isinf(live.lo[j]) else float(live.lo[j]),
+            "max": None if math.isinf(live.hi[j]) else float(live.hi[j]),
+            "bins": layout.labels(j),
+            "distribution": (a.tolist() if psi is not None else None),
+            "reference_distribution": (ref.counts[lo:hi] / max(ref.counts[lo:hi].sum(), 1)).tolist(),
+        }
+    return features
+
+
+def report(version, model_path, start=None, end=None):
+    """Báo cáo drift của phiên bản `version` trong [start, end); None nếu không có reference"""
+    reference = load_reference(model_path)
+    if reference is None:
+        return None
+    live = live_sketch(reference, version, start, end)
+    features = compare(reference, live)
+    psis = {f: r["psi"] for f, r in features.items() if r["psi"] is not None}
+    for f, psi in psis.items():
+        metrics.set_gauge("heart_drift_psi", psi, feature=f, version=version)
+    worst = max(psis, key=psis.get) if psis else None
+    return {
+        "model_version": version,
+        "reference": reference.source,
+        "reference_rows": reference.sketch.n,
+        "count": live.n,
+        "status": status_of(psis[worst] if worst else None),
+        "worst_feature": worst,
+        "features": features,
+    }
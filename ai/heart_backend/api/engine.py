@@ -0,0 +1,436 @@
+# ===============================
+# engine.py – bộ chấm điểm thuần NumPy cho mô hình LR đã calibrate
+# ===============================
+#
+# Pipeline sklearn đang phục vụ có dạng:
+#   Pipeline([("pre", ColumnTransformer(num: SimpleImputer+StandardScaler,
+#                                       cat: SimpleImputer+OneHotEncoder)),
+#             ("clf", CalibratedClassifierCV(LogisticRegression, isotonic, cv=5))])
+#
+# compile_pipeline() "làm phẳng" pipeline đã fit thành các mảng NumPy,
+# save_engine()/load_engine() ghi/đọc chúng dưới dạng thư mục các file .npy,
+# CompiledModel chấm điểm trực tiếp trên các mảng đó.
+# Đầu severity (LR multinomial mức độ 0–4, tuỳ chọn) dùng chung ma trận transform với
+# đầu nhị phân: predict_heads() chỉ transform 1 lần cho cả 2.
+# Mô hình theo cơ sở (api/cohorts.py, tuỳ chọn): fold LR + isotonic của từng cohort được
+# xếp chồng sau các fold của mô hình chung; mỗi dòng chỉ lấy K fold của route của nó.
+# Module này KHÔNG import pandas/sklearn để giữ request path thật nhẹ.
+
+import json
+import os
+
+import numpy as np
+
+from . import cohorts
+
+ENGINE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+
+ARRAY_NAMES = (
+    "num_index", "num_fill", "num_mean", "num_scale",
+    "cat_index", "cat_fill", "cat_values", "cat_offsets",
+    "coef", "intercept",
+    "iso_x", "iso_y", "iso_offsets",
+)
+# mảng tuỳ chọn (engine export cũ có thể không có)
+OPTIONAL_ARRAYS = (
+    "background_mean",   # E[z] của dữ liệu huấn luyện sau transform, dùng cho api/explain.py
+    "severity_coef", "severity_intercept", "severity_classes",   # compile_severity()
+    "cohort_coef", "cohort_intercept", "cohort_iso_x", "cohort_iso_y", "cohort_iso_offsets",
+    "route_index", "route_table",                                # compile_cohorts()
+)
+
+
+class CompiledModel:
+    """Mô hình đã biên dịch: imputer/scaler/one-hot + K fold LR + K isotonic."""
+
+    def __init__(self, manifest, arrays):
+        self.manifest = manifest
+        self.feature_order = list(manifest["feature_order"])
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        for name in OPTIONAL_ARRAYS:
+            setattr(self, name, arrays.get(name))
+
+        self.n_features = len(self.feature_order)
+        self.n_num = len(self.num_index)
+        self.n_out = self.coef.shape[1]
+        self.n_folds = self.coef.shape[0]
+        # cột one-hot thứ i ứng với biến category cat_owner[i]
+        self.cat_owner = np.repeat(np.arange(len(self.cat_index)), np.diff(self.cat_offsets))
+
+        # route 0 = mô hình chung, route c = manifest["cohorts"][c - 1]; K fold mỗi route
+        self.cohorts = list(manifest.get("cohorts", []))
+        coef, intercept = self.coef, self.intercept
+        iso_x, iso_y, iso_offsets = self.iso_x, self.iso_y, self.iso_offsets
+        if self.has_cohorts:
+            if self.cohort_coef.shape != (len(self.cohorts) * self.n_folds, self.n_out):
+                raise ValueError(f"cohort_coef has shape {self.cohort_coef.shape}, expected "
+                                 f"({len(self.cohorts)} cohorts x {self.n_folds} folds, {self.n_out})")
+            coef = np.vstack([coef, self.cohort_coef])
+            intercept = np.concatenate([intercept, self.cohort_intercept])
+            iso_x = np.concatenate([iso_x, self.cohort_iso_x])
+            iso_y = np.concatenate([iso_y, self.cohort_iso_y])
+            iso_offsets = np.concatenate([iso_offsets, self.cohort_iso_offsets[1:] + iso_offsets[-1]])
+        self.all_coef, self.all_intercept, self.all_iso_y = coef, intercept, iso_y
+        self.route_folds = np.arange(len(coef)).reshape(-1, self.n_folds)
+
+        # Gộp mọi đường isotonic thành 1 lần np.interp: kẹp logit của fold k vào
+        # [lo_k, hi_k] rồi tịnh tiến trục x của fold k đi shift_k để các đoạn không chồng nhau.
+        starts, ends = iso_offsets[:-1], iso_offsets[1:] - 1
+        self.all_iso_lo = iso_x[starts]
+        self.all_iso_hi = iso_x[ends]
+        width = self.all_iso_hi - self.all_iso_lo + 1.0
+        self.all_iso_shift = np.concatenate([[0.0], np.cumsum(width)[:-1]]) - self.all_iso_lo
+        self.iso_xs = iso_x + np.repeat(self.all_iso_shift, np.diff(iso_offsets))
+        # K fold đầu là mô hình chung
+        self.iso_lo = self.all_iso_lo[:self.n_folds]
+        self.iso_hi = self.all_iso_hi[:self.n_folds]
+        self.iso_shift = self.all_iso_shift[:self.n_folds]
+
+    # -------------------------------
+    # Input
+    # -------------------------------
+    def to_matrix(self, records):
+        """list[dict] -> ma trận float (n, n_features) theo feature_order, None -> NaN"""
+        order = self.feature_order
+        return np.array([[r.get(f) for f in order] for r in records], dtype=float).reshape(-1, self.n_features)
+
+    # -------------------------------
+    # Route theo cơ sở (api/cohorts.py)
+    # -------------------------------
+    @property
+    def has_cohorts(self):
+        return self.cohort_coef is not None and len(self.cohorts) > 0
+
+    def route(self, X, sites=None):
+        """Chỉ số route (n,) của từng dòng; None nếu không có mô hình cohort"""
+        if not self.has_cohorts:
+            return None
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        return cohorts.route(X, self.route_index, self.route_table, self.cohorts, sites)
+
+    def route_names(self, routes):
+        names = [cohorts.GLOBAL] + self.cohorts
+        return [names[r] for r in routes] if routes is not None else None
+
+    def _folds(self, route):
+        """các fold của 1 route: route_folds là arange liên tiếp nên lấy slice (view, không copy)"""
+        return slice(route * self.n_folds, (route + 1) * self.n_folds)
+
+    @staticmethod
+    def _squeeze(routes):
+        """mọi dòng cùng 1 route (luôn đúng với 1 dòng) -> số nguyên, khỏi gather theo từng dòng"""
+        if routes is None or len(routes) == 0:
+            return None
+        first = int(routes[0])
+        return first if len(routes) == 1 or (routes == first).all() else routes
+
+    # -------------------------------
+    # Preprocess (tương đương ColumnTransformer.transform)
+    # -------------------------------
+    def transform(self, X):
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        Z = np.empty((X.shape[0], self.n_out))
+
+        num = X[:, self.num_index]
+        num = np.where(np.isnan(num), self.num_fill, num)
+        Z[:, :self.n_num] = (num - self.num_mean) / self.num_scale
+
+        cat = X[:, self.cat_index]
+        cat = np.where(np.isnan(cat), self.cat_fill, cat)
+        # handle_unknown="ignore": giá trị lạ -> toàn 0
+        Z[:, self.n_num:] = cat[:, self.cat_owner] == self.cat_values
+        return Z
+
+    # -------------------------------
+    # LR + isotonic cho từng fold
+    # -------------------------------
+    def decision_function(self, Z, routes=None):
+        """
+        (n, n_out) -> (n, n_folds) logit của từng fold. routes: None (mô hình chung), 1 route
+        cho mọi dòng (int) hoặc mảng route (n,).
+        """
+        if routes is None:
+            return Z @ self.coef.T + self.intercept
+        if np.ndim(routes) == 0:
+            folds = self._folds(routes)
+            return Z @ self.all_coef[folds].T + self.all_intercept[folds]
+        # mọi cohort trong 1 phép nhân ma trận, rồi mỗi dòng lấy K cột của route của nó
+        D = Z @ self.all_coef.T + self.all_intercept
+        return np.take_along_axis(D, self.route_folds[routes], axis=1)
+
+    def calibrate(self, D, routes=None):
+        """(n, n_folds) logit -> (n, n_folds) xác suất đã calibrate của từng fold"""
+        if routes is None:
+            lo, hi, shift = self.iso_lo, self.iso_hi, self.iso_shift
+        else:
+            folds = self._folds(routes) if np.ndim(routes) == 0 else self.route_folds[routes]
+            lo, hi, shift = self.all_iso_lo[folds], self.all_iso_hi[folds], self.all_iso_shift[folds]
+        D = np.clip(D, lo, hi) + shift
+        P = np.interp(D, self.iso_xs, self.all_iso_y)
+        P[(P > 1.0) & (P <= 1.0 + 1e-5)] = 1.0
+        return P
+
+    def predict_positive(self, X, routes=None):
+        """
+        Xác suất lớp 1 (có bệnh), shape (n,). Có mô hình cohort: routes=None thì route theo
+        mẫu thiếu của X.
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        if routes is None:
+            routes = self.route(X)
+        routes = self._squeeze(routes)
+        return self.calibrate(self.decision_function(self.transform(X), routes), routes).mean(axis=1)
+
+    def predict_proba(self, X):
+        """Giống sklearn: shape (n, 2)"""
+        p = self.predict_positive(X)
+        return np.column_stack([1.0 - p, p])
+
+    def predict_records(self, records):
+        X = self.to_matrix(records)
+        return self.predict_positive(X, self.route_records(X, records))
+
+    def route_records(self, X, records):
+        """route của list[dict] đã đổi sang X: ưu tiên trường "site" của từng dòng"""
+        if not self.has_cohorts:
+            return None
+        return self.route(X, [r.get("site") for r in records])
+
+    # -------------------------------
+    # Lưới counterfactual (api/whatif.py)
+    # -------------------------------
+    def grid_positive(self, x, axes, route=None):
+        """
+        Xác suất lớp 1 trên lưới: x là 1 dòng (n_features,), axes = [(cột, mảng giá trị), ...].
+        Trả về mảng shape (len(v1), len(v2), ...).
+
+        Mỗi cột được transform độc lập và logit tuyến tính theo Z, nên logit của 1 điểm
+        lưới = logit(x) + tổng phần thay đổi của từng trục: chỉ transform sum(len(v))
+        dòng thay vì prod(len(v)) dòng, rồi cộng broadcast + 1 lần calibrate.
+        Cả lưới dùng 1 route (route=None: route của x), vì các trục không đổi mẫu thiếu.
+        """
+        x = np.asarray(x, dtype=float).reshape(1, self.n_features)
+        if route is None and self.has_cohorts:
+            route = int(self.route(x)[0])
+        folds = self._folds(route or 0)
+        coef = self.all_coef[folds]
+        z0 = self.transform(x)
+        D = (z0 @ coef.T + self.all_intercept[folds])[0]
+        shape = [len(values) for _, values in axes]
+        for a, (col, values) in enumerate(axes):
+            X = np.repeat(x, len(values), axis=0)
+            X[:, col] = values
+            delta = (self.transform(X) - z0) @ coef.T
+            view = [1] * len(axes) + [self.n_folds]
+            view[a] = len(values)
+            D = D + delta.reshape(view)
+        D = np.broadcast_to(D, shape + [self.n_folds]).reshape(-1, self.n_folds)
+        return self.calibrate(D, route or None).mean(axis=1).reshape(shape)
+
+    # -------------------------------
+    # Đầu severity (multinomial)
+    # -------------------------------
+    @property
+    def has_severity(self):
+        return self.severity_coef is not None
+
+    def severity_proba(self, Z):
+        """(n, n_out) đã transform -> (n, n_classes) phân phối mức độ (softmax)"""
+        S = Z @ self.severity_coef.T + self.severity_intercept
+        S -= S.max(axis=1, keepdims=True)
+        np.exp(S, out=S)
+        S /= S.sum(axis=1, keepdims=True)
+        return S
+
+    def predict_heads(self, X, routes=None):
+        """1 lần transform -> (xác suất lớp 1 (n,), phân phối severity (n, k) hoặc None)"""
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        if routes is None:
+            routes = self.route(X)
+        routes = self._squeeze(routes)
+        Z = self.transform(X)
+        p = self.calibrate(self.decision_function(Z, routes), routes).mean(axis=1)
+        return p, (self.severity_proba(Z) if self.has_severity else None)
+
+
+# ===============================
+# Biên dịch pipeline sklearn đã fit -> mảng NumPy
+# ===============================
+
+def _find_step(pipe, cls_name):
+    for _, step in getattr(pipe, "steps", []):
+        if type(step).__name__ == cls_name:
+            return step
+    return None
+
+
+def compile_pipeline(pipeline, feature_order):
+    """Trích các tham số đã fit của pipeline thành (manifest, arrays)."""
+    steps = dict(getattr(pipeline, "steps", []))
+    pre, clf = steps.get("pre"), steps.get("clf")
+    if pre is None or clf is None:
+        raise ValueError("Expected Pipeline([('pre', ColumnTransformer), ('clf', CalibratedClassifierCV)])")
+
+    index = {f: i for i, f in enumerate(feature_order)}
+    num_index, num_fill, num_mean, num_scale = [], [], [], []
+    cat_index, cat_fill, cat_values, cat_offsets = [], [], [], [0]
+    num_cols, cat_cols = [], []
+
+    for name, trans, cols in pre.transformers_:
+        if name == "remainder":
+            if trans != "drop":
+                raise ValueError("ColumnTransformer remainder must be 'drop'")
+            continue
+        imputer = _find_step(trans, "SimpleImputer")
+        scaler = _find_step(trans, "StandardScaler")
+        onehot = _find_step(trans, "OneHotEncoder")
+        if imputer is None:
+            raise ValueError(f"Transformer {name!r} has no SimpleImputer")
+
+        if onehot is not None:
+            if onehot.drop is not None or getattr(onehot, "_infrequent_enabled", False):
+                raise ValueError("OneHotEncoder with drop/infrequent categories is not supported")
+            for col, fill, cats in zip(cols, imputer.statistics_, onehot.categories_):
+                cat_cols.append(col)
+                cat_index.append(index[col])
+                cat_fill.append(float(fill))
+                cat_values.extend(float(c) for c in cats)
+                cat_offsets.append(len(cat_values))
+        elif scaler is not None:
+            mean = scaler.mean_ if scaler.with_mean else np.zeros(len(cols))
+            scale = scaler.scale_ if scaler.with_std else np.ones(len(cols))
+            for col, fill, m, s in zip(cols, imputer.statistics_, mean, scale):
+                num_cols.append(col)
+                num_index.append(index[col])
+                num_fill.append(float(fill))
+                num_mean.append(float(m))
+                num_scale.append(float(s))
+        else:
+            raise ValueError(f"Transformer {name!r} must end with StandardScaler or OneHotEncoder")
+
+    # ColumnTransformer đặt khối num trước khối cat (như make_preprocess())
+    first = pre.transformers_[0]
+    if cat_cols and num_cols and _find_step(first[1], "OneHotEncoder") is not None:
+        raise ValueError("Numeric transformer must come before the categorical one")
+
+    coef, intercept, iso_x, iso_y, iso_offsets = _compile_folds(clf)
+    arrays = {
+        "num_index": np.array(num_index, dtype=np.intp),
+        "num_fill": np.array(num_fill),
+        "num_mean": np.array(num_mean),
+        "num_scale": np.array(num_scale),
+        "cat_index": np.array(cat_index, dtype=np.intp),
+        "cat_fill": np.array(cat_fill),
+        "cat_values": np.array(cat_values),
+        "cat_offsets": np.array(cat_offsets, dtype=np.intp),
+        "coef": coef,
+        "intercept": intercept,
+        "iso_x": iso_x,
+        "iso_y": iso_y,
+        "iso_offsets": iso_offsets,
+    }
+    manifest = {
+        "format": ENGINE_FORMAT,
+        "feature_order": list(feature_order),
+        "num_cols": num_cols,
+        "cat_cols": cat_cols,
+        "n_folds": len(coef),
+    }
+    return manifest, arrays
+
+
+def _compile_folds(clf):
+    """CalibratedClassifierCV(LogisticRegression, isotonic) -> (coef, intercept, iso_x, iso_y, iso_offsets)"""
+    if getattr(clf, "method", None) != "isotonic":
+        raise ValueError(f"Only isotonic calibration is supported, got {getattr(clf, 'method', None)!r}")
+    coef, intercept, iso_x, iso_y, iso_offsets = [], [], [], [], [0]
+    for cc in clf.calibrated_classifiers_:
+        est = cc.estimator
+        if type(est).__name__ != "LogisticRegression" or est.coef_.shape[0] != 1:
+            raise ValueError("Only binary LogisticRegression base estimators are supported")
+        coef.append(est.coef_[0])
+        intercept.append(est.intercept_[0])
+        cal = cc.calibrators[0]
+        iso_x.extend(cal.X_thresholds_)
+        iso_y.extend(cal.y_thresholds_)
+        iso_offsets.append(len(iso_x))
+    return (np.array(coef), np.array(intercept), np.array(iso_x, dtype=float),
+            np.array(iso_y, dtype=float), np.array(iso_offsets, dtype=np.intp))
+
+
+def compile_cohorts(bundle, feature_order, n_out, n_folds):
+    """
+    Mô hình theo cơ sở (training.fit_cohorts) -> (tên các cohort, mảng cohort_* + route_*).
+    Mọi cohort phải là LR calibrate isotonic với đúng n_folds fold trên n_out cột transform.
+    """
+    names = list(bundle["names"])
+    parts = []
+    for name, clf in zip(names, bundle["models"]):
+        coef, intercept, iso_x, iso_y, iso_offsets = _compile_folds(clf)
+        if coef.shape != (n_folds, n_out):
+            raise ValueError(f"Cohort {name!r} has coef of shape {coef.shape}, expected ({n_folds}, {n_out})")
+        parts.append((coef, intercept, iso_x, iso_y, iso_offsets))
+    if not parts:
+        return names, {}
+    # offset isotonic nối tiếp nhau giữa các cohort
+    offsets = [np.array([0], dtype=np.intp)]
+    total = 0
+    for *_, iso_offsets in parts:
+        offsets.append(iso_offsets[1:] + total)
+        total += iso_offsets[-1]
+    return names, {
+        "cohort_coef": np.vstack([p[0] for p in parts]),
+        "cohort_intercept": np.concatenate([p[1] for p in parts]),
+        "cohort_iso_x": np.concatenate([p[2] for p in parts]),
+        "cohort_iso_y": np.concatenate([p[3] for p in parts]),
+        "cohort_iso_offsets": np.concatenate(offsets),
+        "route_index": np.array([list(feature_order).index(f) for f in bundle["route_features"]], dtype=np.intp),
+        "route_table": np.asarray(bundle["route_table"], dtype=np.intp),
+    }
+
+
+def compile_severity(clf, n_out):
+    """LogisticRegression multinomial đã fit trên pre.transform(X) -> các mảng severity_*"""
+    if type(clf).__name__ != "LogisticRegression":
+        raise ValueError(f"Severity head must be a LogisticRegression, got {type(clf).__name__}")
+    coef = np.asarray(clf.coef_, dtype=float)
+    if len(clf.classes_) < 3 or coef.shape != (len(clf.classes_), n_out):
+        raise ValueError(f"Severity head must be multinomial over {n_out} transformed columns, "
+                         f"got coef_ of shape {coef.shape}")
+    if getattr(clf, "multi_class", "auto") == "ovr":
+        raise ValueError("One-vs-rest severity heads are not supported")
+    return {
+        "severity_coef": coef,
+        "severity_intercept": np.asarray(clf.intercept_, dtype=float),
+        "severity_classes": np.asarray(clf.classes_, dtype=float),
+    }
+
+
+# ===============================
+# Lưu / nạp
+# ===============================
+
+def save_engine(path, manifest, arrays):
+    os.makedirs(path, exist_ok=True)
+    for name in ARRAY_NAMES + OPTIONAL_ARRAYS:
+        if arrays.get(name) is not None:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+    with open(os.path.join(path, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def load_engine(path, mmap_mode=None):
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ENGINE_FORMAT:
+        raise ValueError(f"Unsupported engine format {manifest.get('format')!r} in {path}")
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in ARRAY_NAMES
+    }
+    for name in OPTIONAL_ARRAYS:
+        if os.path.exists(os.path.join(path, f"{name}.npy")):
+            arrays[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+    return CompiledModel(manifest, arrays)
@@ -0,0 +1,91 @@
+# ===============================
+# explain.py – giải thích SHAP cho mô hình LR đã biên dịch
+# ===============================
+#
+# Mô hình phục vụ là trung bình K fold LR + isotonic. Phần tuyến tính (logit trung
+# bình của K fold) có SHAP dạng đóng (LinearExplainer, giả định biến độc lập):
+#     phi_j = w_j * (z_j - E[z_j]),   w = trung bình coef của K fold
+# nên không cần thư viện shap hay lấy mẫu: 1 phép nhân ma trận cho cả batch.
+# Các cột sau transform (6 cột số + 19 cột one-hot) được cộng dồn về 13 biến gốc
+# qua ma trận gộp G. Giá trị trả về ở thang logit: base_value + sum(phi) = logit
+# trung bình; isotonic chỉ đơn điệu hoá nên thứ tự/ dấu ảnh hưởng được giữ nguyên.
+#
+# E[z] (background_mean) được export_engine tính sẵn từ dữ liệu huấn luyện;
+# engine cũ không có mảng này thì tính lại từ processed.cleveland.data lúc nạp.
+
+import os
+
+import numpy as np
+from django.conf import settings
+
+BACKGROUND_FILE = os.path.join("data", "heart+disease", "processed.cleveland.data")
+
+
+def background_matrix(n_features):
+    """Dữ liệu huấn luyện thô (n, n_features), NaN = thiếu"""
+    path = os.path.join(settings.BASE_DIR.parent, BACKGROUND_FILE)
+    X = np.genfromtxt(path, delimiter=",", missing_values="?", filling_values=np.nan)
+    return X[:, :n_features]
+
+
+def _background_from_data(engine):
+    return engine.transform(background_matrix(engine.n_features)).mean(axis=0)
+
+
+class LinearExplainer:
+    """SHAP dạng đóng trên logit trung bình của các fold LR."""
+
+    def __init__(self, engine, background_mean=None):
+        self.engine = engine
+        self.feature_order = engine.feature_order
+        if background_mean is None:
+            background_mean = engine.background_mean
+        if background_mean is None:
+            background_mean = _background_from_data(engine)
+        self.mu = np.asarray(background_mean, dtype=float)
+        # trọng số trung bình các fold của từng route (0 = mô hình chung, rồi các cohort)
+        self.W = np.asarray(engine.all_coef, dtype=float)[engine.route_folds].mean(axis=1)
+        self.base_values = engine.all_intercept[engine.route_folds].mean(axis=1) + self.W @ self.mu
+        self.w = self.W[0]
+        self.base_value = float(self.base_values[0])
+
+        # G[c, j] = 1 nếu cột transform c thuộc biến gốc j
+        G = np.zeros((engine.n_out, engine.n_features))
+        G[np.arange(engine.n_num), engine.num_index] = 1.0
+        G[engine.n_num + np.arange(len(engine.cat_owner)), engine.cat_index[engine.cat_owner]] = 1.0
+        self.G = G
+
+    def explain(self, X, routes=None):
+        """(n, n_features) -> phi (n, n_features) ở thang logit của mô hình route từng dòng"""
+        Z = self.engine.transform(X)
+        w = self.w if routes is None else self.W[routes]
+        return ((Z - self.mu) * w) @ self.G
+
+    def top(self, phi, k=3):
+        """Tên k biến có |phi| lớn nhất cho từng dòng"""
+        order = np.argsort(-np.abs(phi), axis=1, kind="stable")[:, :k]
+        names = np.asarray(self.feature_order)
+        return names[order].tolist()
+
+    def explain_records(self, records, k=3):
+        """list[dict] -> list các dict giải thích (dùng cho response API)"""
+        X = self.engine.to_matrix(records)
+        routes = self.engine.route_records(X, records)
+        phi = self.explain(X, routes)
+        tops = self.top(phi, k)
+        bases = [self.base_value] * len(phi) if routes is None else self.base_values[routes].tolist()
+        return [
+            {
+                "base_value": base,
+                "contributions": dict(zip(self.feature_order, row)),
+                "top": top,
+            }
+            for row, top, base in zip(phi.tolist(), tops, bases)
+        ]
+
+
+def build_explainer(model):
+    """LinearExplainer cho ServedModel; pipeline sklearn được biên dịch tạm sang engine."""
+    if model.compiled is None:
+        return None
+    return LinearExplainer(model.compiled)
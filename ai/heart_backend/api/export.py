@@ -0,0 +1,231 @@
+# ===============================
+# export.py – xuất toàn bộ History dạng luồng (CSV / NDJSON / Parquet)
+# ===============================
+#
+# Dùng cho /api/history/export/ (StreamingHttpResponse) và `manage.py export_history`.
+# Đọc History theo id tăng dần bằng server-side cursor (QuerySet.iterator(chunk_size)),
+# mã hoá từng chunk rồi yield ngay: bộ nhớ không phụ thuộc số dòng của bảng.
+#
+#   - lọc theo khoảng created_at [start, end) và user
+#   - after_id: tiếp tục từ id cuối cùng đã nhận (mọi định dạng đều có cột id)
+#   - gzip=True: nén luồng bằng zlib (file .gz đầy đủ, giải nén bằng gunzip)
+#   - Parquet cần pyarrow (tuỳ chọn); mỗi chunk là 1 row group
+#   - chạy dưới ASGI: aiter_stream() biến luồng thành async iterator, nếu không Django
+#     gom cả luồng đồng bộ vào RAM (sync_to_async(list)) trước khi gửi byte đầu tiên
+
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from .models import History, Recommendation
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COLUMNS = (("id", "uid", "user_id", "created_at", "model_version") + History.FEATURES
+           + ("probability", "risk", "recommendations"))
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def history_queryset(start=None, end=None, user_id=None, after_id=None):
+    rows = History.objects.all()
+    if start is not None:
+        rows = rows.filter(created_at__gte=start)
+    if end is not None:
+        rows = rows.filter(created_at__lt=end)
+    if user_id is not None:
+        rows = rows.filter(user_id=user_id)
+    if after_id is not None:
+        rows = rows.filter(id__gt=after_id)
+    return rows.order_by("id")
+
+
+def iter_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    list các tuple theo COLUMNS, tối đa chunk_size dòng mỗi list.
+    progress (dict): cập nhật "rows" và "last_id" sau mỗi chunk.
+    """
+    names = [c if c != "recommendations" else "recommendation_ids" for c in COLUMNS]
+    texts_for = Recommendation.objects.texts_for
+    chunk = []
+    rows = queryset.values_list(*names).iterator(chunk_size=chunk_size)
+    while True:
+        for row in rows:
+            # cột cuối là recommendation_ids -> câu khuyến nghị
+            chunk.append(row[:-1] + (texts_for(row[-1]),))
+            if len(chunk) >= chunk_size:
+                break
+        if not chunk:
+            return
+        if progress is not None:
+            progress["rows"] = progress.get("rows", 0) + len(chunk)
+            progress["last_id"] = chunk[-1][0]
+        yield chunk
+        chunk = []
+
+
+# -------------------------------
+# Bộ mã hoá: chunk dòng -> bytes
+# -------------------------------
+def _encode_csv(chunks, header=True):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(COLUMNS)
+    for chunk in chunks:
+        for row in chunk:
+            writer.writerow(row[:1] + (str(row[1]), row[2], row[3].isoformat()) + row[4:-1]
+                            + (" | ".join(row[-1]),))
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def _encode_ndjson(chunks, header=True):
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    for chunk in chunks:
+        lines = []
+        for row in chunk:
+            item = dict(zip(COLUMNS, row))
+            item["uid"] = str(item["uid"])
+            item["created_at"] = item["created_at"].isoformat()
+            lines.append(dumps(item))
+        lines.append("")
+        yield "\n".join(lines).encode()
+
+
+class _Sink(io.RawIOBase):
+    """file-like chỉ ghi cho ParquetWriter; drain() lấy phần đã ghi ra"""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        out, self._parts = b"".join(self._parts), []
+        return out
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _encode_parquet(chunks, header=True):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    int_columns = ("id", "user_id") + History.INT_FEATURES
+    schema = pa.schema(
+        [(c, pa.int64()) if c in int_columns
+         else (c, pa.timestamp("us", tz="UTC")) if c == "created_at"
+         else (c, pa.list_(pa.string())) if c == "recommendations"
+         else (c, pa.string()) if c in ("uid", "model_version", "risk")
+         else (c, pa.float64())
+         for c in COLUMNS])
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            columns[1] = [str(u) for u in columns[1]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+ENCODERS = {"csv": _encode_csv, "ndjson": _encode_ndjson, "parquet": _encode_parquet}
+
+
+def _gzip(stream, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)   # wbits=31: định dạng gzip
+    for data in stream:
+        out = compressor.compress(data)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def stream(fmt, queryset, gzip=False, chunk_size=DEFAULT_CHUNK_SIZE, header=True, progress=None):
+    """
+    Luồng bytes của `queryset` theo định dạng `fmt`. ValueError nếu định dạng không dùng được.
+    header=False: bỏ dòng tiêu đề CSV (nối tiếp vào file đã có).
+    """
+    if fmt not in ENCODERS:
+        raise ValueError(f"format must be one of {', '.join(ENCODERS)}")
+    if fmt == "parquet":
+        if not parquet_available():
+            raise ValueError("Parquet export requires pyarrow, which is not installed")
+        if gzip:
+            raise ValueError("Parquet is already compressed; gzip is only for csv/ndjson")
+    out = (data for data in ENCODERS[fmt](iter_chunks(queryset, chunk_size, progress), header=header) if data)
+    return _gzip(out) if gzip else out
+
+
+async def aiter_stream(stream):
+    """
+    Async iterator trên luồng đồng bộ của stream(): mỗi bước (đọc cursor + mã hoá 1 chunk)
+    chạy qua sync_to_async trên cùng 1 luồng (cursor phía server gắn với connection của luồng đó).
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    while True:
+        data = await step(stream, None)
+        if data is None:
+            return
+        yield data
+
+
+def filename(fmt, gzip=False, stamp=None):
+    name = f"history-{stamp}" if stamp else "history"
+    return f"{name}.{FORMATS[fmt][1]}" + (".gz" if gzip else "")
+
+
+def resume_point(path, fmt):
+    """
+    File CSV/NDJSON chưa nén đang xuất dở -> id của dòng hoàn chỉnh cuối cùng (None nếu
+    chưa có dòng dữ liệu nào). Dòng cuối bị cắt ngang (tiến trình chết giữa chừng) được
+    xoá khỏi file để ghi nối tiếp.
+    """
+    with open(path, "rb+") as f:
+        f.seek(0, io.SEEK_END)
+        pos = f.tell()
+        block = b""
+        # đọc ngược từng khối tới khi có 2 ký tự xuống dòng (1 dòng hoàn chỉnh) hoặc hết file
+        while pos > 0 and block.count(b"\n") < 2:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step) + block
+        cut = block.rfind(b"\n")
+        complete = block[:cut] if cut >= 0 else b""
+        f.truncate(pos + cut + 1 if cut >= 0 else 0)
+    line = complete.rsplit(b"\n", 1)[-1].decode()
+    if not line:
+        return None
+    if fmt == "ndjson":
+        return int(json.loads(line)["id"])
+    first = next(csv.reader([line]))[0]
+    return int(first) if first.isdigit() else None
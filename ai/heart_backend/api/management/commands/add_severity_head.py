@@ -0,0 +1,66 @@
+import json
+import os
+
+import joblib
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api import registry
+from api.training import severity_for
+
+from .train import DATA_DIR
+
+
+class Command(BaseCommand):
+    help = "Fit the multi-class severity head for an existing model version and re-export its engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-version", help="default: every version without a severity head")
+        parser.add_argument("--data-dir", default=DATA_DIR)
+        parser.add_argument("--files", nargs="+", help="default: the datasets the version was trained on "
+                                                       "(processed.cleveland.data if unknown)")
+        parser.add_argument("--seed", type=int, help="default: the version's training seed (42 if unknown)")
+        parser.add_argument("--force", action="store_true", help="refit an existing severity head")
+
+    def handle(self, *args, **opts):
+        versions = registry.discover_versions()
+        if opts["model_version"]:
+            if opts["model_version"] not in versions:
+                raise CommandError(f"Unknown model version {opts['model_version']!r}")
+            targets = [opts["model_version"]]
+        else:
+            targets = sorted(versions, key=registry._version_key)
+
+        for version in targets:
+            path = versions[version]
+            meta_path = os.path.join(path, registry.META_FILE)
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("severity") and not opts["force"]:
+                self.stdout.write(f"{version}: already has a severity head, skipping (use --force)")
+                continue
+
+            training = meta.get("training", {})
+            files = opts["files"] or training.get("datasets") or ["processed.cleveland.data"]
+            seed = opts["seed"] if opts["seed"] is not None else training.get("seed", 42)
+            pipeline = joblib.load(os.path.join(path, registry.MODEL_FILE))
+            severity, report = severity_for(pipeline, opts["data_dir"], files=files, seed=seed)
+            self.stdout.write(f"{version}: val F1-macro={report['val_f1_macro']:.4f} "
+                              f"test F1-macro={report['test_f1_macro']:.4f}")
+
+            joblib.dump(severity, os.path.join(path, registry.SEVERITY_FILE))
+            meta["severity"] = {"file": registry.SEVERITY_FILE, "classes": report["classes"], "report": report}
+
+            # engine mới phải có mặt trước khi meta.json đổi (watcher của registry theo dõi mtime)
+            tmp = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            try:
+                if os.path.isdir(os.path.join(path, registry.ENGINE_DIR)):
+                    call_command("export_engine", model=os.path.join(path, registry.MODEL_FILE), meta=tmp,
+                                 out=os.path.join(path, registry.ENGINE_DIR), stdout=self.stdout)
+                os.replace(tmp, meta_path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.stdout.write(self.style.SUCCESS(f"Added severity head to {version} ({path})"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api import drift, shadow
+from api.rollups import compact
+
+
+class Command(BaseCommand):
+    help = ("Merge per-insert rollup deltas into one row per (hour, risk, age band), drift sketches "
+            "into one row per (hour, model version) and shadow aggregates into one row per "
+            "(hour, live version, candidate); run periodically")
+
+    def handle(self, *args, **opts):
+        before, after = compact()
+        self.stdout.write(self.style.SUCCESS(f"Compacted {before} rollup rows into {after}"))
+        before, after = drift.compact()
+        self.stdout.write(self.style.SUCCESS(f"Compacted {before} drift sketch rows into {after}"))
+        before, after = shadow.compact()
+        self.stdout.write(self.style.SUCCESS(f"Compacted {before} shadow aggregate rows into {after}"))
@@ -0,0 +1,67 @@
+import json
+import os
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import drift, registry
+from api.datasets import FEATURES, load_processed
+
+from .train import DATA_DIR
+
+
+class Command(BaseCommand):
+    help = "Compare recent prediction inputs with the training distribution (PSI / KS per feature)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-version", help="default: the version currently targeted by the registry")
+        parser.add_argument("--hours", type=float, default=24.0, help="look-back window")
+        parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+        parser.add_argument("--fail-on-drift", action="store_true", help="exit with code 1 if any feature drifted")
+        parser.add_argument("--write-reference", action="store_true",
+                            help="(re)build drift_reference.json for the version from --files instead of reporting")
+        parser.add_argument("--data-dir", default=DATA_DIR)
+        parser.add_argument("--files", nargs="+", default=["processed.cleveland.data"],
+                            help="training data for --write-reference")
+
+    def handle(self, *args, **opts):
+        versions = registry.discover_versions()
+        version = opts["model_version"] or registry.target_version(versions)
+        if version not in versions:
+            raise CommandError(f"Unknown model version {version!r}")
+        path = versions[version]
+
+        if opts["write_reference"]:
+            X = load_processed(opts["data_dir"], opts["files"])[FEATURES].to_numpy(dtype=float)
+            reference = drift.build_reference(X, FEATURES, source="+".join(opts["files"]))
+            out = os.path.join(path, registry.DRIFT_REFERENCE_FILE)
+            drift.write_reference(out, reference)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {out} ({len(X)} rows)"))
+            return
+
+        end = timezone.now()
+        result = drift.report(version, path, end - timedelta(hours=opts["hours"]), end)
+        if result is None:
+            raise CommandError(f"Model {version} has no {registry.DRIFT_REFERENCE_FILE}; "
+                               "rerun with --write-reference")
+        if opts["json"]:
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            self.stdout.write(f"Model {version}: {result['count']} inputs in the last {opts['hours']:g}h "
+                              f"vs {result['reference_rows']} reference rows ({result['reference']})")
+            self.stdout.write(f"{'feature':10s} {'status':18s} {'psi':>8s} {'ks/tvd':>8s} {'shift':>8s} {'missing':>8s}")
+            for name, r in result["features"].items():
+                distance = r["ks"] if r["ks"] is not None else r["tvd"]
+                self.stdout.write(
+                    f"{name:10s} {r['status']:18s} {_num(r['psi'])} {_num(distance)} "
+                    f"{_num(r['mean_shift'])} {_num(r['missing_rate'])}")
+            style = self.style.ERROR if result["status"] == "drift" else self.style.SUCCESS
+            self.stdout.write(style(f"Overall: {result['status']} (worst: {result['worst_feature']})"))
+        if opts["fail_on_drift"] and result["status"] == "drift":
+            raise SystemExit(1)
+
+
+def _num(value):
+    return f"{'-':>8s}" if value is None or not np.isfinite(value) else f"{value:8.3f}"
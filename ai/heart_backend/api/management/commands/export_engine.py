@@ -0,0 +1,141 @@
+import glob
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cohorts import GLOBAL, predict_routed
+from api.engine import CompiledModel, compile_cohorts, compile_pipeline, compile_severity, save_engine
+from api.registry import COHORT_FILE, SEVERITY_FILE
+
+
+MODEL_DIR = os.path.join(settings.BASE_DIR, "api", "model")
+DATA_DIR = os.path.join(os.path.dirname(settings.BASE_DIR), "data", "heart+disease")
+
+
+def _reference_rows(feature_order, n_random, seed):
+    """Các dòng processed.*.data (có '?' -> NaN) + dòng ngẫu nhiên quanh chúng."""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "processed.*.data"))):
+        df = pd.read_csv(path, header=None, names=feature_order + ["target"], na_values="?")
+        frames.append(df[feature_order].apply(pd.to_numeric, errors="coerce"))
+    X = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=feature_order)
+
+    if n_random and len(X):
+        rng = np.random.default_rng(seed)
+        R = X.sample(n_random, replace=True, random_state=seed).to_numpy(dtype=float)
+        R += rng.normal(0, 0.5, R.shape) * X.std().to_numpy()
+        R[rng.random(R.shape) < 0.05] = np.nan
+        X = pd.concat([X, pd.DataFrame(R, columns=feature_order)], ignore_index=True)
+    return X
+
+
+class Command(BaseCommand):
+    help = "Flatten the fitted sklearn pipeline into NumPy arrays served by api.engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=os.path.join(MODEL_DIR, "best_model_calibrated.pkl"))
+        parser.add_argument("--meta", default=os.path.join(MODEL_DIR, "meta.json"))
+        parser.add_argument("--out", default=os.path.join(MODEL_DIR, "engine"))
+        parser.add_argument("--background", default=os.path.join(DATA_DIR, "processed.cleveland.data"),
+                            help="training data whose transformed mean is the SHAP background expectation")
+        parser.add_argument("--severity", help=f"multinomial severity head (default: {SEVERITY_FILE} "
+                                               "next to --model, if present)")
+        parser.add_argument("--cohorts", help=f"per-site cohort models (default: {COHORT_FILE} "
+                                              "next to --model, if present)")
+        parser.add_argument("--tol", type=float, default=1e-9)
+        parser.add_argument("--random-rows", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **opts):
+        pipeline = joblib.load(opts["model"])
+        with open(opts["meta"]) as f:
+            meta = json.load(f)
+        feature_order = meta["feature_order"]
+
+        try:
+            manifest, arrays = compile_pipeline(pipeline, feature_order)
+        except ValueError as exc:
+            raise CommandError(f"Cannot compile {opts['model']}: {exc}")
+        manifest.update({
+            "model_name": meta.get("model_name"),
+            "model_version": meta.get("model_version"),
+            "source": os.path.basename(opts["model"]),
+        })
+
+        severity_path = opts["severity"] or os.path.join(os.path.dirname(opts["model"]), SEVERITY_FILE)
+        severity = None
+        if os.path.exists(severity_path):
+            severity = joblib.load(severity_path)
+            try:
+                arrays.update(compile_severity(severity, CompiledModel(manifest, arrays).n_out))
+            except ValueError as exc:
+                raise CommandError(f"Cannot compile {severity_path}: {exc}")
+            manifest["severity_source"] = os.path.basename(severity_path)
+        elif opts["severity"]:
+            raise CommandError(f"{severity_path} does not exist")
+
+        cohort_path = opts["cohorts"] or os.path.join(os.path.dirname(opts["model"]), COHORT_FILE)
+        bundle = None
+        if os.path.exists(cohort_path):
+            bundle = joblib.load(cohort_path)
+            try:
+                manifest["cohorts"], cohort_arrays = compile_cohorts(
+                    bundle, feature_order, arrays["coef"].shape[1], len(arrays["coef"]))
+            except ValueError as exc:
+                raise CommandError(f"Cannot compile {cohort_path}: {exc}")
+            arrays.update(cohort_arrays)
+            manifest["cohorts_source"] = os.path.basename(cohort_path)
+        elif opts["cohorts"]:
+            raise CommandError(f"{cohort_path} does not exist")
+
+        if opts["background"] and os.path.exists(opts["background"]):
+            bg = pd.read_csv(opts["background"], header=None, names=feature_order + ["target"], na_values="?")
+            arrays["background_mean"] = CompiledModel(manifest, arrays).transform(
+                bg[feature_order].to_numpy(dtype=float)).mean(axis=0)
+            manifest["background"] = os.path.basename(opts["background"])
+
+        # đối chiếu với predict_proba của sklearn trước khi ghi ra đĩa
+        X = _reference_rows(feature_order, opts["random_rows"], opts["seed"])
+        engine = CompiledModel(manifest, arrays)
+        if engine.has_cohorts:
+            # route theo mẫu thiếu (dòng ngẫu nhiên có NaN nên đi qua nhiều route)
+            routes = engine.route(X.to_numpy(dtype=float))
+            expected = predict_routed(pipeline.named_steps["pre"].transform(X), routes,
+                                      pipeline.named_steps["clf"], bundle["models"])
+            manifest["verified_routes"] = {name: int((routes == r).sum())
+                                           for r, name in enumerate([GLOBAL] + engine.cohorts)}
+        else:
+            expected = pipeline.predict_proba(X)[:, 1]
+        got = engine.predict_positive(X.to_numpy(dtype=float))
+        max_err = float(np.max(np.abs(got - expected))) if len(X) else 0.0
+        if max_err > opts["tol"]:
+            raise CommandError(f"Compiled engine differs from predict_proba by {max_err:.3e} (> {opts['tol']:.0e})")
+        if severity is not None:
+            expected = severity.predict_proba(pipeline.named_steps["pre"].transform(X))
+            got = engine.severity_proba(engine.transform(X.to_numpy(dtype=float)))
+            severity_err = float(np.max(np.abs(got - expected))) if len(X) else 0.0
+            if severity_err > opts["tol"]:
+                raise CommandError(f"Compiled severity head differs from predict_proba by "
+                                   f"{severity_err:.3e} (> {opts['tol']:.0e})")
+            max_err = max(max_err, severity_err)
+
+        manifest["verified_rows"] = int(len(X))
+        manifest["max_abs_error"] = max_err
+        save_engine(opts["out"], manifest, arrays)
+
+        one = X.iloc[:1].to_numpy(dtype=float)
+        t0 = time.perf_counter()
+        for _ in range(1000):
+            engine.predict_positive(one)
+        per_call = (time.perf_counter() - t0) / 1000
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {opts['out']} ({len(X)} rows verified, max |err| = {max_err:.2e}, "
+            f"{per_call * 1e6:.1f} µs/row single-call)"
+        ))
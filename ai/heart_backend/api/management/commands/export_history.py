@@ -0,0 +1,76 @@
+import os
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api import export
+from api.views import AnalyticsView
+
+
+class Command(BaseCommand):
+    help = "Stream the History table to CSV / NDJSON / Parquet without loading it into memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(export.FORMATS), default="csv")
+        parser.add_argument("--out", default="-", help="output file (default: stdout)")
+        parser.add_argument("--gzip", action="store_true", help="gzip the csv/ndjson stream")
+        parser.add_argument("--start", help="created_at >= start (ISO date or datetime)")
+        parser.add_argument("--end", help="created_at < end (ISO date or datetime)")
+        parser.add_argument("--user", help="user id or username")
+        parser.add_argument("--after-id", type=int, help="only rows with id > AFTER_ID")
+        parser.add_argument("--resume", action="store_true",
+                            help="append to an interrupted uncompressed csv/ndjson --out, "
+                                 "continuing after its last complete row")
+        parser.add_argument("--chunk-size", type=int, default=export.DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **opts):
+        fmt, out = opts["format"], opts["out"]
+        try:
+            start = AnalyticsView.parse_time(opts["start"]) if opts["start"] else None
+            end = AnalyticsView.parse_time(opts["end"]) if opts["end"] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        user_id = None
+        if opts["user"]:
+            user = opts["user"]
+            user_id = (int(user) if user.isdigit()
+                       else get_user_model().objects.filter(username=user).values_list("id", flat=True).first())
+            if user_id is None:
+                raise CommandError(f"Unknown user {user!r}")
+
+        after_id, header, mode = opts["after_id"], True, "wb"
+        if opts["resume"]:
+            if out == "-" or opts["gzip"] or fmt == "parquet":
+                raise CommandError("--resume needs an uncompressed csv/ndjson --out file")
+            if os.path.exists(out):
+                last_id = export.resume_point(out, fmt)
+                if last_id is not None:
+                    after_id = max(after_id or 0, last_id)
+                # file còn dòng tiêu đề (hoặc đã có dữ liệu) -> không ghi lại tiêu đề
+                header = os.path.getsize(out) == 0
+                mode = "ab"
+
+        progress = {}
+        try:
+            body = export.stream(fmt, export.history_queryset(start, end, user_id, after_id),
+                                 gzip=opts["gzip"], chunk_size=max(opts["chunk_size"], 1),
+                                 header=header, progress=progress)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        f = sys.stdout.buffer if out == "-" else open(out, mode)
+        try:
+            for data in body:
+                f.write(data)
+            f.flush()
+        finally:
+            if f is not sys.stdout.buffer:
+                f.close()
+
+        # stdout có thể là dữ liệu xuất -> báo cáo ra stderr
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {progress.get('rows', 0)} rows"
+            + (f" (last id {progress['last_id']})" if "last_id" in progress else "")
+            + ("" if out == "-" else f" to {out}")))
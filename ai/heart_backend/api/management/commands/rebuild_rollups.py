@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the /api/analytics/ rollup table from all History rows (backfill)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="rows fetched per server-side cursor round trip")
+
+    def handle(self, *args, **opts):
+        n, rows = rebuild(chunk_size=opts["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups from {n} History rows into {rows} rollup rows"))
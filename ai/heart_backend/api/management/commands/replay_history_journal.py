@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.writebehind import journal_dir, replay_orphans
+
+
+class Command(BaseCommand):
+    help = "Write History rows left in write-behind journals by dead workers to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=None, help="journal directory (default: settings.HISTORY_JOURNAL_DIR)")
+        parser.add_argument("--all", action="store_true",
+                            help="also replay journals of processes that still look alive (server must be stopped)")
+
+    def handle(self, *args, **opts):
+        directory = opts["dir"] or journal_dir()
+        n = replay_orphans(directory, only_dead=not opts["all"])
+        self.stdout.write(self.style.SUCCESS(f"Replayed {n} History rows from {directory}"))
@@ -0,0 +1,160 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api import cohorts, registry
+from api.datasets import iter_chunks
+from api.personalize import engine as rule_engine, risk_tier
+
+# mô hình dùng cho cả lệnh; tiến trình con nạp lại từ đường dẫn qua _init_worker
+_model = None
+
+
+def _init_worker(path):
+    """initializer của ProcessPoolExecutor: spawn (mặc định trên macOS) không thừa hưởng _model"""
+    global _model
+    if _model is None or str(_model.path) != str(path):
+        _model = registry.load_model(path)
+
+
+def chunk_sites(df, site=None):
+    """
+    Cơ sở của từng dòng cho mô hình theo cơ sở: `site` (--site hoặc suy ra từ tên file) cho
+    mọi dòng, nếu không thì cột "site" của CSV; None = route theo mẫu thiếu.
+    """
+    if site:
+        return [site] * len(df)
+    if "site" in df.columns:
+        return [s if isinstance(s, str) and s in cohorts.SITES else None for s in df["site"]]
+    return None
+
+
+def score_chunk(df, site=None):
+    """Chấm điểm vectorized 1 chunk, trả về chunk kèm probability/risk/recommendations"""
+    model = _model
+    X = df[model.feature_order].to_numpy(dtype=float)
+    probs = model.predict_matrix(X, chunk_sites(df, site))
+    risks = [risk_tier(p) for p in probs.tolist()]
+    if model.feature_order != rule_engine.features:
+        X = df[rule_engine.features].to_numpy(dtype=float)
+    df = df.copy()
+    df["probability"] = probs
+    df["risk"] = risks
+    df["recommendations"] = rule_engine.recommend_batch(X, tiers=risks)
+    df["model_version"] = model.version
+    return df
+
+
+def _ordered(chunks, workers, site=None):
+    """Chấm điểm các chunk theo thứ tự; tối đa 2*workers chunk đang xử lý để bộ nhớ không tăng"""
+    if workers <= 1:
+        for chunk in chunks:
+            yield score_chunk(chunk, site)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(_model.path),)) as pool:
+        pending = []
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk, site))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+
+    def write(self, df):
+        df = df.assign(recommendations=[json.dumps(r, ensure_ascii=False) for r in df["recommendations"]])
+        df.to_csv(self.path, mode="w" if self.header else "a", header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise CommandError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.path = path
+        self.writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Command(BaseCommand):
+    help = "Score a CSV or UCI heart-disease data file in chunks with the served model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input")
+        parser.add_argument("output", help="output path (.csv or .parquet)")
+        parser.add_argument("--format", choices=["csv", "processed", "raw"],
+                            help="input format (default: guessed from the file name)")
+        parser.add_argument("--output-format", choices=["csv", "parquet"],
+                            help="default: guessed from the output extension")
+        parser.add_argument("--chunksize", type=int, default=10000)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--model-version", help="model version to use (default: the one being served)")
+        parser.add_argument("--site", choices=cohorts.SITES,
+                            help="site of every row for per-site models (default: guessed from the file "
+                                 "name, else a 'site' column, else routed by missing values)")
+
+    def handle(self, *args, **opts):
+        global _model
+        if not os.path.exists(opts["input"]):
+            raise CommandError(f"{opts['input']} does not exist")
+        if opts["chunksize"] < 1:
+            raise CommandError("--chunksize must be positive")
+
+        if opts["model_version"]:
+            versions = registry.discover_versions()
+            if opts["model_version"] not in versions:
+                raise CommandError(f"Unknown model version {opts['model_version']!r}")
+            _model = registry.load_model(versions[opts["model_version"]])
+        else:
+            _model = registry.get_model()
+
+        out_format = opts["output_format"] or ("parquet" if opts["output"].endswith(".parquet") else "csv")
+        writer = ParquetWriter(opts["output"]) if out_format == "parquet" else CsvWriter(opts["output"])
+
+        t0 = time.perf_counter()
+        rows = chunks = 0
+        risk_counts = {}
+        try:
+            source = iter_chunks(opts["input"], opts["format"], opts["chunksize"], _model.feature_order)
+            site = opts["site"] or cohorts.site_of(opts["input"])
+            for df in _ordered(source, opts["workers"], site):
+                writer.write(df)
+                rows += len(df)
+                chunks += 1
+                for risk, n in zip(*np.unique(df["risk"], return_counts=True)):
+                    risk_counts[risk] = risk_counts.get(risk, 0) + int(n)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            writer.close()
+
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {rows} rows in {chunks} chunks with model {_model.version} "
+            f"in {elapsed:.2f}s -> {opts['output']} ({risk_counts})"
+        ))
@@ -0,0 +1,74 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api import registry
+from api.datasets import PROCESSED_FILES
+from api.training import FAMILIES, train, write_version
+
+DATA_DIR = os.path.join(os.path.dirname(settings.BASE_DIR), "data", "heart+disease")
+
+
+def next_version():
+    versions = sorted(registry.discover_versions(), key=registry._version_key)
+    if not versions:
+        return "v1.0"
+    major, _, minor = versions[-1].lstrip("v").partition(".")
+    try:
+        return f"v{int(major)}.{int(minor or 0) + 1}"
+    except ValueError:
+        raise CommandError(f"Cannot derive the next version from {versions[-1]!r}; pass --model-version")
+
+
+class Command(BaseCommand):
+    help = "Search, calibrate and package a new model version into MODEL_REGISTRY_DIR/<version>/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--data-dir", default=DATA_DIR)
+        parser.add_argument("--files", nargs="+", default=PROCESSED_FILES)
+        parser.add_argument("--families", nargs="+", choices=sorted(FAMILIES), default=["lr", "svc", "rf"])
+        parser.add_argument("--search", choices=["halving", "grid"], default="halving")
+        parser.add_argument("--jobs", type=int, default=-1, help="size of the shared process pool")
+        parser.add_argument("--cache-dir", help="persistent preprocessing cache (default: temporary)")
+        parser.add_argument("--no-cache", action="store_true", help="do not cache fitted preprocessing")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--model-version", help="default: next minor version after the newest one")
+        parser.add_argument("--out", help="default: MODEL_REGISTRY_DIR/<version>")
+        parser.add_argument("--no-engine", action="store_true", help="skip exporting the NumPy engine")
+        parser.add_argument("--no-severity", action="store_true", help="skip the multi-class severity head")
+        parser.add_argument("--no-cohorts", action="store_true",
+                            help="skip the per-site cohort models (trained when --files spans several sites)")
+
+    def handle(self, *args, **opts):
+        version = opts["model_version"] or next_version()
+        if version in registry.discover_versions():
+            raise CommandError(f"Model version {version} already exists")
+        out_dir = opts["out"] or os.path.join(registry.registry_dir(), version)
+        if os.path.exists(os.path.join(out_dir, "meta.json")):
+            raise CommandError(f"{out_dir} already contains a model")
+
+        pipeline, report, severity, reference, cohort_bundle = train(
+            opts["data_dir"], files=opts["files"], families=opts["families"], search=opts["search"],
+            n_jobs=opts["jobs"], cache_dir=False if opts["no_cache"] else opts["cache_dir"],
+            seed=opts["seed"], severity=not opts["no_severity"], cohort_models=not opts["no_cohorts"],
+            log=self.stdout.write,
+        )
+
+        def export_engine(meta_path):
+            if opts["no_engine"]:
+                return
+            try:
+                call_command("export_engine", model=os.path.join(out_dir, "best_model_calibrated.pkl"),
+                             meta=meta_path, out=os.path.join(out_dir, "engine"), stdout=self.stdout)
+            except CommandError as exc:
+                # vd. SVC/RF: registry dùng pipeline sklearn
+                self.stderr.write(f"Engine not exported: {exc}")
+
+        write_version(out_dir, version, pipeline, report, before_publish=export_engine, severity=severity,
+                      reference=reference, cohort_bundle=cohort_bundle)
+        self.stdout.write(json.dumps({k: report[k] for k in ("selected", "test", "threshold", "severity", "cohorts",
+                                                              "timings")}, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Wrote model {version} to {out_dir}"))
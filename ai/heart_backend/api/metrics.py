@@ -0,0 +1,226 @@
+# ===============================
+# metrics.py – counter/gauge trong tiến trình, xuất dạng Prometheus text
+# ===============================
+#
+# Mỗi worker (gunicorn / uvicorn --workers N) có bộ đếm riêng; Prometheus scrape qua load
+# balancer sẽ gặp ngẫu nhiên 1 worker nên số liệu nhảy lung tung. Đặt
+# METRICS_MULTIPROCESS_DIR (thư mục cục bộ, riêng cho từng máy / container, dọn sạch mỗi lần
+# deploy) để mọi worker ghi snapshot metrics-<pid>.json mỗi METRICS_FLUSH_SECONDS giây
+# (và khi thoát); render() gộp snapshot của mọi worker:
+#   - counter, histogram: cộng dồn, kể cả worker đã chết (tổng không giảm khi worker bị thay)
+#   - gauge: mỗi worker còn sống 1 series với nhãn pid (dùng sum/max by (...) khi truy vấn)
+# Số liệu của worker khác trễ tối đa METRICS_FLUSH_SECONDS; của worker đang trả lời là tức thời.
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+_lock = threading.Lock()
+_values = {}     # (name, labels) -> value
+_meta = {}       # name -> (type, help)
+_hist = {}       # (name, labels) -> [số đếm theo bucket..., tổng, số lần]
+_buckets = {}    # name -> cận trên các bucket
+
+# bucket mặc định (giây): từ 50µs tới 10s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# -------------------------------
+# Gộp nhiều worker (METRICS_MULTIPROCESS_DIR)
+# -------------------------------
+_writer_lock = threading.Lock()
+_writer_started = False   # luồng ghi snapshot không sống qua fork(): reset ở tiến trình con
+
+
+def _forked():
+    global _writer_started
+    _writer_started = False
+
+
+os.register_at_fork(after_in_child=_forked)
+
+
+def multiprocess_dir():
+    from django.conf import settings
+
+    directory = getattr(settings, "METRICS_MULTIPROCESS_DIR", None) if settings.configured else None
+    return str(directory) if directory else None
+
+
+def write_snapshot(directory=None):
+    """Ghi metric của tiến trình này vào metrics-<pid>.json (ghi tmp rồi os.replace)"""
+    directory = directory or multiprocess_dir()
+    if not directory:
+        return
+    with _lock:
+        snapshot = {
+            "values": [[name, labels, value] for (name, labels), value in _values.items()],
+            "hist": [[name, labels, list(h)] for (name, labels), h in _hist.items()],
+        }
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def _run_writer(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot(directory)
+        except OSError:
+            pass
+
+
+def _ensure_writer():
+    global _writer_started
+    with _writer_lock:
+        if _writer_started:
+            return
+        _writer_started = True
+        directory = multiprocess_dir()
+        if not directory:
+            return
+        from django.conf import settings
+
+        interval = max(float(getattr(settings, "METRICS_FLUSH_SECONDS", 5)), 0.1)
+        threading.Thread(target=_run_writer, args=(directory, interval), name="metrics-writer", daemon=True).start()
+        atexit.register(write_snapshot, directory)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect(directory):
+    """(values, hist) gộp từ snapshot của mọi worker trong `directory`"""
+    write_snapshot(directory)
+    values, hists = {}, {}
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = pid == os.getpid() or _pid_alive(pid)
+        for name, labels, value in snapshot["values"]:
+            labels = tuple(tuple(pair) for pair in labels)
+            if _meta.get(name, ("counter",))[0] == "gauge":
+                if alive:
+                    values[(name, tuple(sorted(labels + (("pid", str(pid)),))))] = value
+            else:
+                key = (name, labels)
+                values[key] = values.get(key, 0) + value
+        for name, labels, h in snapshot["hist"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            current = hists.get(key)
+            hists[key] = list(h) if current is None else [a + b for a, b in zip(current, h)]
+    return values, hists
+
+
+def describe(name, kind, help_text, buckets=None):
+    """Khai báo kiểu ("counter"/"gauge"/"histogram") và mô tả cho 1 metric"""
+    _meta[name] = (kind, help_text)
+    if kind == "histogram":
+        _buckets[name] = tuple(buckets or DEFAULT_BUCKETS)
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    if not _writer_started:
+        _ensure_writer()
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not _writer_started:
+        _ensure_writer()
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Ghi 1 giá trị vào histogram"""
+    bounds = _buckets.get(name, DEFAULT_BUCKETS)
+    i = bisect_left(bounds, value)
+    if not _writer_started:
+        _ensure_writer()
+    key = _key(name, labels)
+    with _lock:
+        h = _hist.get(key)
+        if h is None:
+            h = _hist[key] = [0] * (len(bounds) + 1) + [0.0, 0]
+        h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+def get(name, **labels):
+    return _values.get(_key(name, labels), 0)
+
+
+def get_histogram(name, **labels):
+    """(tổng, số lần) của 1 histogram"""
+    h = _hist.get(_key(name, labels))
+    return (h[-2], h[-1]) if h else (0.0, 0)
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + body + "}"
+
+
+def _header(lines, seen, name):
+    if name not in seen:
+        seen.add(name)
+        kind, help_text = _meta.get(name, ("untyped", ""))
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def render():
+    """Toàn bộ metric hiện có (của mọi worker nếu có METRICS_MULTIPROCESS_DIR) theo Prometheus text format"""
+    directory = multiprocess_dir()
+    if directory:
+        values, hists = _collect(directory)
+        items, hists = sorted(values.items()), sorted(hists.items())
+    else:
+        with _lock:
+            items = sorted(_values.items())
+            hists = sorted((k, list(v)) for k, v in _hist.items())
+    lines, seen = [], set()
+    for (name, labels), value in items:
+        _header(lines, seen, name)
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    for (name, labels), h in hists:
+        _header(lines, seen, name)
+        bounds = _buckets.get(name, DEFAULT_BUCKETS)
+        cumulative = 0
+        for le, n in zip([f"{b:g}" for b in bounds] + ["+Inf"], h[:-2]):
+            cumulative += n
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
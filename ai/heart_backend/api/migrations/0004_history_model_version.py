@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_user_full_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='model_version',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_history_model_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='api_history_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:09
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+def gen_uid(apps, schema_editor):
+    # mỗi dòng cũ cần 1 UUID riêng trước khi bật unique
+    History = apps.get_model("api", "History")
+    rows = list(History.objects.only("id"))
+    for row in rows:
+        row.uid = uuid.uuid4()
+    History.objects.bulk_update(rows, ["uid"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_history_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='uid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(gen_uid, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='history',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.DeleteModel(
+            name='PredictionHistory',
+        ),
+    ]
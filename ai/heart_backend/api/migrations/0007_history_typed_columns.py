@@ -0,0 +1,170 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:37
+
+import api.models
+from django.db import migrations, models
+
+FEATURES = ("age", "sex", "cp", "trestbps", "chol", "fbs", "restecg",
+            "thalach", "exang", "oldpeak", "slope", "ca", "thal")
+INT_FEATURES = ("age", "sex", "cp", "fbs", "restecg", "exang", "slope", "thal")
+BATCH = 2000
+
+
+def _value(feature, raw):
+    if raw is None or raw == "":
+        return None
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None
+    if value != value:
+        return None
+    return int(round(value)) if feature in INT_FEATURES else value
+
+
+def _batches(queryset):
+    batch = []
+    for row in queryset.iterator(chunk_size=BATCH):
+        batch.append(row)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_columns(apps, schema_editor):
+    # input_data JSON -> cột có kiểu, recommendations -> id trong bảng Recommendation
+    History = apps.get_model("api", "History")
+    Recommendation = apps.get_model("api", "Recommendation")
+    ids = {}
+    rows = History.objects.order_by("pk").only("id", "input_data", "recommendations")
+    for batch in _batches(rows):
+        new = {t for row in batch for t in (row.recommendations or []) if t not in ids}
+        if new:
+            Recommendation.objects.bulk_create([Recommendation(text=t) for t in new], ignore_conflicts=True)
+            ids.update({text: pk for pk, text in Recommendation.objects.filter(text__in=new).values_list("id", "text")})
+        for row in batch:
+            data = row.input_data or {}
+            for f in FEATURES:
+                setattr(row, f, _value(f, data.get(f)))
+            row.recommendation_ids = [ids[t] for t in row.recommendations or []]
+        History.objects.bulk_update(batch, FEATURES + ("recommendation_ids",))
+
+
+def to_json(apps, schema_editor):
+    History = apps.get_model("api", "History")
+    Recommendation = apps.get_model("api", "Recommendation")
+    texts = dict(Recommendation.objects.values_list("id", "text"))
+    rows = History.objects.order_by("pk").only("id", "recommendation_ids", *FEATURES)
+    for batch in _batches(rows):
+        for row in batch:
+            row.input_data = {f: getattr(row, f) for f in FEATURES}
+            row.recommendations = [texts[i] for i in row.recommendation_ids]
+        History.objects.bulk_update(batch, ("input_data", "recommendations"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_history_uid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='age',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='sex',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='cp',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='trestbps',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='chol',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='fbs',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='restecg',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='thalach',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='exang',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='oldpeak',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='slope',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='ca',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='thal',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='recommendation_ids',
+            field=api.models.IdListField(default=list),
+        ),
+        # cho phép NULL để khi rollback cột JSON được thêm lại trước khi to_json điền dữ liệu
+        migrations.AlterField(
+            model_name='history',
+            name='input_data',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='recommendations',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(to_columns, to_json),
+        migrations.RemoveField(
+            model_name='history',
+            name='input_data',
+        ),
+        migrations.RemoveField(
+            model_name='history',
+            name='recommendations',
+        ),
+    ]
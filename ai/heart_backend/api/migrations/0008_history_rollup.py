@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:40
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_history_typed_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('risk', models.CharField(max_length=20)),
+                ('age_band', models.SmallIntegerField(null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('probability_sum', models.FloatField(default=0.0)),
+                ('recommendation_counts', api.models.CountsField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'risk', 'age_band'], name='api_rollup_bucket_idx')],
+            },
+        ),
+    ]
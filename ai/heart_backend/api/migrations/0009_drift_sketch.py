@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_history_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriftSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('model_version', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+                ('sketch', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model_version', 'bucket'], name='api_drift_version_bucket_idx')],
+            },
+        ),
+    ]
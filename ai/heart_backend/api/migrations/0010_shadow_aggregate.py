@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_drift_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShadowAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('live_version', models.CharField(max_length=50)),
+                ('candidate', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('stats', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'live_version'], name='api_shadow_bucket_idx')],
+            },
+        ),
+    ]
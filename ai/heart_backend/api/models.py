@@ -1,8 +1,9 @@
-from django.db import models
+import threading
+import uuid
 
-# Create your models here.
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 class User(AbstractUser):
     full_name = models.CharField(max_length=150,blank=True)
@@ -10,22 +11,231 @@ class User(AbstractUser):
     pass
 
 
-class PredictionHistory(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    input_data = models.JSONField()   # dữ liệu đầu vào
-    probability = models.FloatField()  # xác suất
-    risk_level = models.CharField(max_length=50)  # thấp / trung bình / cao
-    created_at = models.DateTimeField(auto_now_add=True)
+# ===============================
+# Khuyến nghị: mỗi câu lưu 1 lần, History chỉ giữ danh sách id
+# ===============================
+class RecommendationManager(models.Manager):
+    # câu khuyến nghị không bao giờ đổi nội dung sau khi tạo -> cache trong tiến trình không cần hết hạn
+    _ids = {}
+    _texts = {}
+    _lock = threading.Lock()
+
+    def ids_for(self, texts):
+        """list[str] -> list[int]; câu chưa có trong bảng được thêm (1 lần cho mỗi tiến trình)"""
+        ids = self._ids
+        missing = [t for t in dict.fromkeys(texts) if t not in ids]
+        if missing:
+            self.bulk_create([Recommendation(text=t) for t in missing], ignore_conflicts=True)
+            ids = {**ids, **{text: pk for pk, text in self._load(self.filter(text__in=missing))}}
+        return [ids[t] for t in texts]
+
+    def texts_for(self, ids):
+        """list[int] -> list[str]"""
+        texts = self._texts
+        if any(i not in texts for i in ids):
+            texts = dict(self._load(self.all()))
+        return [texts[i] for i in ids]
+
+    def _load(self, queryset):
+        """
+        Đọc (id, text) cho lần gọi hiện tại; chỉ đưa vào cache khi transaction của caller
+        commit (ngoài transaction thì ngay): rollback thì id vừa thêm không còn tồn tại.
+        """
+        rows = list(queryset.values_list("id", "text"))
+        transaction.on_commit(lambda: self._remember(rows), using=self.db)
+        return rows
+
+    def _remember(self, rows):
+        with self._lock:
+            for pk, text in rows:
+                self._ids[text] = pk
+                self._texts[pk] = text
+
+
+class Recommendation(models.Model):
+    text = models.TextField(unique=True)
+
+    objects = RecommendationManager()
+
+    def __str__(self):
+        return self.text
+
+
+class IdListField(models.TextField):
+    """list[int] <-> "3,1,7" (giữ thứ tự, gọn hơn JSON array)"""
+
+    def from_db_value(self, value, expression, connection):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, list):
+            return value
+        return [int(v) for v in value.split(",")] if value else []
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return ",".join(map(str, value))
+
 
-    class Meta:
-        ordering = ["-created_at"]
 class History(models.Model):
+    # biến đầu vào (PredictSerializer) -> cột có kiểu; INT_FEATURES là các biến nguyên
+    FEATURES = ("age", "sex", "cp", "trestbps", "chol", "fbs", "restecg",
+                "thalach", "exang", "oldpeak", "slope", "ca", "thal")
+    INT_FEATURES = ("age", "sex", "cp", "fbs", "restecg", "exang", "slope", "thal")
+
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)  # sinh trong app, có ngay trước khi INSERT
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="histories")
-    input_data = models.JSONField()   # lưu raw input của user
+    age = models.SmallIntegerField(null=True)
+    sex = models.SmallIntegerField(null=True)
+    cp = models.SmallIntegerField(null=True)
+    trestbps = models.FloatField(null=True)
+    chol = models.FloatField(null=True)
+    fbs = models.SmallIntegerField(null=True)
+    restecg = models.SmallIntegerField(null=True)
+    thalach = models.FloatField(null=True)
+    exang = models.SmallIntegerField(null=True)
+    oldpeak = models.FloatField(null=True)
+    slope = models.SmallIntegerField(null=True)
+    ca = models.FloatField(null=True)
+    thal = models.SmallIntegerField(null=True)
     probability = models.FloatField()
     risk = models.CharField(max_length=20)
-    recommendations = models.JSONField()  # list recommendations trả ra FE
-    created_at = models.DateTimeField(auto_now_add=True)
+    recommendation_ids = IdListField(default=list)  # id trong Recommendation, đúng thứ tự trả ra FE
+    model_version = models.CharField(max_length=50, blank=True, default="")  # meta.json model_version
+    created_at = models.DateTimeField(default=timezone.now)  # write-behind giữ thời điểm dự đoán
+
+    class Meta:
+        indexes = [
+            # keyset pagination của HistoryView: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=["user", "-created_at", "-id"], name="api_history_user_created_idx"),
+        ]
 
     def __str__(self):
-        return f"History #{self.id} - {self.user.username}"
\ No newline at end of file
+        return f"History #{self.id} - {self.user.username}"
+
+    # input_data / recommendations giữ nguyên API cũ (History(input_data=..., recommendations=...),
+    # history.input_data, serializer) trên nền các cột mới
+    @property
+    def input_data(self):
+        return {f: getattr(self, f) for f in self.FEATURES}
+
+    @input_data.setter
+    def input_data(self, data):
+        for f in self.FEATURES:
+            setattr(self, f, data.get(f))
+
+    @property
+    def recommendations(self):
+        pending = getattr(self, "_pending_recommendations", None)
+        if pending is not None:
+            return pending
+        return Recommendation.objects.texts_for(self.recommendation_ids)
+
+    @recommendations.setter
+    def recommendations(self, texts):
+        # id được gán lúc ghi DB (resolve_recommendations): view async dựng History
+        # trong event loop, không được truy vấn DB ở đây
+        self._pending_recommendations = list(texts)
+
+    @classmethod
+    def resolve_recommendations(cls, histories):
+        """Gán recommendation_ids cho các History vừa dựng, trước save()/bulk_create()"""
+        pending = [h for h in histories if getattr(h, "_pending_recommendations", None) is not None]
+        if not pending:
+            return
+        ids = Recommendation.objects.ids_for([t for h in pending for t in h._pending_recommendations])
+        start = 0
+        for h in pending:
+            end = start + len(h._pending_recommendations)
+            h.recommendation_ids = ids[start:end]
+            h._pending_recommendations = None
+            start = end
+
+    def save(self, *args, **kwargs):
+        from .rollups import record
+
+        History.resolve_recommendations([self])
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # dòng mới: cập nhật rollup của /api/analytics/ trong cùng transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            record([self])
+
+# ===============================
+# Rollup cho /api/analytics/ (api/rollups.py)
+# ===============================
+class CountsField(models.TextField):
+    """dict[int, int] <-> "3:12,7:5" (số lần từng khuyến nghị xuất hiện)"""
+
+    def from_db_value(self, value, expression, connection):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, dict):
+            return value
+        return {int(k): int(n) for k, n in (item.split(":") for item in value.split(","))} if value else {}
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return ",".join(f"{k}:{n}" for k, n in sorted(value.items()))
+
+
+class HistoryRollup(models.Model):
+    """
+    Tổng hợp History theo (giờ, risk, nhóm tuổi). Mỗi lần ghi History thêm 1 dòng delta,
+    compact_rollups gộp các dòng cùng khóa lại; truy vấn cộng tất cả các dòng trong khoảng
+    nên luôn đúng dù đã compact hay chưa.
+    """
+    bucket = models.DateTimeField()                       # đầu giờ (UTC)
+    risk = models.CharField(max_length=20)
+    age_band = models.SmallIntegerField(null=True)        # 40 = 40–49 tuổi, NULL = không có tuổi
+    count = models.IntegerField(default=0)
+    probability_sum = models.FloatField(default=0.0)
+    recommendation_counts = CountsField(default=dict)     # {Recommendation.id: số lần}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket", "risk", "age_band"], name="api_rollup_bucket_idx"),
+        ]
+
+
+# ===============================
+# Sketch input cho theo dõi drift (api/drift.py)
+# ===============================
+class DriftSketch(models.Model):
+    """
+    Sketch kích thước cố định của các input đã dự đoán trong 1 khoảng flush của 1 worker
+    (moment + histogram theo bin của drift_reference.json). Các dòng cộng được với nhau.
+    """
+    bucket = models.DateTimeField()                       # đầu giờ (UTC)
+    model_version = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+    sketch = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["model_version", "bucket"], name="api_drift_version_bucket_idx"),
+        ]
+
+
+# ===============================
+# Thống kê chấm điểm bóng của mô hình ứng viên (api/shadow.py)
+# ===============================
+class ShadowAggregate(models.Model):
+    """
+    Thống kê cộng được (tỉ lệ đồng thuận, histogram Δ xác suất, latency) của 1 ứng viên so
+    với mô hình live trong 1 khoảng flush của 1 worker. Các dòng cộng được với nhau.
+    """
+    bucket = models.DateTimeField()                       # đầu giờ (UTC)
+    live_version = models.CharField(max_length=50)
+    candidate = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+    stats = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket", "live_version"], name="api_shadow_bucket_idx"),
+        ]
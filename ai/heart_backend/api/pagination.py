@@ -0,0 +1,44 @@
+# ===============================
+# pagination.py – keyset (cursor) pagination theo (created_at, id)
+# ===============================
+#
+# Cursor là base64 của "created_at|id" của dòng cuối trang trước. Trang tiếp theo
+# lấy các dòng (created_at, id) < cursor theo thứ tự giảm dần, dùng index
+# (user, -created_at, -id) nên chi phí không phụ thuộc việc đang ở trang thứ mấy.
+
+import base64
+import hashlib
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """-> (created_at, id); ValueError nếu cursor hỏng"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(pk)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError(f"Invalid cursor {cursor!r}") from exc
+
+
+def after_cursor(queryset, cursor):
+    """Các dòng đứng sau cursor theo thứ tự (-created_at, -id)"""
+    created_at, pk = decode_cursor(cursor)
+    return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+
+def page_etag(keys, *parts):
+    """ETag của 1 trang từ danh sách (id, created_at) + tham số truy vấn"""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(repr(part).encode())
+    for pk, created_at in keys:
+        h.update(f"{pk}:{created_at.isoformat()};".encode())
+    return f'W/"{h.hexdigest()}"'
@@ -1,115 +1,256 @@
 # ===============================
 # personalize.py – AI recommendation logic
 # ===============================
+#
+# Các ngưỡng khuyến nghị được khai báo 1 lần trong bảng RULES, biên dịch thành
+# RuleEngine: đánh giá cả batch bệnh nhân bằng mask boolean NumPy, rồi tra danh
+# sách khuyến nghị theo "khóa lượng tử hoá" (các bit rule nào bật + tier) trong
+# LRU cache – rất nhiều input khác nhau cho ra cùng 1 bộ khuyến nghị.
+#
+# Khi mô hình có đầu severity (phân phối mức độ 0–4), severity_level() rút phân phối
+# về 1 nhãn ("nang" / "vua" / None): nhãn này nâng tier tối thiểu (risk_tier) và thêm
+# 1 khuyến nghị riêng, đồng thời là 1 phần của khóa cache.
 
-def risk_tier(p):
-    """Phân loại mức độ nguy cơ dựa vào xác suất p"""
-    if p < 0.33:
-        return "thấp"
-    if p < 0.66:
-        return "trung_binh"
-    return "cao"
+from functools import lru_cache
 
+import numpy as np
 
-def personalize_recommendations(x, p=None, shap_top=None):
-    """
-    x: dict input gồm các biến Cleveland dataset
-    p: xác suất dự đoán (0..1)
-    shap_top: top features từ SHAP (tùy chọn)
-    Trả về list[str] khuyến nghị cá nhân hóa.
-    """
+FEATURES = ["age", "sex", "cp", "trestbps", "chol", "fbs", "restecg",
+            "thalach", "exang", "oldpeak", "slope", "ca", "thal"]
 
-    recs = []
 
-    # -------------------------------
-    # 1. Lipid & đường huyết
-    # -------------------------------
-    if x.get("chol") is not None:
-        if x["chol"] >= 240:
-            recs.append("Cholesterol cao: giảm chất béo bão hoà/chiên xào; tăng cá, hạt, rau ≥400g/ngày.")
-        elif x["chol"] >= 200:
-            recs.append("Cholesterol cận cao: duy trì chế độ DASH/Mediterranean và theo dõi định kỳ.")
+TIERS = ("thấp", "trung_binh", "cao")
+TIER_EDGES = (0.33, 0.66)
 
-    if x.get("fbs") == 1:
-        recs.append("Đường huyết đói cao: ăn ít đường tinh luyện, tăng chất xơ; vận động 150 phút/tuần.")
 
-    # -------------------------------
-    # 2. Huyết áp & gắng sức
-    # -------------------------------
-    if x.get("trestbps") is not None:
-        if x["trestbps"] >= 140:
-            recs.append("Huyết áp cao: giảm muối <5g/ngày, đi bộ nhanh 30 phút/ngày, kiểm soát stress.")
-        elif x["trestbps"] >= 130:
-            recs.append("Huyết áp tăng nhẹ: duy trì vận động đều, hạn chế rượu bia, theo dõi huyết áp.")
+def risk_tier(p, severity=None):
+    """Phân loại mức độ nguy cơ dựa vào xác suất p (severity_level nâng tier tối thiểu)"""
+    if p < TIER_EDGES[0]:
+        tier = "thấp"
+    elif p < TIER_EDGES[1]:
+        tier = "trung_binh"
+    else:
+        tier = "cao"
+    if severity is not None:
+        tier = max(tier, SEVERITY_MIN_TIER[severity], key=TIERS.index)
+    return tier
 
-    if x.get("thalach") is not None and x["thalach"] < 120:
-        recs.append("Thể lực thấp (thalach <120): bắt đầu tập nhẹ–vừa 20–30 phút, 5 ngày/tuần.")
 
-    if x.get("exang") == 1:
-        recs.append("Đau ngực khi gắng sức: tập mức nhẹ, ngừng lại nếu đau hoặc khó thở.")
+def risk_tier_index(P):
+    """Mảng xác suất -> mảng chỉ số trong TIERS (vectorized, cùng ngưỡng với risk_tier)"""
+    return np.searchsorted(TIER_EDGES, P, side="right")
 
-    # -------------------------------
-    # 3. ST segment & ECG
-    # -------------------------------
-    if x.get("oldpeak") is not None:
-        if x["oldpeak"] > 2.0:
-            recs.append("Oldpeak >2: giảm căng thẳng, ngủ đủ 7–8h; nên tham khảo bác sĩ.")
-        elif x["oldpeak"] > 1.0:
-            recs.append("Oldpeak 1–2: điều độ cường độ tập luyện, theo dõi triệu chứng.")
 
-    if x.get("slope") == 2:
-        recs.append("Slope downsloping: thận trọng khi gắng sức; ưu tiên bài tập nhịp nhàng.")
+# -------------------------------
+# Mức độ bệnh (đầu severity): (nhãn, mức thấp nhất, ngưỡng P(mức >= mức thấp nhất))
+# xét theo thứ tự, nhãn đầu tiên thoả thì dùng. Đầu severity fit với class_weight="balanced"
+# nên xác suất các mức hiếm (3–4) bị đẩy lên: ngưỡng 0.5 chứ không thấp hơn.
+# -------------------------------
+SEVERITY_LEVELS = [
+    ("nang", 3, 0.5),
+    ("vua", 2, 0.5),
+]
+SEVERITY_MIN_TIER = {"nang": "cao", "vua": "trung_binh"}
+SEVERITY_MESSAGES = {
+    "nang": "Phân bố mức độ nghiêng về bệnh NẶNG (mức 3–4): nên khám chuyên khoa tim mạch sớm, không tự tập gắng sức.",
+    "vua": "Có khả năng bệnh mức VỪA (mức ≥2): nên làm thêm xét nghiệm (ECG gắng sức/siêu âm tim) theo chỉ định.",
+}
 
-    if x.get("restecg") not in (None, 0):
-        recs.append("Điện tâm đồ có bất thường: tránh tăng gắng sức đột ngột, theo dõi triệu chứng.")
 
-    # -------------------------------
-    # 4. Mạch vành & thal
-    # -------------------------------
-    if x.get("ca") is not None and x["ca"] >= 1:
-        recs.append("Có dấu hiệu tổn thương mạch (ca≥1): siết chặt lối sống; theo dõi HA/lipid.")
+def severity_level(distribution, classes=(0, 1, 2, 3, 4)):
+    """phân phối severity của 1 bệnh nhân -> "nang" / "vua" / None"""
+    for level, lowest, threshold in SEVERITY_LEVELS:
+        if sum(q for c, q in zip(classes, distribution) if c >= lowest) >= threshold:
+            return level
+    return None
+
+
+def severity_levels(S, classes=(0, 1, 2, 3, 4)):
+    """(n, k) phân phối severity -> list nhãn, vectorized"""
+    S = np.asarray(S, dtype=float)
+    classes = np.asarray(classes)
+    out = [None] * len(S)
+    for level, lowest, threshold in reversed(SEVERITY_LEVELS):
+        hit = S[:, classes >= lowest].sum(axis=1) >= threshold
+        for i in np.flatnonzero(hit).tolist():
+            out[i] = level
+    return out
 
-    if x.get("thal") in (6, 7):
-        recs.append("Thal bất thường (6/7): tập nhẹ–vừa, theo dõi khó thở/mệt mỏi.")
 
-    # -------------------------------
+TIER_MESSAGES = {
+    "cao": "Bạn thuộc nhóm NGUY CƠ CAO: nên tham khảo bác sĩ sớm.",
+    "trung_binh": "Nguy cơ TRUNG BÌNH: áp dụng khuyến nghị và tái kiểm tra sau 1–3 tháng.",
+    "thấp": "Nguy cơ THẤP: duy trì lối sống lành mạnh và theo dõi định kỳ.",
+}
+
+# -------------------------------
+# Bảng luật: (mã, [điều kiện AND], khuyến nghị)
+# điều kiện = (biến, toán tử, giá trị); biến thiếu (None/NaN) -> điều kiện sai.
+# Thứ tự trong bảng = thứ tự khuyến nghị trả về.
+# -------------------------------
+RULES = [
+    # 1. Lipid & đường huyết
+    ("chol_high", [("chol", ">=", 240)],
+     "Cholesterol cao: giảm chất béo bão hoà/chiên xào; tăng cá, hạt, rau ≥400g/ngày."),
+    ("chol_borderline", [("chol", ">=", 200), ("chol", "<", 240)],
+     "Cholesterol cận cao: duy trì chế độ DASH/Mediterranean và theo dõi định kỳ."),
+    ("fbs_high", [("fbs", "==", 1)],
+     "Đường huyết đói cao: ăn ít đường tinh luyện, tăng chất xơ; vận động 150 phút/tuần."),
+
+    # 2. Huyết áp & gắng sức
+    ("bp_high", [("trestbps", ">=", 140)],
+     "Huyết áp cao: giảm muối <5g/ngày, đi bộ nhanh 30 phút/ngày, kiểm soát stress."),
+    ("bp_elevated", [("trestbps", ">=", 130), ("trestbps", "<", 140)],
+     "Huyết áp tăng nhẹ: duy trì vận động đều, hạn chế rượu bia, theo dõi huyết áp."),
+    ("low_fitness", [("thalach", "<", 120)],
+     "Thể lực thấp (thalach <120): bắt đầu tập nhẹ–vừa 20–30 phút, 5 ngày/tuần."),
+    ("exang", [("exang", "==", 1)],
+     "Đau ngực khi gắng sức: tập mức nhẹ, ngừng lại nếu đau hoặc khó thở."),
+
+    # 3. ST segment & ECG
+    ("oldpeak_high", [("oldpeak", ">", 2.0)],
+     "Oldpeak >2: giảm căng thẳng, ngủ đủ 7–8h; nên tham khảo bác sĩ."),
+    ("oldpeak_mid", [("oldpeak", ">", 1.0), ("oldpeak", "<=", 2.0)],
+     "Oldpeak 1–2: điều độ cường độ tập luyện, theo dõi triệu chứng."),
+    ("slope_down", [("slope", "==", 2)],
+     "Slope downsloping: thận trọng khi gắng sức; ưu tiên bài tập nhịp nhàng."),
+    ("restecg_abnormal", [("restecg", "!=", 0)],
+     "Điện tâm đồ có bất thường: tránh tăng gắng sức đột ngột, theo dõi triệu chứng."),
+
+    # 4. Mạch vành & thal
+    ("ca_vessels", [("ca", ">=", 1)],
+     "Có dấu hiệu tổn thương mạch (ca≥1): siết chặt lối sống; theo dõi HA/lipid."),
+    ("thal_defect", [("thal", "in", (6, 7))],
+     "Thal bất thường (6/7): tập nhẹ–vừa, theo dõi khó thở/mệt mỏi."),
+
     # 5. Nhân khẩu học & triệu chứng
-    # -------------------------------
-    if x.get("age") is not None and x["age"] >= 55:
-        recs.append("Tuổi ≥55: duy trì ăn lành mạnh, vận động đều, khám 6–12 tháng/lần.")
-
-    if x.get("sex") == 1 and x.get("age", 0) >= 45:
-        recs.append("Nam ≥45 tuổi: kiểm soát vòng eo, hạn chế rượu bia, theo dõi lipid.")
-
-    if x.get("cp") in (0, 1):
-        recs.append("Có triệu chứng đau ngực: nếu đau lan tay/hàm hoặc khó thở → đi khám ngay.")
-
-    # -------------------------------
-    # 6. Nguy cơ tổng quát (từ mô hình)
-    # -------------------------------
-    if p is not None:
-        tier = risk_tier(p)
-        if tier == "cao":
-            recs.insert(0, "Bạn thuộc nhóm NGUY CƠ CAO: nên tham khảo bác sĩ sớm.")
-        elif tier == "trung_binh":
-            recs.insert(0, "Nguy cơ TRUNG BÌNH: áp dụng khuyến nghị và tái kiểm tra sau 1–3 tháng.")
-        else:
-            recs.insert(0, "Nguy cơ THẤP: duy trì lối sống lành mạnh và theo dõi định kỳ.")
-
-    # -------------------------------
-    # 7. SHAP feature explanation (tuỳ chọn)
-    # -------------------------------
-    if shap_top:
-        recs.append(f"Yếu tố ảnh hưởng nhiều (SHAP): {', '.join(shap_top[:3])}.")
-
-    # -------------------------------
-    # 8. Loại trùng lặp
-    # -------------------------------
-    seen = set()
-    unique_recs = []
-    for r in recs:
-        if r not in seen:
-            unique_recs.append(r)
-            seen.add(r)
-
-    return unique_recs
+    ("age_55", [("age", ">=", 55)],
+     "Tuổi ≥55: duy trì ăn lành mạnh, vận động đều, khám 6–12 tháng/lần."),
+    ("male_45", [("sex", "==", 1), ("age", ">=", 45)],
+     "Nam ≥45 tuổi: kiểm soát vòng eo, hạn chế rượu bia, theo dõi lipid."),
+    ("chest_pain", [("cp", "in", (0, 1))],
+     "Có triệu chứng đau ngực: nếu đau lan tay/hàm hoặc khó thở → đi khám ngay."),
+]
+
+_OPS = {
+    ">=": (np.greater_equal, lambda a, b: a >= b),
+    ">": (np.greater, lambda a, b: a > b),
+    "<": (np.less, lambda a, b: a < b),
+    "<=": (np.less_equal, lambda a, b: a <= b),
+    "==": (np.equal, lambda a, b: a == b),
+    "!=": (np.not_equal, lambda a, b: a != b),
+    "in": (np.isin, lambda a, b: a in b),
+}
+
+
+class RuleEngine:
+    """RULES đã biên dịch: mask NumPy cho cả batch + LRU cache theo khóa lượng tử hoá.
+
+    Khóa lượng tử hoá của 1 bệnh nhân = số nguyên có bit r bật nếu rule r kích hoạt,
+    cộng với tier và top SHAP; mọi input cho cùng khóa có cùng danh sách khuyến nghị.
+    """
+
+    def __init__(self, rules, features=FEATURES, cache_size=4096):
+        self.codes = [code for code, _, _ in rules]
+        self.messages = tuple(msg for _, _, msg in rules)
+        self.features = list(features)
+        index = {f: i for i, f in enumerate(self.features)}
+        self.n_rules = len(rules)
+        # mỗi điều kiện -> (biến, cột, hàm NumPy, hàm Python, giá trị, rule)
+        self.conditions = []
+        for r, (_, conds, _) in enumerate(rules):
+            for feature, op, value in conds:
+                np_op, py_op = _OPS[op]
+                self.conditions.append((feature, index[feature], np_op, py_op, value, r))
+        self.bit_weights = 1 << np.arange(self.n_rules, dtype=np.int64)
+        self._lookup = lru_cache(maxsize=cache_size)(self._build)
+
+    def to_matrix(self, records):
+        """list[dict] -> (n, n_features) float, None -> NaN"""
+        return np.array([[r.get(f) for f in self.features] for r in records], dtype=float).reshape(-1, len(self.features))
+
+    def masks(self, X):
+        """(n, n_features) -> (n, n_rules) bool: rule nào được kích hoạt"""
+        X = np.asarray(X, dtype=float)
+        M = np.ones((X.shape[0], self.n_rules), dtype=bool)
+        present = ~np.isnan(X)
+        for _, col, np_op, _, value, r in self.conditions:
+            M[:, r] &= present[:, col] & np_op(X[:, col], value)
+        return M
+
+    def key(self, x):
+        """Khóa lượng tử hoá của 1 dict input (đường đi thuần Python cho 1 bệnh nhân)"""
+        failed = 0
+        for feature, _, _, py_op, value, r in self.conditions:
+            v = x.get(feature)
+            if v is None or v != v or not py_op(v, value):
+                failed |= 1 << r
+        return ((1 << self.n_rules) - 1) & ~failed
+
+    def _build(self, key, tier, shap_top, severity=None):
+        recs = [msg for r, msg in enumerate(self.messages) if key >> r & 1]
+        if severity is not None:
+            recs.insert(0, SEVERITY_MESSAGES[severity])
+        if tier is not None:
+            recs.insert(0, TIER_MESSAGES[tier])
+        if shap_top:
+            recs.append(f"Yếu tố ảnh hưởng nhiều (SHAP): {', '.join(shap_top[:3])}.")
+        # loại trùng lặp, giữ thứ tự
+        return tuple(dict.fromkeys(recs))
+
+    def recommend(self, x, tier=None, shap_top=None, severity=None):
+        return list(self._lookup(self.key(x), tier, tuple(shap_top[:3]) if shap_top else None, severity))
+
+    def recommend_batch(self, X, p=None, shap_top=None, tiers=None, severities=None):
+        """
+        X: (n, n_features) theo self.features
+        p: xác suất (n,) hoặc None; tiers: list tier đã tính sẵn (bỏ qua p)
+        shap_top: list (mỗi dòng 1 list tên feature) hoặc None
+        severities: list nhãn severity_level (hoặc None) cho từng dòng
+        """
+        keys = self.masks(X) @ self.bit_weights
+        n = len(keys)
+        if severities is None:
+            severities = [None] * n
+        if tiers is None:
+            tiers = [None] * n if p is None else [risk_tier(float(pi), s) for pi, s in zip(p, severities)]
+        if shap_top is None:
+            # không có SHAP: chỉ dựng danh sách cho từng khóa (key, tier, severity) khác nhau
+            built = {}
+            out = []
+            for k, tier, severity in zip(keys.tolist(), tiers, severities):
+                recs = built.get((k, tier, severity))
+                if recs is None:
+                    recs = built[(k, tier, severity)] = self._lookup(k, tier, None, severity)
+                out.append(list(recs))
+            return out
+        return [
+            list(self._lookup(k, tier, tuple(shap[:3]) if shap else None, severity))
+            for k, tier, shap, severity in zip(keys.tolist(), tiers, shap_top, severities)
+        ]
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+
+engine = RuleEngine(RULES)
+
+
+def personalize_recommendations(x, p=None, shap_top=None, tier=None, severity=None):
+    """
+    x: dict input gồm các biến Cleveland dataset
+    p: xác suất dự đoán (0..1)
+    shap_top: top features từ SHAP (tùy chọn)
+    tier: risk_tier(p) nếu đã tính sẵn
+    severity: severity_level(...) từ đầu severity (tùy chọn)
+    Trả về list[str] khuyến nghị cá nhân hóa.
+    """
+    if tier is None and p is not None:
+        tier = risk_tier(p, severity)
+    return engine.recommend(x, tier=tier, shap_top=shap_top, severity=severity)
+
+
+def personalize_batch(records, p=None, shap_top=None, tiers=None, severities=None):
+    """Phiên bản batch của personalize_recommendations cho list[dict]"""
+    return engine.recommend_batch(engine.to_matrix(records), p=p, shap_top=shap_top, tiers=tiers,
+                                  severities=severities)
@@ -0,0 +1,226 @@
+# ===============================
+# profiling.py – đo thời gian từng request / từng giai đoạn + profile request chậm
+# ===============================
+#
+# ProfilingMiddleware (đứng đầu MIDDLEWARE) đo tổng thời gian mỗi request, số câu SQL
+# và thời gian SQL, ghi vào histogram của api/metrics.py (xem /api/metrics/) và trả
+# về header Server-Timing. Trong view, `with stage("predict"):` đo từng giai đoạn
+# (auth, validate, predict, personalize, history, ...).
+#
+# Thống kê của request hiện tại nằm trong ContextVar nên đi theo cả sync_to_async
+# (view async) lẫn luồng của executor khi dùng contextvars.copy_context().
+# SQL được đo bằng execute_wrapper gắn vào mọi kết nối DB lúc tạo (connection_created).
+#
+# PROFILE_SAMPLE_RATE > 0: lấy mẫu chừng đó phần request để chạy profiler (cProfile hoặc
+# pyinstrument), request nào chậm hơn PROFILE_SLOW_SECONDS thì ghi profile ra PROFILE_DIR.
+
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("heart_request_seconds", "histogram", "HTTP request latency by view")
+metrics.describe("heart_stage_seconds", "histogram", "Latency of instrumented stages of the prediction path")
+metrics.describe("heart_db_query_seconds", "histogram", "Latency of individual SQL queries")
+metrics.describe("heart_db_queries_per_request", "histogram", "SQL queries issued per request",
+                 buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+metrics.describe("heart_profiles_written_total", "counter", "Slow-request profiles written to PROFILE_DIR")
+
+_request = ContextVar("heart_request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("stages", "db_queries", "db_seconds")
+
+    def __init__(self):
+        self.stages = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+
+@contextmanager
+def stage(name):
+    """Đo 1 giai đoạn: histogram heart_stage_seconds{stage=name} + Server-Timing của request"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        metrics.observe("heart_stage_seconds", elapsed, stage=name)
+        stats = _request.get()
+        if stats is not None:
+            stats.stages[name] = stats.stages.get(name, 0.0) + elapsed
+
+
+def db_wrapper(execute, sql, params, many, context):
+    t0 = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - t0
+        metrics.observe("heart_db_query_seconds", elapsed)
+        stats = _request.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+
+
+def install_db_wrapper(sender=None, connection=None, **kwargs):
+    """Receiver của connection_created: gắn db_wrapper vào kết nối mới"""
+    if db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_wrapper)
+
+
+class TimedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication có đo giai đoạn "auth" (DRF xác thực lười trong APIView.initial)"""
+
+    def authenticate(self, request):
+        with stage("auth"):
+            return super().authenticate(request)
+
+
+# -------------------------------
+# Profiler lấy mẫu
+# -------------------------------
+# cProfile (Python >= 3.12 dùng sys.monitoring: "Another profiling tool is already active")
+# và pyinstrument không chạy chồng nhau được: mỗi tiến trình profile tối đa 1 request
+_active = threading.Lock()
+
+
+class _Profiler:
+    def __init__(self, engine):
+        self.engine = engine
+        if engine == "pyinstrument":
+            from pyinstrument import Profiler
+            self.profiler = Profiler(async_mode="enabled")
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        """False nếu đang có request khác được profile (bỏ lượt lấy mẫu này)"""
+        if not _active.acquire(blocking=False):
+            return False
+        try:
+            if self.engine == "pyinstrument":
+                self.profiler.start()
+            else:
+                self.profiler.enable()
+        except BaseException:
+            _active.release()
+            raise
+        return True
+
+    def stop(self):
+        try:
+            if self.engine == "pyinstrument":
+                self.profiler.stop()
+            else:
+                self.profiler.disable()
+        finally:
+            _active.release()
+
+    def dump(self, directory, request, elapsed):
+        os.makedirs(directory, exist_ok=True)
+        name = request.path.strip("/").replace("/", "_") or "root"
+        base = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{name}-{elapsed * 1000:.0f}ms")
+        if self.engine == "pyinstrument":
+            path = base + ".html"
+            with open(path, "w") as f:
+                f.write(self.profiler.output_html())
+        else:
+            path = base + ".prof"
+            self.profiler.dump_stats(path)
+        metrics.inc("heart_profiles_written_total")
+        logger.info("Slow request %s %s (%.0f ms): profile written to %s",
+                    request.method, request.path, elapsed * 1000, path)
+
+
+def _make_profiler():
+    rate = getattr(settings, "PROFILE_SAMPLE_RATE", 0.0)
+    if not rate or random.random() >= rate:
+        return None
+    engine = getattr(settings, "PROFILE_ENGINE", "cprofile")
+    try:
+        return _Profiler(engine)
+    except ImportError:
+        logger.warning("PROFILE_ENGINE=%r is not installed, falling back to cProfile", engine)
+        return _Profiler("cprofile")
+
+
+class ProfilingMiddleware:
+    """Đo latency/SQL theo view, header Server-Timing, profile request chậm (sync + async)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, "PROFILE_SLOW_SECONDS", 1.0)
+        self.profile_dir = str(getattr(settings, "PROFILE_DIR", os.path.join(settings.BASE_DIR, "var", "profiles")))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, profiler, t0 = self._begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            self._end(token, profiler)
+        return self._finish(request, response, stats, profiler, t0)
+
+    async def __acall__(self, request):
+        stats, token, profiler, t0 = self._begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._end(token, profiler)
+        return self._finish(request, response, stats, profiler, t0)
+
+    def _begin(self):
+        stats = RequestStats()
+        token = _request.set(stats)
+        profiler = _make_profiler()
+        if profiler is not None and not profiler.start():
+            profiler = None
+        return stats, token, profiler, time.perf_counter()
+
+    def _end(self, token, profiler):
+        # cả khi view ném lỗi: profiler phải dừng để nhả _active
+        _request.reset(token)
+        if profiler is not None:
+            profiler.stop()
+
+    def _finish(self, request, response, stats, profiler, t0):
+        elapsed = time.perf_counter() - t0
+        if profiler is not None:
+            if elapsed >= self.slow_seconds:
+                try:
+                    profiler.dump(self.profile_dir, request, elapsed)
+                except Exception:
+                    logger.exception("Writing profile failed")
+
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        metrics.observe("heart_request_seconds", elapsed, view=view, method=request.method,
+                        status=response.status_code)
+        metrics.observe("heart_db_queries_per_request", stats.db_queries, view=view)
+
+        timings = [f"{name};dur={sec * 1000:.3f}" for name, sec in stats.stages.items()]
+        timings.append(f"db;desc=\"{stats.db_queries} queries\";dur={stats.db_seconds * 1000:.3f}")
+        timings.append(f"total;dur={elapsed * 1000:.3f}")
+        response["Server-Timing"] = ", ".join(timings)
+        return response
@@ -0,0 +1,616 @@
+# ===============================
+# registry.py – nạp mô hình lười (lazy) và dùng chung trong tiến trình
+# ===============================
+#
+# Thay cho joblib.load() lúc import views.py:
+#   - đường dẫn lấy từ settings.MODEL_DIR (mặc định BASE_DIR/api/model), không phụ thuộc cwd
+#   - chỉ nạp ở lần gọi get_model() đầu tiên -> migrate/shell không phải import sklearn
+#   - MODEL_PRELOAD=True: nạp ngay trong AppConfig.ready(); chạy gunicorn với --preload
+#     thì master nạp 1 lần trước khi fork, các worker dùng chung trang nhớ (copy-on-write)
+#   - MODEL_MMAP=True: các mảng của engine NumPy được memory-map read-only, N worker
+#     dùng chung 1 bản trong page cache của OS
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import cohorts, metrics
+from .engine import load_engine
+
+try:
+    import fcntl
+except ImportError:   # Windows: không khoá registry.json giữa các tiến trình
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "best_model_calibrated.pkl"
+META_FILE = "meta.json"
+ENGINE_DIR = "engine"
+SEVERITY_FILE = "severity_model.pkl"   # đầu severity (LR multinomial trên output của bước "pre")
+DRIFT_REFERENCE_FILE = "drift_reference.json"   # sketch dữ liệu huấn luyện cho api/drift.py
+COHORT_FILE = "cohort_models.pkl"   # mô hình theo cơ sở + bảng route (api/cohorts.py)
+
+metrics.describe("heart_model_load_seconds", "gauge", "Wall time spent loading the served model")
+metrics.describe("heart_model_artifact_bytes", "gauge", "On-disk size of the loaded model artifact")
+metrics.describe("heart_model_loads_total", "counter", "Number of model loads in this process")
+
+
+def _dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path) for f in files
+    )
+
+
+class ServedModel:
+    """Mô hình đang phục vụ: meta.json + engine NumPy (hoặc pipeline sklearn dự phòng)."""
+
+    def __init__(self, path, meta, engine=None, pipeline=None, severity=None, cohorts=None):
+        self.path = path
+        self.meta = meta
+        self.engine = engine
+        self.pipeline = pipeline
+        self.severity = severity   # đầu severity sklearn, chỉ dùng khi không có engine
+        self.cohorts = cohorts     # bundle cohort sklearn (training.fit_cohorts), chỉ dùng khi không có engine
+        self.name = meta.get("model_name")
+        self.version = meta.get("model_version")
+        self.threshold = meta["threshold"]
+        self.feature_order = meta["feature_order"]
+        self.load_seconds = 0.0
+        self.artifact_bytes = 0
+        self.validation = None
+        self._compiled = False    # False = chưa dựng, None = không biên dịch được
+        self._explainer = False
+        self._triage = False
+
+    @property
+    def backend(self):
+        return "engine" if self.engine is not None else "sklearn"
+
+    def predict_matrix(self, X, sites=None):
+        """
+        ma trận (n, n_features) theo feature_order -> xác suất lớp 1. sites: cơ sở của từng
+        dòng (None / phần tử None = route theo mẫu thiếu)
+        """
+        if self.engine is not None:
+            return self.engine.predict_positive(X, self.engine.route(X, sites) if sites is not None else None)
+        import pandas as pd
+        X = pd.DataFrame(X, columns=self.feature_order)
+        if self.has_cohorts:
+            return self._predict_routed(X, self._routes(X.to_numpy(dtype=float), sites))
+        return self.pipeline.predict_proba(X)[:, 1]
+
+    def predict_positive(self, rows):
+        """list[dict] -> xác suất lớp 1"""
+        if self.engine is not None:
+            return self.engine.predict_records(rows)
+        import pandas as pd
+        X = pd.DataFrame(rows, columns=self.feature_order)
+        if self.has_cohorts:
+            return self._predict_routed(X, self.routes(rows, X.to_numpy(dtype=float)))
+        return self.pipeline.predict_proba(X)[:, 1]
+
+    # -------------------------------
+    # Mô hình theo cơ sở (api/cohorts.py)
+    # -------------------------------
+    @property
+    def has_cohorts(self):
+        if self.engine is not None:
+            return self.engine.has_cohorts
+        return bool(self.cohorts and self.cohorts["names"])
+
+    def cohort_names(self):
+        if self.engine is not None:
+            return self.engine.cohorts
+        return list(self.cohorts["names"]) if self.has_cohorts else []
+
+    def _routes(self, X, sites=None):
+        bundle = self.cohorts
+        index = [self.feature_order.index(f) for f in bundle["route_features"]]
+        return cohorts.route(X, index, bundle["route_table"], bundle["names"], sites)
+
+    def routes(self, rows, X=None):
+        """list[dict] -> chỉ số route (n,) (trường "site" ưu tiên hơn mẫu thiếu); None nếu không có cohort"""
+        if not self.has_cohorts:
+            return None
+        if self.engine is not None:
+            return self.engine.route_records(self.engine.to_matrix(rows) if X is None else X, rows)
+        if X is None:
+            import numpy as np
+            X = np.array([[r.get(f) for f in self.feature_order] for r in rows], dtype=float)
+        return self._routes(X, [r.get("site") for r in rows])
+
+    def cohort_of(self, rows):
+        """list[dict] -> tên mô hình phục vụ từng dòng ("global" hoặc tên cơ sở); None nếu không có cohort"""
+        routes = self.routes(rows)
+        if routes is None:
+            return None
+        names = [cohorts.GLOBAL] + self.cohort_names()
+        return [names[r] for r in routes]
+
+    def _predict_routed(self, X, routes):
+        pre, clf = self.pipeline.steps[0][1], self.pipeline.steps[-1][1]
+        return cohorts.predict_routed(pre.transform(X), routes, clf, self.cohorts["models"])
+
+    @property
+    def has_severity(self):
+        if self.engine is not None:
+            return self.engine.has_severity
+        return self.severity is not None
+
+    def predict_heads(self, rows):
+        """
+        list[dict] -> (xác suất lớp 1, phân phối severity (n, k) hoặc None).
+        Cả 2 đầu dùng chung 1 lần transform.
+        """
+        if self.engine is not None:
+            X = self.engine.to_matrix(rows)
+            return self.engine.predict_heads(X, self.engine.route_records(X, rows))
+        import pandas as pd
+        pre, clf = self.pipeline.steps[0][1], self.pipeline.steps[-1][1]
+        X = pd.DataFrame(rows, columns=self.feature_order)
+        Z = pre.transform(X)
+        if self.has_cohorts:
+            p = cohorts.predict_routed(Z, self.routes(rows, X.to_numpy(dtype=float)), clf, self.cohorts["models"])
+        else:
+            p = clf.predict_proba(Z)[:, 1]
+        return p, (self.severity.predict_proba(Z) if self.severity is not None else None)
+
+    def severity_classes(self):
+        if self.engine is not None and self.engine.has_severity:
+            return [int(c) for c in self.engine.severity_classes]
+        if self.severity is not None:
+            return [int(c) for c in self.severity.classes_]
+        return None
+
+    @property
+    def compiled(self):
+        """CompiledModel của mô hình (engine, hoặc pipeline sklearn biên dịch tạm); None nếu không được"""
+        if self._compiled is False:
+            engine = self.engine
+            if engine is None:
+                from .engine import CompiledModel, compile_cohorts, compile_pipeline
+                try:
+                    manifest, arrays = compile_pipeline(self.pipeline, self.feature_order)
+                    if self.has_cohorts:
+                        manifest["cohorts"], cohort_arrays = compile_cohorts(
+                            self.cohorts, self.feature_order, arrays["coef"].shape[1], len(arrays["coef"]))
+                        arrays.update(cohort_arrays)
+                    engine = CompiledModel(manifest, arrays)
+                except (ValueError, TypeError, AttributeError) as exc:
+                    logger.warning("Model %s cannot be compiled (%s); explanations/triage disabled",
+                                   self.version, exc)
+                    engine = None
+            self._compiled = engine
+        return self._compiled
+
+    @property
+    def explainer(self):
+        """LinearExplainer (SHAP) dựng 1 lần cho mỗi mô hình, None nếu không hỗ trợ"""
+        if self._explainer is False:
+            from .explain import build_explainer
+            self._explainer = build_explainer(self)
+        return self._explainer
+
+    @property
+    def triage(self):
+        """TriageModel (dự đoán với input thiếu + chọn xét nghiệm kế tiếp), None nếu không hỗ trợ"""
+        if self._triage is False:
+            from .triage import build_triage
+            self._triage = build_triage(self)
+        return self._triage
+
+    def explain(self, rows, k=3):
+        """list[dict] -> list giải thích SHAP, hoặc None nếu mô hình không hỗ trợ"""
+        explainer = self.explainer
+        if explainer is None:
+            return None
+        return explainer.explain_records(rows, k=k)
+
+    def stats(self):
+        return {
+            "model_name": self.name,
+            "model_version": self.version,
+            "backend": self.backend,
+            "severity": self.has_severity,
+            "cohorts": self.cohort_names(),
+            "path": str(self.path),
+            "load_seconds": self.load_seconds,
+            "artifact_bytes": self.artifact_bytes,
+            "validation": self.validation,
+        }
+
+
+def load_model(path, mmap=None):
+    """Nạp 1 thư mục mô hình (meta.json + engine/ hoặc best_model_calibrated.pkl)."""
+    if mmap is None:
+        mmap = getattr(settings, "MODEL_MMAP", True)
+    t0 = time.perf_counter()
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+
+    engine_path = os.path.join(path, ENGINE_DIR)
+    model_path = os.path.join(path, MODEL_FILE)
+    model = None
+    if os.path.isdir(engine_path):
+        engine = load_engine(engine_path, mmap_mode="r" if mmap else None)
+        if engine.manifest.get("model_version") == meta.get("model_version"):
+            model = ServedModel(path, meta, engine=engine)
+            model.artifact_bytes = _dir_size(engine_path)
+        else:
+            logger.warning("Engine in %s is for %s, meta.json says %s; using %s",
+                           engine_path, engine.manifest.get("model_version"),
+                           meta.get("model_version"), MODEL_FILE)
+    if model is None:
+        import joblib
+        severity_path = os.path.join(path, SEVERITY_FILE)
+        severity = joblib.load(severity_path) if os.path.isfile(severity_path) else None
+        cohort_path = os.path.join(path, COHORT_FILE)
+        bundle = joblib.load(cohort_path) if os.path.isfile(cohort_path) else None
+        model = ServedModel(path, meta, pipeline=joblib.load(model_path), severity=severity, cohorts=bundle)
+        model.artifact_bytes = _dir_size(model_path)
+
+    if model.engine is not None:
+        # dựng sẵn explainer (vài ms) để request ?explain=true đầu tiên không phải chờ
+        model.explainer
+    model.load_seconds = time.perf_counter() - t0
+    metrics.set_gauge("heart_model_load_seconds", model.load_seconds, version=model.version)
+    metrics.set_gauge("heart_model_artifact_bytes", model.artifact_bytes, version=model.version)
+    metrics.inc("heart_model_loads_total")
+    logger.info("Loaded model %s (%s) from %s in %.3fs",
+                model.version, model.backend, path, model.load_seconds)
+    return model
+
+
+# ===============================
+# Registry nhiều phiên bản + hot-swap
+# ===============================
+#
+# Phiên bản = thư mục có meta.json: MODEL_DIR (mô hình đóng gói sẵn) và mọi thư mục
+# con của MODEL_REGISTRY_DIR (ai/models/<version>/). Mặc định phục vụ phiên bản mới
+# nhất; admin có thể pin/rollback, trạng thái lưu ở MODEL_REGISTRY_DIR/registry.json
+# để mọi worker cùng thấy. Luồng watcher poll thư mục, nạp phiên bản mới ở nền,
+# kiểm tra trên golden set rồi mới đổi con trỏ _current (request đang chạy vẫn giữ
+# tham chiếu tới mô hình cũ nên không bị rớt).
+# Mọi lần nạp (kể cả lần đầu của mỗi worker) đi qua activate(). Phiên bản trượt golden
+# set được ghi vào registry.json ("rejected", theo mtime của meta.json) nên worker mới /
+# lần khởi động sau không phục vụ lại nó; khi đó lùi về bản tốt gần nhất ("last_good",
+# nếu đang pin) rồi các bản còn lại theo thứ tự giảm dần.
+
+STATE_FILE = "registry.json"
+
+metrics.describe("heart_model_active", "gauge", "1 for the model version currently served")
+metrics.describe("heart_model_swaps_total", "counter", "Model hot-swaps performed")
+metrics.describe("heart_model_rejected_total", "counter", "Model versions rejected by golden-set validation")
+
+_lock = threading.Lock()        # bảo vệ lần nạp đầu tiên
+_swap_lock = threading.Lock()   # tuần tự hoá activate()/pin()/rollback()
+_current = None
+_watcher = None
+
+
+class ValidationError(Exception):
+    pass
+
+
+def model_dir():
+    return str(getattr(settings, "MODEL_DIR", os.path.join(settings.BASE_DIR, "api", "model")))
+
+
+def registry_dir():
+    return str(getattr(settings, "MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(settings.BASE_DIR), "models")))
+
+
+def _version_key(version):
+    # "v1.10" > "v1.9": so sánh từng cụm số như số nguyên
+    parts = []
+    for chunk in "".join(c if c.isdigit() else " " + c + " " for c in str(version)).split():
+        parts.append((0, int(chunk), "") if chunk.isdigit() else (1, 0, chunk))
+    return parts
+
+
+def discover_versions():
+    """{version: thư mục} của mọi phiên bản hiện có trên đĩa"""
+    candidates = [model_dir()]
+    root = registry_dir()
+    if os.path.isdir(root):
+        candidates += [os.path.join(root, d) for d in sorted(os.listdir(root))]
+
+    versions = {}
+    for path in candidates:
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.isfile(meta_path):
+            continue
+        try:
+            with open(meta_path) as f:
+                version = json.load(f)["model_version"]
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Skipping %s: unreadable meta.json (%s)", path, exc)
+            continue
+        if version in versions:
+            logger.warning("Duplicate model_version %s in %s (keeping %s)", version, path, versions[version])
+            continue
+        versions[version] = path
+    return versions
+
+
+def read_state():
+    try:
+        with open(os.path.join(registry_dir(), STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"pinned": None, "history": []}
+
+
+def write_state(state):
+    os.makedirs(registry_dir(), exist_ok=True)
+    path = os.path.join(registry_dir(), STATE_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _state_lock():
+    # nhiều worker cùng đọc-sửa-ghi registry.json (pin, rejected, last_good)
+    os.makedirs(registry_dir(), exist_ok=True)
+    with open(os.path.join(registry_dir(), STATE_FILE + ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def update_state(mutate):
+    """Đọc registry.json, mutate(state) rồi ghi lại dưới khoá file"""
+    with _state_lock():
+        state = read_state()
+        mutate(state)
+        write_state(state)
+    return state
+
+
+def _rejection(state, version, path):
+    """Lý do `version` bị từ chối với đúng meta.json hiện tại, None nếu chưa bị từ chối"""
+    entry = state.get("rejected", {}).get(version)
+    if entry and entry.get("mtime") == _meta_mtime(path):
+        return entry.get("reason")
+    return None
+
+
+def _record_rejection(version, path, reason):
+    def mutate(state):
+        state.setdefault("rejected", {})[version] = {"mtime": _meta_mtime(path), "reason": reason}
+    try:
+        update_state(mutate)
+    except OSError:
+        logger.exception("Cannot record rejection of model %s", version)
+
+
+def _record_good(version):
+    state = read_state()
+    if state.get("last_good") == version and version not in state.get("rejected", {}):
+        return
+
+    def mutate(state):
+        state["last_good"] = version
+        state.get("rejected", {}).pop(version, None)
+    try:
+        update_state(mutate)
+    except OSError:
+        logger.exception("Cannot record model %s as last good", version)
+
+
+def target_version(versions=None, state=None):
+    """Phiên bản nên phục vụ: bản đã pin, nếu không thì bản mới nhất"""
+    versions = discover_versions() if versions is None else versions
+    state = read_state() if state is None else state
+    pinned = state.get("pinned")
+    if pinned in versions:
+        return pinned
+    if pinned:
+        logger.warning("Pinned model version %s not found, serving latest", pinned)
+    if not versions:
+        raise FileNotFoundError(f"No model versions in {model_dir()} or {registry_dir()}")
+    return max(versions, key=_version_key)
+
+
+def _auc(y, p):
+    pos, neg = p[y == 1], p[y == 0]
+    if not len(pos) or not len(neg):
+        return float("nan")
+    greater = (pos[:, None] > neg[None, :]).sum()
+    ties = (pos[:, None] == neg[None, :]).sum()
+    return float((greater + 0.5 * ties) / (len(pos) * len(neg)))
+
+
+def validate(model, golden_path=None):
+    """Kiểm tra mô hình mới trên golden set trước khi cho phục vụ."""
+    import numpy as np
+
+    golden_path = golden_path or str(getattr(settings, "MODEL_GOLDEN_PATH", os.path.join(model_dir(), "golden.json")))
+    if not os.path.isfile(golden_path):
+        logger.warning("No golden set at %s, skipping validation of %s", golden_path, model.version)
+        return {}
+    with open(golden_path) as f:
+        golden = json.load(f)
+
+    cols = [golden["feature_order"].index(c) for c in model.feature_order]
+    X = np.array(golden["rows"], dtype=float)[:, cols]
+    y = np.array(golden["target"])
+    p = np.asarray(model.predict_matrix(X), dtype=float)
+
+    if p.shape != y.shape or not np.all(np.isfinite(p)) or p.min() < 0 or p.max() > 1:
+        raise ValidationError("predictions on the golden set are not probabilities in [0, 1]")
+    auc = _auc(y, p)
+    min_auc = getattr(settings, "MODEL_GOLDEN_MIN_AUC", 0.75)
+    if not auc >= min_auc:
+        raise ValidationError(f"golden-set AUC {auc:.3f} < {min_auc}")
+    return {"golden_auc": auc, "golden_rows": int(len(y))}
+
+
+def _swap(model):
+    global _current
+    old = _current
+    _current = model
+    if old is not None:
+        metrics.set_gauge("heart_model_active", 0, version=old.version)
+        metrics.inc("heart_model_swaps_total")
+    metrics.set_gauge("heart_model_active", 1, version=model.version)
+    logger.info("Serving model %s (%s)", model.version, model.path)
+
+
+def activate(version, versions=None):
+    """Nạp + kiểm tra + đổi sang `version`. Lỗi thì giữ nguyên mô hình cũ."""
+    versions = discover_versions() if versions is None else versions
+    if version not in versions:
+        raise KeyError(version)
+    with _swap_lock:
+        if _current is not None and _current.version == version and _current.path == versions[version]:
+            return _current
+        model = load_model(versions[version])
+        try:
+            model.validation = validate(model)
+        except ValidationError as exc:
+            metrics.inc("heart_model_rejected_total", version=version)
+            _record_rejection(version, versions[version], str(exc))
+            raise ValidationError(f"{version}: {exc}") from exc
+        _swap(model)
+        _record_good(version)
+        return model
+
+
+def _meta_mtime(path):
+    try:
+        return os.path.getmtime(os.path.join(path, META_FILE))
+    except OSError:
+        return 0.0
+
+
+def _candidates(versions, state):
+    # phiên bản đích, rồi (khi đang pin) bản tốt gần nhất, rồi mọi bản theo thứ tự giảm dần
+    order = [target_version(versions, state)]
+    if state.get("pinned"):
+        order.append(state.get("last_good"))
+    order += sorted(versions, key=_version_key, reverse=True)
+    return [v for v in dict.fromkeys(order) if v in versions]
+
+
+def refresh():
+    """
+    Đồng bộ với đĩa: phục vụ phiên bản đầu tiên trong _candidates() chưa bị từ chối.
+    Không bao giờ lùi xuống dưới bản đang phục vụ (trừ khi pin).
+    """
+    versions = discover_versions()
+    state = read_state()
+    for version in _candidates(versions, state):
+        if _current is not None and _current.version == version:
+            break
+        if _rejection(state, version, versions[version]) is not None:
+            continue
+        try:
+            return activate(version, versions)
+        except ValidationError as exc:
+            logger.error("Not swapping to model %s", exc)
+    return _current
+
+
+def list_versions():
+    versions = discover_versions()
+    state = read_state()
+    target = target_version(versions, state) if versions else None
+    out = []
+    for version in sorted(versions, key=_version_key, reverse=True):
+        path = versions[version]
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        out.append({
+            "model_version": version,
+            "model_name": meta.get("model_name"),
+            "threshold": meta.get("threshold"),
+            "path": path,
+            "backend": "engine" if os.path.isdir(os.path.join(path, ENGINE_DIR)) else "sklearn",
+            "active": _current is not None and _current.version == version,
+            "target": version == target,
+            "pinned": version == state.get("pinned"),
+            "rejected": _rejection(state, version, path),
+        })
+    return out
+
+
+def pin(version):
+    """Pin 1 phiên bản (None = bỏ pin, theo bản mới nhất). Nạp ngay trong tiến trình này."""
+    versions = discover_versions()
+    if version is not None and version not in versions:
+        raise KeyError(version)
+    model = activate(version if version is not None else target_version(versions, {"pinned": None}), versions)
+
+    def mutate(state):
+        state["pinned"] = version
+        state["history"] = (state.get("history", []) + [model.version])[-50:]
+    update_state(mutate)
+    return model
+
+
+def rollback():
+    """Pin lại phiên bản phục vụ trước bản hiện tại."""
+    current = get_model().version
+    versions = discover_versions()
+    for version in reversed(read_state().get("history", [])):
+        if version != current and version in versions:
+            return pin(version)
+    older = [v for v in versions if _version_key(v) < _version_key(current)]
+    if not older:
+        raise KeyError("no earlier version to roll back to")
+    return pin(max(older, key=_version_key))
+
+
+class Watcher(threading.Thread):
+    """Poll thư mục mô hình mỗi MODEL_REGISTRY_POLL_SECONDS giây."""
+
+    def __init__(self, interval):
+        super().__init__(name="model-registry-watcher", daemon=True)
+        self.interval = interval
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Model registry refresh failed")
+
+
+def _ensure_watcher():
+    # thread không sống qua fork(): mỗi worker tự khởi động watcher của mình
+    global _watcher
+    interval = getattr(settings, "MODEL_REGISTRY_POLL_SECONDS", 0)
+    if interval and (_watcher is None or _watcher.pid != os.getpid()):
+        _watcher = Watcher(interval)
+        _watcher.start()
+
+
+def get_model():
+    """Mô hình đang phục vụ, nạp (và kiểm tra trên golden set) ở lần gọi đầu tiên."""
+    model = _current
+    if model is None:
+        with _lock:
+            if _current is None and refresh() is None:
+                raise ValidationError("no model version passed golden-set validation")
+            model = _current
+    _ensure_watcher()
+    return model
+
+
+def preload():
+    """Gọi trong AppConfig.ready() khi MODEL_PRELOAD=True (trước khi gunicorn fork)."""
+    return get_model()
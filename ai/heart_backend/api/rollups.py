@@ -0,0 +1,170 @@
+# ===============================
+# rollups.py – tổng hợp History theo thời gian cho /api/analytics/
+# ===============================
+#
+# HistoryRollup giữ (giờ, risk, nhóm tuổi 10 năm) -> số lượt, tổng xác suất và số lần
+# từng khuyến nghị xuất hiện. Truy vấn dashboard chỉ đọc các dòng rollup trong khoảng
+# thời gian, nên chi phí tỉ lệ với số bucket chứ không với kích thước bảng History.
+#
+# Cập nhật:
+#   - mỗi lần ghi History (save / bulk_create / write-behind flush) thêm các dòng delta
+#     trong cùng transaction: chỉ INSERT, không UPDATE 1 dòng đếm nóng nên các request
+#     đồng thời không tranh khoá nhau
+#   - `manage.py compact_rollups` (chạy định kỳ) gộp các delta cùng khóa thành 1 dòng
+#   - `manage.py rebuild_rollups` tính lại toàn bộ từ History (backfill / sửa lệch)
+# HISTORY_ROLLUPS=False: không ghi delta lúc insert, chỉ dùng rebuild_rollups.
+
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.functions import Trunc
+
+from .models import History, HistoryRollup, Recommendation
+
+GRANULARITIES = ("hour", "day", "week", "month")
+KEY_FIELDS = ("bucket", "risk", "age_band")
+
+
+def enabled():
+    return getattr(settings, "HISTORY_ROLLUPS", True)
+
+
+def bucket_of(created_at):
+    return created_at.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def age_band(age):
+    return None if age is None else int(age) // 10 * 10
+
+
+def aggregate(rows, groups=None):
+    """(created_at, risk, age, probability, recommendation_ids) -> {khóa: [count, sum p, Counter]}"""
+    groups = {} if groups is None else groups
+    for created_at, risk, age, probability, recommendation_ids in rows:
+        key = (bucket_of(created_at), risk, age_band(age))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [0, 0.0, Counter()]
+        group[0] += 1
+        group[1] += probability
+        group[2].update(recommendation_ids)
+    return groups
+
+
+def _rollups(groups):
+    return [
+        HistoryRollup(bucket=bucket, risk=risk, age_band=band, count=count,
+                      probability_sum=probability_sum, recommendation_counts=dict(counts))
+        for (bucket, risk, band), (count, probability_sum, counts) in groups.items()
+    ]
+
+
+def record(histories):
+    """Ghi delta cho các History vừa INSERT (gọi trong cùng transaction)"""
+    if not histories or not enabled():
+        return
+    groups = aggregate((h.created_at, h.risk, h.age, h.probability, h.recommendation_ids) for h in histories)
+    HistoryRollup.objects.bulk_create(_rollups(groups))
+
+
+def _lock_rollups():
+    # Postgres: chặn delta mới tới khi rebuild/compact commit; History đang INSERT dở sẽ
+    # chờ ở đây và được đếm sau, không bị tính 2 lần hay bị mất
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {HistoryRollup._meta.db_table} IN EXCLUSIVE MODE")
+
+
+def rebuild(chunk_size=2000):
+    """Xoá và tính lại toàn bộ rollup từ History. Trả về (số History, số dòng rollup)."""
+    with transaction.atomic():
+        _lock_rollups()
+        HistoryRollup.objects.all().delete()
+        rows = (History.objects.order_by()
+                .values_list("created_at", "risk", "age", "probability", "recommendation_ids")
+                .iterator(chunk_size=chunk_size))
+        n = 0
+        groups = {}
+        for row in rows:
+            aggregate([row], groups)
+            n += 1
+        HistoryRollup.objects.bulk_create(_rollups(groups), batch_size=1000)
+    return n, len(groups)
+
+
+def compact():
+    """Gộp các dòng delta cùng (bucket, risk, age_band). Trả về (số dòng trước, số dòng sau)."""
+    with transaction.atomic():
+        _lock_rollups()
+        groups = {}
+        ids = {}
+        for pk, bucket, risk, band, count, probability_sum, counts in HistoryRollup.objects.values_list(
+                "id", *KEY_FIELDS, "count", "probability_sum", "recommendation_counts").iterator(chunk_size=5000):
+            key = (bucket, risk, band)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0.0, Counter()]
+            group[0] += count
+            group[1] += probability_sum
+            group[2].update(counts)
+            ids.setdefault(key, []).append(pk)
+        merged = {key: groups[key] for key, pks in ids.items() if len(pks) > 1}
+        stale = [pk for key in merged for pk in ids[key]]
+        for start in range(0, len(stale), 1000):
+            HistoryRollup.objects.filter(id__in=stale[start:start + 1000]).delete()
+        HistoryRollup.objects.bulk_create(_rollups(merged), batch_size=1000)
+    before = sum(len(pks) for pks in ids.values())
+    return before, before - len(stale) + len(merged)
+
+
+def query(start=None, end=None, granularity="day"):
+    """
+    Chuỗi thời gian cho dashboard: mỗi bucket gồm số lượt, xác suất trung bình,
+    số lượt theo risk, theo nhóm tuổi (kèm xác suất trung bình) và các khuyến nghị.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    rollups = HistoryRollup.objects.all()
+    if start is not None:
+        rollups = rollups.filter(bucket__gte=start)
+    if end is not None:
+        rollups = rollups.filter(bucket__lt=end)
+    rows = (rollups.annotate(period=Trunc("bucket", granularity))
+            .values_list("period", "risk", "age_band", "count", "probability_sum", "recommendation_counts"))
+
+    periods = {}
+    for period, risk, band, count, probability_sum, counts in rows:
+        p = periods.get(period)
+        if p is None:
+            p = periods[period] = {"count": 0, "probability_sum": 0.0, "risk": Counter(),
+                                   "age_bands": {}, "recommendations": Counter()}
+        p["count"] += count
+        p["probability_sum"] += probability_sum
+        p["risk"][risk] += count
+        b = p["age_bands"].setdefault(band, [0, 0.0])
+        b[0] += count
+        b[1] += probability_sum
+        p["recommendations"].update(counts)
+
+    ids = {i for p in periods.values() for i in p["recommendations"]}
+    texts = dict(zip(ids, Recommendation.objects.texts_for(list(ids))))
+    result = []
+    for period in sorted(periods):
+        p = periods[period]
+        result.append({
+            "bucket": period.isoformat(),
+            "count": p["count"],
+            "mean_probability": p["probability_sum"] / p["count"] if p["count"] else None,
+            "risk": dict(p["risk"]),
+            "age_bands": [
+                {"band": None if band is None else f"{band}-{band + 9}", "count": n,
+                 "mean_probability": s / n if n else None}
+                for band, (n, s) in sorted(p["age_bands"].items(), key=lambda kv: (kv[0] is None, kv[0] or 0))
+            ],
+            "recommendations": [
+                {"id": i, "text": texts[i], "count": n} for i, n in p["recommendations"].most_common()
+            ],
+        })
+    return result
@@ -1,6 +1,12 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from django.contrib.auth.hashers import make_password
-from .models import History, PredictionHistory
+from .models import History, Recommendation
+from .authentication import user_claims
+from .cohorts import SITES
+from .whatif import parse_axes
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
@@ -21,15 +27,59 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 
 class HistorySerializer(serializers.ModelSerializer):
      risk_level = serializers.CharField(source="risk", read_only=True)
+     # property của History dựng lại JSON cũ từ cột có kiểu / id khuyến nghị
+     input_data = serializers.ReadOnlyField()
+     recommendations = serializers.ReadOnlyField()
+
+     @classmethod
+     def page_data(cls, queryset, fields=None):
+        """
+        Giống HistorySerializer(queryset, many=True).data (chỉ giữ các field trong `fields`)
+        nhưng đọc thẳng values_list các cột có kiểu, không dựng instance History / field DRF
+        cho từng ô.
+        """
+        fields = [f for f in cls.Meta.fields if fields is None or f in fields]
+        features = History.FEATURES
+        created = serializers.DateTimeField()
+        columns = {
+            "id": ("id",), "uid": ("uid",), "user": ("user_id",), "input_data": features,
+            "probability": ("probability",), "risk_level": ("risk",),
+            "recommendations": ("recommendation_ids",), "model_version": ("model_version",),
+            "created_at": ("created_at",),
+        }
+        convert = {
+            "uid": str,
+            "input_data": lambda values: dict(zip(features, values)),
+            "recommendations": Recommendation.objects.texts_for,
+            "created_at": created.to_representation,
+        }
+        names = [c for f in fields for c in columns[f]]
+        slices, start = [], 0
+        for f in fields:
+            n = len(columns[f])
+            slices.append((f, start, start + n, n == 1, convert.get(f)))
+            start += n
+
+        data = []
+        for row in queryset.values_list(*names):
+            item = {}
+            for f, lo, hi, single, conv in slices:
+                value = row[lo] if single else row[lo:hi]
+                item[f] = conv(value) if conv is not None and value is not None else value
+            data.append(item)
+        return data
+
      class Meta:
         model = History
         fields = [
             "id",
+            "uid",
             "user",
             "input_data",
             "probability",
             "risk_level",              # <- dùng đúng tên field trong model
             "recommendations",
+            "model_version",
             "created_at",
         ]
 
@@ -44,6 +94,72 @@ class PredictSerializer(serializers.Serializer):
     thalach = serializers.FloatField()
     exang = serializers.IntegerField()
     oldpeak = serializers.FloatField()
-    slope = serializers.IntegerField()
-    ca = serializers.FloatField()
-    thal = serializers.IntegerField()
\ No newline at end of file
+    # thường bị thiếu ở Hungarian / Switzerland / VA: để trống thì mô hình tự impute
+    slope = serializers.IntegerField(required=False, allow_null=True)
+    ca = serializers.FloatField(required=False, allow_null=True)
+    thal = serializers.IntegerField(required=False, allow_null=True)
+    # cơ sở lấy mẫu (tùy chọn): chọn mô hình cohort của cơ sở đó (api/cohorts.py)
+    site = serializers.ChoiceField(choices=SITES, required=False)
+
+class WhatIfSerializer(PredictSerializer):
+    """Bệnh nhân + các biến cần thay đổi (api/whatif.py); vary -> list (biến, mảng giá trị)"""
+    vary = serializers.JSONField()
+    surface = serializers.BooleanField(default=True)
+
+    def validate_vary(self, value):
+        try:
+            return parse_axes(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+
+class PartialPredictSerializer(PredictSerializer):
+    """Như PredictSerializer nhưng biến nào cũng có thể chưa có (triage từng bước)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields.values():
+            field.required = False
+            field.allow_null = True
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """/api/login/: nhúng thông tin user vào token để ClaimsJWTAuthentication không phải tra DB"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for name, value in user_claims(user).items():
+            token[name] = value
+        return token
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    /api/token/refresh/: đọc lại User từ DB và ghi claim hiện tại vào token mới.
+    RefreshToken.access_token chép mọi claim của refresh token, nên nếu không ghi lại
+    thì admin đã bị hạ quyền vẫn có is_staff cũ tới khi refresh token hết hạn.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first() if user_id else None
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        for name, value in user_claims(user).items():
+            refresh[name] = value
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except AttributeError:
+                    # chưa cài app token_blacklist
+                    pass
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data["refresh"] = str(refresh)
+        return data
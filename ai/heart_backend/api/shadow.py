@@ -0,0 +1,456 @@
+# ===============================
+# shadow.py – chấm điểm "bóng" các mô hình ứng viên trên traffic thật
+# ===============================
+#
+# Trước khi thay best_model_calibrated.pkl bằng 1 ứng viên mới (LR / RF / SVC từ
+# final.ipynb, hay 1 phiên bản trong MODEL_REGISTRY_DIR), bật SHADOW_MODELS để xem
+# ứng viên trả lời khác mô hình đang phục vụ thế nào trên input thật.
+#
+# Đường đi của request chỉ có: random() < SHADOW_SAMPLE_RATE, rồi put_nowait() tuple
+# (phiên bản live, ngưỡng, input, xác suất live) vào 1 queue có giới hạn (SHADOW_QUEUE_SIZE).
+# Queue đầy -> bỏ mẫu (đếm vào "dropped"), không bao giờ chờ. SHADOW_WORKERS luồng
+# nền gom mẫu thành lô (tới BATCH_ROWS dòng hoặc SHADOW_BATCH_SECONDS giây: RF/SVC tốn
+# gần như nhau cho 1 dòng hay vài trăm dòng, gom lô để luồng nền ít tranh CPU với
+# request), chấm từng ứng viên 1 lần cho cả lô và cộng vào thống kê trong RAM:
+#   - tỉ lệ cùng risk tier / cùng nhãn (theo ngưỡng của từng mô hình), ma trận tier
+#   - hiệu xác suất ứng viên − live: tổng, tổng |Δ|, tổng Δ², max |Δ|, histogram
+#   - latency mỗi dòng của ứng viên (histogram theo metrics.DEFAULT_BUCKETS), số lỗi
+# Mọi trường cộng được với nhau. Cứ SHADOW_FLUSH_SECONDS giây luồng nền ghi 1 dòng
+# ShadowAggregate cho mỗi (giờ, live, ứng viên); /api/shadow/ cộng các dòng trong
+# khoảng thời gian (+ phần chưa ghi của tiến trình hiện tại).
+
+import atexit
+import logging
+import math
+import os
+import queue
+import random
+import threading
+import time
+from bisect import bisect_left
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import metrics
+from .personalize import TIERS, risk_tier_index
+
+logger = logging.getLogger(__name__)
+
+# mốc histogram của Δ = p_ứng viên − p_live
+DELTA_EDGES = (-0.2, -0.1, -0.05, -0.02, 0.02, 0.05, 0.1, 0.2)
+LATENCY_EDGES = metrics.DEFAULT_BUCKETS
+BATCH_ROWS = 256   # số dòng tối đa luồng nền chấm trong 1 lần gọi
+
+metrics.describe("heart_shadow_enqueued_total", "counter", "Prediction inputs sampled for shadow scoring")
+metrics.describe("heart_shadow_dropped_total", "counter", "Shadow samples dropped because the queue was full")
+metrics.describe("heart_shadow_scored_total", "counter", "Inputs scored by a shadow candidate")
+metrics.describe("heart_shadow_errors_total", "counter", "Shadow candidate scoring failures")
+metrics.describe("heart_shadow_queue_depth", "gauge", "Shadow samples waiting for a worker")
+metrics.describe("heart_shadow_seconds", "histogram", "Shadow candidate scoring time per input row")
+
+
+def candidates():
+    """SHADOW_MODELS: list phiên bản trong registry hoặc đường dẫn thư mục mô hình"""
+    return list(getattr(settings, "SHADOW_MODELS", []))
+
+
+def sample_rate():
+    return float(getattr(settings, "SHADOW_SAMPLE_RATE", 0.1))
+
+
+def enabled():
+    return bool(candidates()) and sample_rate() > 0
+
+
+# ===============================
+# Thống kê cộng được của 1 cặp (live, ứng viên)
+# ===============================
+class Stats:
+    def __init__(self):
+        self.n = 0
+        self.errors = 0
+        self.dropped = 0
+        self.agree_tier = 0
+        self.agree_label = 0
+        self.delta_sum = 0.0
+        self.abs_delta_sum = 0.0
+        self.delta_sq_sum = 0.0
+        self.max_abs_delta = 0.0
+        self.delta_counts = np.zeros(len(DELTA_EDGES) + 1, dtype=np.int64)
+        self.tiers = np.zeros((len(TIERS), len(TIERS)), dtype=np.int64)   # [tier live, tier ứng viên]
+        self.seconds = 0.0
+        self.latency_counts = np.zeros(len(LATENCY_EDGES) + 1, dtype=np.int64)
+
+    def update(self, p_live, p_cand, threshold_live, threshold_cand, seconds):
+        """cộng 1 lô: 2 mảng xác suất cùng độ dài + thời gian chấm cả lô của ứng viên"""
+        n = len(p_live)
+        delta = p_cand - p_live
+        t_live, t_cand = risk_tier_index(p_live), risk_tier_index(p_cand)
+        self.n += n
+        self.agree_tier += int(np.count_nonzero(t_live == t_cand))
+        self.agree_label += int(np.count_nonzero((p_live >= threshold_live) == (p_cand >= threshold_cand)))
+        self.delta_sum += float(delta.sum())
+        self.abs_delta_sum += float(np.abs(delta).sum())
+        self.delta_sq_sum += float(np.dot(delta, delta))
+        self.max_abs_delta = max(self.max_abs_delta, float(np.abs(delta).max()))
+        self.delta_counts += np.bincount(np.searchsorted(DELTA_EDGES, delta, side="right"),
+                                         minlength=len(self.delta_counts))
+        np.add.at(self.tiers, (t_live, t_cand), 1)
+        # cả lô dùng chung 1 lần gọi: latency mỗi dòng = thời gian / số dòng
+        self.seconds += seconds
+        self.latency_counts[bisect_left(LATENCY_EDGES, seconds / n)] += n
+
+    def merge(self, other):
+        for key in ("n", "errors", "dropped", "agree_tier", "agree_label",
+                    "delta_sum", "abs_delta_sum", "delta_sq_sum", "seconds"):
+            setattr(self, key, getattr(self, key) + getattr(other, key))
+        self.max_abs_delta = max(self.max_abs_delta, other.max_abs_delta)
+        self.delta_counts += other.delta_counts
+        self.tiers += other.tiers
+        self.latency_counts += other.latency_counts
+        return self
+
+    def empty(self):
+        return not (self.n or self.errors or self.dropped)
+
+    def to_dict(self):
+        out = {key: getattr(self, key) for key in (
+            "n", "errors", "dropped", "agree_tier", "agree_label", "delta_sum", "abs_delta_sum",
+            "delta_sq_sum", "max_abs_delta", "seconds")}
+        out["delta_counts"] = self.delta_counts.tolist()
+        out["tiers"] = self.tiers.tolist()
+        out["latency_counts"] = self.latency_counts.tolist()
+        return out
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for key, value in data.items():
+            if key in ("delta_counts", "tiers", "latency_counts"):
+                value = np.asarray(value, dtype=np.int64)
+                if value.shape != getattr(stats, key).shape:
+                    raise ValueError(f"{key} has shape {value.shape}")
+            setattr(stats, key, value)
+        return stats
+
+    def _quantile(self, q):
+        """cận trên của bucket latency chứa phân vị q (None nếu vượt bucket cuối)"""
+        total = int(self.latency_counts.sum())
+        if not total:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.latency_counts), q * total))
+        return LATENCY_EDGES[i] if i < len(LATENCY_EDGES) else None
+
+    def summary(self):
+        n = self.n
+        return {
+            "count": n,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "tier_agreement": self.agree_tier / n if n else None,
+            "label_agreement": self.agree_label / n if n else None,
+            "mean_delta": self.delta_sum / n if n else None,
+            "mean_abs_delta": self.abs_delta_sum / n if n else None,
+            "rmse": math.sqrt(self.delta_sq_sum / n) if n else None,
+            "max_abs_delta": self.max_abs_delta if n else None,
+            "delta_bins": [f"< {DELTA_EDGES[0]:g}"]
+                          + [f"{a:g} – {b:g}" for a, b in zip(DELTA_EDGES, DELTA_EDGES[1:])]
+                          + [f">= {DELTA_EDGES[-1]:g}"],
+            "delta_counts": self.delta_counts.tolist(),
+            "tiers": TIERS,
+            "tier_matrix": self.tiers.tolist(),
+            "latency": {
+                "mean_seconds": self.seconds / n if n else None,
+                "p50_seconds": self._quantile(0.5),
+                "p95_seconds": self._quantile(0.95),
+            },
+        }
+
+
+# ===============================
+# Queue + luồng nền
+# ===============================
+class ShadowScorer:
+    def __init__(self, specs, queue_size=1000, workers=1, flush_seconds=300.0, batch_seconds=1.0):
+        self.specs = specs
+        self.flush_seconds = flush_seconds
+        self.batch_seconds = batch_seconds
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()          # _stats, _dropped
+        self._flush_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._models = {}    # spec -> ServedModel | None (nạp lỗi)
+        self._stats = {}     # (phiên bản live, ứng viên) -> Stats
+        self._dropped = {}   # phiên bản live -> số mẫu bị bỏ
+        self._last_flush = time.monotonic()
+        self._threads = [threading.Thread(target=self._run, name=f"shadow-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    # -------------------------------
+    # Phía request: không chặn
+    # -------------------------------
+    def submit(self, version, threshold, rows, probabilities):
+        try:
+            self.queue.put_nowait((version, threshold, rows, probabilities))
+        except queue.Full:
+            with self._lock:
+                self._dropped[version] = self._dropped.get(version, 0) + len(rows)
+            metrics.inc("heart_shadow_dropped_total", len(rows))
+            return False
+        metrics.inc("heart_shadow_enqueued_total", len(rows))
+        return True
+
+    # -------------------------------
+    # Phía luồng nền
+    # -------------------------------
+    def _candidate(self, spec):
+        model = self._models.get(spec, False)
+        if model is False:
+            with self._load_lock:
+                model = self._models.get(spec, False)
+                if model is False:
+                    model = self._models[spec] = _load_candidate(spec)
+        return model
+
+    def _take_batch(self, timeout):
+        """chờ 1 mẫu rồi gom thêm tới BATCH_ROWS dòng hoặc hết batch_seconds giây"""
+        items = [self.queue.get(timeout=timeout)]
+        rows = len(items[0][2])
+        deadline = time.monotonic() + self.batch_seconds
+        while rows < BATCH_ROWS:
+            wait = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=wait) if wait > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            rows += len(item[2])
+        return items
+
+    def score(self, items):
+        """Chấm các mẫu bằng mọi ứng viên, cộng vào thống kê trong RAM"""
+        by_version = {}
+        for version, threshold, rows, probabilities in items:
+            group = by_version.setdefault((version, threshold), ([], []))
+            group[0].extend(rows)
+            group[1].extend(probabilities)
+        for (version, threshold_live), (rows, probabilities) in by_version.items():
+            p_live = np.asarray(probabilities, dtype=float)
+            scored = {version}
+            for spec in self.specs:
+                model = self._candidate(spec)
+                label = candidate_label(spec, model)
+                # ứng viên chính là mô hình live, hoặc 2 spec trỏ tới cùng 1 phiên bản
+                if model is None or label in scored:
+                    continue
+                scored.add(label)
+                batch = Stats()
+                t0 = time.perf_counter()
+                try:
+                    p_cand = np.asarray(model.predict_positive(rows), dtype=float)
+                    batch.update(p_live, p_cand, threshold_live, model.threshold, time.perf_counter() - t0)
+                    metrics.inc("heart_shadow_scored_total", len(rows), candidate=label)
+                    metrics.observe("heart_shadow_seconds", batch.seconds / len(rows), candidate=label)
+                except Exception:
+                    batch = Stats()
+                    batch.errors = len(rows)
+                    metrics.inc("heart_shadow_errors_total", len(rows), candidate=label)
+                    logger.exception("Shadow candidate %s failed on %d rows", label, len(rows))
+                with self._lock:
+                    self._stats.setdefault((version, label), Stats()).merge(batch)
+
+    def _run(self):
+        while True:
+            try:
+                items = self._take_batch(timeout=min(self.flush_seconds, 5.0))
+            except queue.Empty:
+                items = None
+            try:
+                if items:
+                    self.score(items)
+                    metrics.set_gauge("heart_shadow_queue_depth", self.queue.qsize())
+                if time.monotonic() - self._last_flush >= self.flush_seconds:
+                    self.flush()
+            except Exception:
+                logger.exception("Shadow worker error")
+            finally:
+                close_old_connections()
+
+    def pending(self):
+        """Bản sao thống kê chưa ghi: {(live, ứng viên): Stats}"""
+        with self._lock:
+            out = {key: Stats().merge(stats) for key, stats in self._stats.items()}
+            self._attach_dropped(out, dict(self._dropped))
+        return out
+
+    def _attach_dropped(self, stats, dropped):
+        # mẫu bị bỏ không được ứng viên nào chấm: cộng vào mọi ứng viên của phiên bản live đó
+        labels = {label for _, label in stats} | {candidate_label(s, self._models.get(s)) for s in self.specs}
+        for version, n in dropped.items():
+            for label in labels - {version}:
+                stats.setdefault((version, label), Stats()).dropped += n
+
+    def flush(self):
+        """Ghi thống kê đã tích luỹ thành các dòng ShadowAggregate"""
+        from .models import ShadowAggregate
+        from .rollups import bucket_of
+
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            with self._lock:
+                stats, self._stats = self._stats, {}
+                dropped, self._dropped = self._dropped, {}
+            self._attach_dropped(stats, dropped)
+            rows = [ShadowAggregate(bucket=bucket_of(timezone.now()), live_version=version or "",
+                                    candidate=label, count=s.n, stats=s.to_dict())
+                    for (version, label), s in stats.items() if not s.empty()]
+            if not rows:
+                return 0
+            try:
+                ShadowAggregate.objects.bulk_create(rows)
+            except Exception:
+                # giữ lại để lần flush sau thử tiếp
+                with self._lock:
+                    for key, s in stats.items():
+                        self._stats.setdefault(key, Stats()).merge(s)
+                raise
+            return len(rows)
+
+
+def candidate_label(spec, model=None):
+    """Tên ứng viên trong thống kê: phiên bản (meta.json) nếu nạp được, nếu không thì spec"""
+    if model is not None and model.version:
+        return model.version
+    return os.path.basename(os.path.normpath(str(spec)))
+
+
+def _load_candidate(spec):
+    from .registry import discover_versions, load_model
+
+    path = discover_versions().get(spec, spec)
+    try:
+        # không mmap: ứng viên nạp 1 lần, sống cùng tiến trình
+        return load_model(path, mmap=False)
+    except Exception:
+        logger.exception("Cannot load shadow candidate %s", spec)
+        return None
+
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+
+def get_scorer():
+    # luồng nền không sống qua fork(): mỗi worker có queue/luồng riêng theo pid
+    global _scorer
+    if _scorer is None or _scorer.pid != os.getpid():
+        with _scorer_lock:
+            if _scorer is None or _scorer.pid != os.getpid():
+                _scorer = ShadowScorer(
+                    candidates(),
+                    queue_size=getattr(settings, "SHADOW_QUEUE_SIZE", 1000),
+                    workers=getattr(settings, "SHADOW_WORKERS", 1),
+                    flush_seconds=getattr(settings, "SHADOW_FLUSH_SECONDS", 300),
+                    batch_seconds=getattr(settings, "SHADOW_BATCH_SECONDS", 1.0),
+                )
+                atexit.register(_flush_at_exit, _scorer)
+    return _scorer
+
+
+def _flush_at_exit(scorer):
+    try:
+        scorer.flush()
+    except Exception:
+        logger.exception("Writing shadow aggregates at exit failed")
+
+
+def submit(model, records, probabilities):
+    """
+    Gọi sau khi đã có kết quả live: lấy mẫu theo SHADOW_SAMPLE_RATE (cả request) và đưa
+    vào queue. Không chặn, không chấm điểm trên luồng request.
+    """
+    if not enabled():
+        return False
+    rate = sample_rate()
+    if not records or (rate < 1 and random.random() >= rate):
+        return False
+    return get_scorer().submit(model.version, model.threshold, list(records), list(probabilities))
+
+
+# ===============================
+# Báo cáo + compact
+# ===============================
+def report(start=None, end=None, live_version=None, include_pending=True):
+    """Cộng các ShadowAggregate trong [start, end) theo (live, ứng viên)"""
+    from .models import ShadowAggregate
+
+    rows = ShadowAggregate.objects.all()
+    if start is not None:
+        rows = rows.filter(bucket__gte=start)
+    if end is not None:
+        rows = rows.filter(bucket__lt=end)
+    if live_version:
+        rows = rows.filter(live_version=live_version)
+    totals = {}
+    for version, label, data in rows.values_list("live_version", "candidate", "stats").iterator(chunk_size=500):
+        try:
+            stats = Stats.from_dict(data)
+        except ValueError:
+            logger.warning("Skipping shadow aggregate with a different layout (%s vs %s)", version, label)
+            continue
+        totals.setdefault((version, label), Stats()).merge(stats)
+    scorer = _scorer if _scorer is not None and _scorer.pid == os.getpid() else None
+    if include_pending and scorer is not None:
+        for key, stats in scorer.pending().items():
+            if not live_version or key[0] == live_version:
+                totals.setdefault(key, Stats()).merge(stats)
+    return [{"live_version": version, "candidate": label, **stats.summary()}
+            for (version, label), stats in sorted(totals.items())]
+
+
+def status():
+    """Cấu hình + trạng thái queue của tiến trình hiện tại"""
+    scorer = _scorer if _scorer is not None and _scorer.pid == os.getpid() else None
+    return {
+        "enabled": enabled(),
+        "candidates": candidates(),
+        "sample_rate": sample_rate(),
+        "queue_size": scorer.queue.maxsize if scorer else getattr(settings, "SHADOW_QUEUE_SIZE", 1000),
+        "queue_depth": scorer.queue.qsize() if scorer else 0,
+        "workers": len(scorer._threads) if scorer else getattr(settings, "SHADOW_WORKERS", 1),
+    }
+
+
+def compact():
+    """Gộp các ShadowAggregate cùng (giờ, live, ứng viên) thành 1 dòng. Trả về (số dòng trước, số dòng sau)."""
+    from django.db import transaction
+    from .models import ShadowAggregate
+
+    with transaction.atomic():
+        groups = {}
+        for pk, bucket, version, label, data in ShadowAggregate.objects.order_by().values_list(
+                "id", "bucket", "live_version", "candidate", "stats").iterator(chunk_size=500):
+            groups.setdefault((bucket, version, label), []).append((pk, data))
+        before = after = 0
+        for (bucket, version, label), rows in groups.items():
+            before += len(rows)
+            after += 1
+            if len(rows) == 1:
+                continue
+            try:
+                merged = Stats()
+                for _, data in rows:
+                    merged.merge(Stats.from_dict(data))
+            except ValueError:
+                after += len(rows) - 1   # khác layout: giữ nguyên
+                continue
+            ShadowAggregate.objects.filter(id__in=[pk for pk, _ in rows]).delete()
+            ShadowAggregate.objects.create(bucket=bucket, live_version=version, candidate=label,
+                                           count=merged.n, stats=merged.to_dict())
+    return before, after
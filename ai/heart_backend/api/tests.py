@@ -1,3 +1,1036 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+import unittest.mock
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+import joblib
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (authentication, cohorts, datasets, drift, engine, export, metrics, personalize, profiling, registry,
+               rollups, shadow, writebehind)
+from . import cache as predict_cache
+from .models import DriftSketch, History, HistoryRollup, Recommendation, User
+from .rollups import bucket_of
+
+MODEL_DIR = os.path.join(settings.BASE_DIR, "api", "model")
+DATA_DIR = os.path.join(os.path.dirname(settings.BASE_DIR), "data", "heart+disease")
+
+SAMPLE = {"age": 58, "sex": 1, "cp": 1, "trestbps": 148, "chol": 252, "fbs": 1, "restecg": 1,
+          "thalach": 112, "exang": 1, "oldpeak": 2.3, "slope": 2, "ca": 1, "thal": 7}
+
+
+def make_history(user, probability=0.5):
+    return History(user=user, input_data=SAMPLE, probability=probability, risk="Trung bình",
+                   recommendations=["Khám định kỳ"], model_version="test")
+
+
+# sketch drift được ghi DB từ luồng nền và lúc thoát (atexit), sau khi DB test đã bị huỷ:
+# tắt cho cả module, test của drift.py tự bật lại
+_drift_off = override_settings(DRIFT_MONITOR=False)
+
+
+def setUpModule():
+    _drift_off.enable()
+
+
+def tearDownModule():
+    drift.stop(flush=False)
+    _drift_off.disable()
+
+
+# ===============================
+# writebehind.py
+# ===============================
+class WriteBehindJournalTests(TransactionTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.user = User.objects.create(username="wb")
+        self.access = str(AccessToken.for_user(self.user))
+        self.old_queue = writebehind._queue
+        self.addCleanup(setattr, writebehind, "_queue", self.old_queue)
+
+    def test_restart_with_same_pid_replays_previous_journal(self):
+        # lần khởi động trước: 2 dòng mới vào journal, chưa kịp flush thì container chết
+        previous = writebehind.WriteBehindQueue(self.dir, batch_size=10**6, flush_seconds=3600)
+        lost = [make_history(self.user, 0.1), make_history(self.user, 0.2)]
+        previous.submit(lost)
+        previous._file.close()
+        self.assertEqual(previous.pid, os.getpid())
+
+        # khởi động lại với cùng pid: queue mới phải replay segment cũ rồi mới nhận dòng mới
+        writebehind._queue = None
+        with override_settings(HISTORY_WRITE_BEHIND=True, HISTORY_JOURNAL_DIR=self.dir,
+                               HISTORY_FLUSH_BATCH=10**6, HISTORY_FLUSH_SECONDS=3600):
+            queue = writebehind.get_queue()
+            self.assertNotEqual(queue._path, previous._path)
+            fresh = make_history(self.user, 0.3)
+            writebehind.save_histories([fresh])
+            self.assertTrue(queue.replayed.wait(10))
+            queue.flush()
+
+        self.assertEqual(
+            set(History.objects.values_list("uid", flat=True)),
+            {h.uid for h in lost + [fresh]},
+        )
+        # chỉ còn segment đang mở của queue mới
+        self.assertEqual(os.listdir(self.dir), [os.path.basename(queue._path)])
+
+    def test_replay_skips_segments_of_running_queue(self):
+        writebehind._queue = None
+        with override_settings(HISTORY_JOURNAL_DIR=self.dir, HISTORY_FLUSH_BATCH=10**6,
+                               HISTORY_FLUSH_SECONDS=3600):
+            queue = writebehind.get_queue()
+            queue.submit([make_history(self.user)])
+            self.assertEqual(writebehind.replay_orphans(self.dir), 0)
+            self.assertEqual(queue.flush(), 1)
+        self.assertEqual(History.objects.count(), 1)
+
+    async def test_async_predict_replays_orphans_off_the_event_loop(self):
+        previous = writebehind.WriteBehindQueue(self.dir, batch_size=10**6, flush_seconds=3600)
+        lost = make_history(self.user, 0.1)
+        previous.submit([lost])
+        previous._file.close()
+
+        # view async gọi get_queue() trong event loop: replay không được chạy ORM ở đó
+        writebehind._queue = None
+        with override_settings(HISTORY_WRITE_BEHIND=True, HISTORY_JOURNAL_DIR=self.dir,
+                               HISTORY_FLUSH_BATCH=10**6, HISTORY_FLUSH_SECONDS=3600):
+            r = await self.async_client.post("/api/predict/async/", SAMPLE, content_type="application/json",
+                                             headers={"Authorization": f"Bearer {self.access}"})
+            self.assertEqual(r.status_code, 200)
+            queue = writebehind._queue
+            self.assertTrue(await sync_to_async(queue.replayed.wait)(10))
+            await sync_to_async(queue.flush)()
+
+        uids = {uid async for uid in History.objects.values_list("uid", flat=True)}
+        self.assertEqual(uids, {lost.uid, uuid.UUID(r.json()["history_uid"])})
+
+
+# ===============================
+# authentication.py
+# ===============================
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="admin", password="pw-123456", is_staff=True)
+
+    def login(self):
+        r = self.client.post("/api/login/", {"username": "admin", "password": "pw-123456"})
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    def export(self, access):
+        return self.client.get("/api/history/export/", HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def test_demotion_revokes_existing_access_token(self):
+        tokens = self.login()
+        self.assertEqual(self.export(tokens["access"]).status_code, 200)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertEqual(self.export(tokens["access"]).status_code, 403)
+
+    def test_refresh_rewrites_claims_from_db(self):
+        tokens = self.login()
+        self.admin.is_staff = False
+        self.admin.save()
+        # worker khác / bản ghi đè đã hết hạn: chỉ còn claim trong token
+        cache.clear()
+        r = self.client.post("/api/token/refresh/", {"refresh": tokens["refresh"]})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.export(r.json()["access"]).status_code, 403)
+
+    def test_refresh_rejects_inactive_user(self):
+        tokens = self.login()
+        self.admin.is_active = False
+        self.admin.save()
+        r = self.client.post("/api/token/refresh/", {"refresh": tokens["refresh"]})
+        self.assertEqual(r.status_code, 401)
+
+    def test_admin_views_read_staff_flag_from_db(self):
+        tokens = self.login()
+        # worker khác: không thấy bản ghi đè (locmem), chỉ còn claim is_staff=True trong token
+        User.objects.filter(pk=self.admin.pk).update(is_staff=False)
+        cache.clear()
+        self.assertEqual(self.export(tokens["access"]).status_code, 403)
+
+    def test_claims_trusted_only_within_cache_ttl_without_shared_cache(self):
+        token = AccessToken.for_user(self.admin)
+        for name, value in authentication.user_claims(self.admin).items():
+            token[name] = value
+        User.objects.filter(pk=self.admin.pk).update(is_active=False)
+        cache.clear()
+        authentication.user_cache.clear()
+        self.addCleanup(authentication.user_cache.clear)
+        auth = authentication.ClaimsJWTAuthentication()
+
+        self.assertTrue(auth.get_user(token).is_active)
+        token["iat"] = int(time.time()) - 301
+        with self.assertRaises(AuthenticationFailed):
+            auth.get_user(token)
+        shared = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared, ignore_errors=True)
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                                                   "LOCATION": shared}}):
+            authentication.user_cache.clear()
+            self.assertTrue(auth.get_user(token).is_active)
+
+
+# ===============================
+# models.py – cache khuyến nghị
+# ===============================
+class RecommendationCacheTests(TransactionTestCase):
+    def setUp(self):
+        Recommendation.objects._ids.clear()
+        Recommendation.objects._texts.clear()
+        self.user = User.objects.create(username="rec")
+
+    def test_rolled_back_ids_are_not_cached(self):
+        text = "Câu chỉ tồn tại trong transaction bị rollback"
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Recommendation.objects.ids_for([text])
+                raise RuntimeError
+        self.assertNotIn(text, Recommendation.objects._ids)
+
+        history = make_history(self.user)
+        history.recommendations = [text]
+        history.save()
+        history.refresh_from_db()
+        self.assertTrue(Recommendation.objects.filter(pk__in=history.recommendation_ids).exists())
+        self.assertEqual(history.recommendations, [text])
+        self.assertIn(text, Recommendation.objects._ids)
+
+
+# ===============================
+# cache.py
+# ===============================
+class PredictCacheTests(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, predict_cache, "_cache", predict_cache._cache)
+        predict_cache._cache = None
+        self.user = User.objects.create(username="cached")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_model_version_is_part_of_the_key(self):
+        local = predict_cache.LocalCache(maxsize=2)
+        v1 = predict_cache.cache_key("v1.0", SAMPLE, list(SAMPLE))
+        v2 = predict_cache.cache_key("v2.0", SAMPLE, list(SAMPLE))
+        self.assertNotEqual(v1, v2)
+        self.assertEqual(v1, predict_cache.cache_key("v1.0", {k: float(v) for k, v in SAMPLE.items()}, list(SAMPLE)))
+        local.set(v1, "v1.0", {"p": 1})
+        # hot-swap: request của phiên bản mới không xoá kết quả của request còn giữ bản cũ
+        self.assertIsNone(local.get(v2, "v2.0"))
+        local.set(v2, "v2.0", {"p": 2})
+        self.assertEqual(local.get(v1, "v1.0"), {"p": 1})
+        # khóa cũ không còn được đọc bị LRU đẩy ra
+        local.set(predict_cache.cache_key("v2.0", dict(SAMPLE, age=60), list(SAMPLE)), "v2.0", {"p": 3})
+        local.set(predict_cache.cache_key("v2.0", dict(SAMPLE, age=61), list(SAMPLE)), "v2.0", {"p": 4})
+        self.assertIsNone(local.get(v1, "v1.0"))
+
+    def predict(self):
+        r = self.client.post("/api/predict/", SAMPLE, format="json")
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    @override_settings(PREDICT_CACHE="local", PREDICT_CACHE_HISTORY_ON_HIT=True)
+    def test_hit_records_history_by_default(self):
+        first, second = self.predict(), self.predict()
+        self.assertEqual((first["cached"], second["cached"]), (False, True))
+        self.assertEqual(second["probability"], first["probability"])
+        self.assertIsNotNone(second["history_id"])
+        self.assertEqual(History.objects.filter(user=self.user).count(), 2)
+
+    @override_settings(PREDICT_CACHE="local", PREDICT_CACHE_HISTORY_ON_HIT=False)
+    def test_hit_without_history(self):
+        self.predict()
+        second = self.predict()
+        self.assertTrue(second["cached"])
+        self.assertEqual((second["history_id"], second["history_uid"]), (None, None))
+        self.assertEqual(History.objects.filter(user=self.user).count(), 1)
+
+
+# ===============================
+# rollups.py
+# ===============================
+class HistoryRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="rollup")
+        self.t0 = datetime(2024, 3, 10, 8, 30, tzinfo=dt_timezone.utc)
+
+    def add(self, *rows):
+        # mỗi lần gọi = 1 lần INSERT (1 nhóm delta); row = (giờ lệch, tuổi, xác suất, risk, khuyến nghị)
+        histories = []
+        for hours, age, p, risk, recs in rows:
+            h = make_history(self.user, p)
+            h.input_data = dict(SAMPLE, age=age)
+            h.risk, h.recommendations, h.created_at = risk, recs, self.t0 + timedelta(hours=hours)
+            histories.append(h)
+        writebehind.save_histories(histories)
+
+    def snapshot(self):
+        return {g: rollups.query(granularity=g) for g in ("hour", "day", "month")}
+
+    def test_compact_and_rebuild_match_incremental_deltas(self):
+        self.add((0, 45, 0.2, "Thấp", ["Khám định kỳ"]), (0, 47, 0.6, "Cao", ["Khám định kỳ", "Bỏ thuốc lá"]))
+        self.add((0, 41, 0.4, "Thấp", ["Bỏ thuốc lá"]), (1, 63, 0.9, "Cao", []))
+        self.add((25, 47, 0.5, "Trung bình", ["Khám định kỳ"]))
+        incremental = self.snapshot()
+
+        hour = incremental["hour"][0]
+        self.assertEqual((hour["count"], hour["risk"]), (3, {"Thấp": 2, "Cao": 1}))
+        self.assertAlmostEqual(hour["mean_probability"], 0.4)
+        self.assertEqual([(b["band"], b["count"]) for b in hour["age_bands"]], [("40-49", 3)])
+        self.assertEqual({r["text"]: r["count"] for r in hour["recommendations"]},
+                         {"Khám định kỳ": 2, "Bỏ thuốc lá": 2})
+        self.assertEqual([p["count"] for p in incremental["day"]], [4, 1])
+
+        # (giờ 0, Thấp, 40) có 2 delta, (giờ 0, Cao, 40) 1, (giờ 1, Cao, 60) 1, (giờ 25, ...) 1
+        self.assertEqual(rollups.compact(), (5, 4))
+        self.assertEqual(HistoryRollup.objects.count(), 4)
+        self.assertEqual(self.snapshot(), incremental)
+        self.assertEqual(rollups.compact(), (4, 4))
+
+        self.assertEqual(rollups.rebuild(), (5, 4))
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_query_window_and_granularity(self):
+        self.add((0, 45, 0.2, "Thấp", []), (25, 55, 0.8, "Cao", []))
+        start = rollups.bucket_of(self.t0 + timedelta(hours=1))
+        self.assertEqual([p["count"] for p in rollups.query(start=start, granularity="hour")], [1])
+        self.assertEqual([p["count"] for p in rollups.query(end=start, granularity="hour")], [1])
+        with self.assertRaises(ValueError):
+            rollups.query(granularity="minute")
+
+
+# ===============================
+# /api/predict/batch/
+# ===============================
+class PredictBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="batch")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_mixed_validity_batch_returns_207(self):
+        items = [SAMPLE, dict(SAMPLE, age="abc"), dict(SAMPLE, chol=200), {"age": 50}]
+        r = self.client.post("/api/predict/batch/", items, format="json")
+        self.assertEqual(r.status_code, 207)
+        body = r.json()
+        self.assertEqual((body["count"], body["succeeded"], body["failed"]), (4, 2, 2))
+        self.assertEqual([res["index"] for res in body["results"]], [0, 1, 2, 3])
+        for res in (body["results"][0], body["results"][2]):
+            self.assertNotIn("errors", res)
+            self.assertTrue(0 <= res["probability"] <= 1)
+        self.assertIn("age", body["results"][1]["errors"])
+        self.assertIn("chol", body["results"][3]["errors"])
+        # chỉ phần tử hợp lệ được lưu, xác suất khớp với /api/predict/
+        self.assertEqual(History.objects.filter(user=self.user).count(), 2)
+        single = self.client.post("/api/predict/", SAMPLE, format="json").json()
+        self.assertAlmostEqual(single["probability"], body["results"][0]["probability"], places=12)
+
+    def test_all_valid_batch_returns_200(self):
+        r = self.client.post("/api/predict/batch/", {"items": [SAMPLE, SAMPLE]}, format="json")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["failed"], 0)
+
+
+# ===============================
+# engine.py – engine NumPy vs. pipeline sklearn
+# ===============================
+class CompiledEngineParityTests(SimpleTestCase):
+    TOL = 1e-9
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not os.path.isdir(DATA_DIR):
+            raise unittest.SkipTest(f"{DATA_DIR} not found")
+        with open(os.path.join(MODEL_DIR, "meta.json")) as f:
+            cls.meta = json.load(f)
+        cls.pipeline = joblib.load(os.path.join(MODEL_DIR, "best_model_calibrated.pkl"))
+        cls.X = datasets.load_processed(DATA_DIR)[cls.meta["feature_order"]]
+        cls.expected = cls.pipeline.predict_proba(cls.X)[:, 1]
+
+    def assert_parity(self, model):
+        got = model.predict_positive(self.X.to_numpy(dtype=float))
+        self.assertEqual(got.shape, self.expected.shape)
+        self.assertLess(float(np.max(np.abs(got - self.expected))), self.TOL)
+
+    def test_compiled_pipeline_matches_predict_proba(self):
+        manifest, arrays = engine.compile_pipeline(self.pipeline, self.meta["feature_order"])
+        self.assert_parity(engine.CompiledModel(manifest, arrays))
+
+    def test_shipped_engine_matches_predict_proba(self):
+        compiled = engine.load_engine(os.path.join(MODEL_DIR, "engine"))
+        self.assertEqual(compiled.manifest["model_version"], self.meta["model_version"])
+        self.assert_parity(compiled)
+
+
+# ===============================
+# /api/history/ – keyset pagination + ETag
+# ===============================
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="pages")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        base = timezone.now() - timedelta(days=1)
+        # 2 cặp dòng trùng created_at: thứ tự phải phân định bằng id
+        times = [base, base, base + timedelta(minutes=1), base + timedelta(minutes=2),
+                 base + timedelta(minutes=2), base + timedelta(minutes=3), base + timedelta(minutes=4)]
+        self.rows = [History.objects.create(user=self.user, input_data=SAMPLE, probability=0.1 * i,
+                                            risk="thấp", created_at=t) for i, t in enumerate(times)]
+
+    def add_row(self, created_at=None):
+        return History.objects.create(user=self.user, input_data=SAMPLE, probability=0.9, risk="cao",
+                                      created_at=created_at or timezone.now())
+
+    def get(self, **params):
+        etag = params.pop("etag", None)
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get("/api/history/", params, **headers)
+
+    def test_cursor_walk_is_stable_under_concurrent_inserts(self):
+        expected = [h.id for h in sorted(self.rows, key=lambda h: (h.created_at, h.id), reverse=True)]
+        seen, cursor = [], None
+        while True:
+            r = self.get(limit=3, **({"cursor": cursor} if cursor else {}))
+            self.assertEqual(r.status_code, 200)
+            seen += [row["id"] for row in r.json()]
+            cursor = r.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            # dòng mới chen vào giữa lúc đang lật trang: không được làm lệch các trang sau
+            self.add_row()
+        self.assertEqual(seen, expected)
+
+    def test_matching_etag_returns_304(self):
+        first = self.get(limit=3, fields="id,probability")
+        etag = first.headers["ETag"]
+        unchanged = self.get(limit=3, fields="id,probability", etag=etag)
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged.headers["ETag"], etag)
+        self.assertEqual(unchanged.headers["X-Next-Cursor"], first.headers["X-Next-Cursor"])
+
+        # trang sau cursor không đổi khi có dòng mới; trang đầu thì đổi
+        second = self.get(limit=3, cursor=first.headers["X-Next-Cursor"])
+        self.add_row()
+        self.assertEqual(self.get(limit=3, cursor=first.headers["X-Next-Cursor"],
+                                  etag=second.headers["ETag"]).status_code, 304)
+        self.assertEqual(self.get(limit=3, fields="id,probability", etag=etag).status_code, 200)
+        # projection khác -> ETag khác
+        self.assertNotEqual(self.get(limit=3).headers["ETag"], etag)
+
+
+# ===============================
+# personalize.py – bảng RULES vs. chuỗi if viết tay
+# ===============================
+def legacy_recommendations(x, p=None, shap_top=None):
+    """personalize_recommendations viết tay trước khi có bảng RULES: chuẩn để so đầu ra"""
+
+    recs = []
+
+    # -------------------------------
+    # 1. Lipid & đường huyết
+    # -------------------------------
+    if x.get("chol") is not None:
+        if x["chol"] >= 240:
+            recs.append("Cholesterol cao: giảm chất béo bão hoà/chiên xào; tăng cá, hạt, rau ≥400g/ngày.")
+        elif x["chol"] >= 200:
+            recs.append("Cholesterol cận cao: duy trì chế độ DASH/Mediterranean và theo dõi định kỳ.")
+
+    if x.get("fbs") == 1:
+        recs.append("Đường huyết đói cao: ăn ít đường tinh luyện, tăng chất xơ; vận động 150 phút/tuần.")
+
+    # -------------------------------
+    # 2. Huyết áp & gắng sức
+    # -------------------------------
+    if x.get("trestbps") is not None:
+        if x["trestbps"] >= 140:
+            recs.append("Huyết áp cao: giảm muối <5g/ngày, đi bộ nhanh 30 phút/ngày, kiểm soát stress.")
+        elif x["trestbps"] >= 130:
+            recs.append("Huyết áp tăng nhẹ: duy trì vận động đều, hạn chế rượu bia, theo dõi huyết áp.")
+
+    if x.get("thalach") is not None and x["thalach"] < 120:
+        recs.append("Thể lực thấp (thalach <120): bắt đầu tập nhẹ–vừa 20–30 phút, 5 ngày/tuần.")
+
+    if x.get("exang") == 1:
+        recs.append("Đau ngực khi gắng sức: tập mức nhẹ, ngừng lại nếu đau hoặc khó thở.")
+
+    # -------------------------------
+    # 3. ST segment & ECG
+    # -------------------------------
+    if x.get("oldpeak") is not None:
+        if x["oldpeak"] > 2.0:
+            recs.append("Oldpeak >2: giảm căng thẳng, ngủ đủ 7–8h; nên tham khảo bác sĩ.")
+        elif x["oldpeak"] > 1.0:
+            recs.append("Oldpeak 1–2: điều độ cường độ tập luyện, theo dõi triệu chứng.")
+
+    if x.get("slope") == 2:
+        recs.append("Slope downsloping: thận trọng khi gắng sức; ưu tiên bài tập nhịp nhàng.")
+
+    if x.get("restecg") not in (None, 0):
+        recs.append("Điện tâm đồ có bất thường: tránh tăng gắng sức đột ngột, theo dõi triệu chứng.")
+
+    # -------------------------------
+    # 4. Mạch vành & thal
+    # -------------------------------
+    if x.get("ca") is not None and x["ca"] >= 1:
+        recs.append("Có dấu hiệu tổn thương mạch (ca≥1): siết chặt lối sống; theo dõi HA/lipid.")
+
+    if x.get("thal") in (6, 7):
+        recs.append("Thal bất thường (6/7): tập nhẹ–vừa, theo dõi khó thở/mệt mỏi.")
+
+    # -------------------------------
+    # 5. Nhân khẩu học & triệu chứng
+    # -------------------------------
+    if x.get("age") is not None and x["age"] >= 55:
+        recs.append("Tuổi ≥55: duy trì ăn lành mạnh, vận động đều, khám 6–12 tháng/lần.")
+
+    if x.get("sex") == 1 and x.get("age", 0) >= 45:
+        recs.append("Nam ≥45 tuổi: kiểm soát vòng eo, hạn chế rượu bia, theo dõi lipid.")
+
+    if x.get("cp") in (0, 1):
+        recs.append("Có triệu chứng đau ngực: nếu đau lan tay/hàm hoặc khó thở → đi khám ngay.")
+
+    # -------------------------------
+    # 6. Nguy cơ tổng quát (từ mô hình)
+    # -------------------------------
+    if p is not None:
+        tier = "thấp" if p < 0.33 else "trung_binh" if p < 0.66 else "cao"
+        if tier == "cao":
+            recs.insert(0, "Bạn thuộc nhóm NGUY CƠ CAO: nên tham khảo bác sĩ sớm.")
+        elif tier == "trung_binh":
+            recs.insert(0, "Nguy cơ TRUNG BÌNH: áp dụng khuyến nghị và tái kiểm tra sau 1–3 tháng.")
+        else:
+            recs.insert(0, "Nguy cơ THẤP: duy trì lối sống lành mạnh và theo dõi định kỳ.")
+
+    # -------------------------------
+    # 7. SHAP feature explanation (tuỳ chọn)
+    # -------------------------------
+    if shap_top:
+        recs.append(f"Yếu tố ảnh hưởng nhiều (SHAP): {', '.join(shap_top[:3])}.")
+
+    # -------------------------------
+    # 8. Loại trùng lặp
+    # -------------------------------
+    seen = set()
+    unique_recs = []
+    for r in recs:
+        if r not in seen:
+            unique_recs.append(r)
+            seen.add(r)
+
+    return unique_recs
+
+
+class RuleEngineParityTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not os.path.isdir(DATA_DIR):
+            raise unittest.SkipTest(f"{DATA_DIR} not found")
+        df = datasets.load_processed(DATA_DIR)[personalize.FEATURES]
+        cls.rows = [{f: (None if v != v else v) for f, v in row.items()} for row in df.to_dict("records")]
+        rng = np.random.default_rng(0)
+        cls.probs = rng.random(len(cls.rows)).tolist()
+
+    def test_single_row_matches_legacy(self):
+        for x, p in zip(self.rows, self.probs):
+            for kwargs in ({}, {"p": p}, {"p": p, "shap_top": ["chol", "age", "ca", "thal"]}):
+                self.assertEqual(personalize.personalize_recommendations(x, **kwargs),
+                                 legacy_recommendations(x, **kwargs), (x, kwargs))
+
+    def test_batch_matches_legacy(self):
+        batch = personalize.personalize_batch(self.rows, p=self.probs)
+        self.assertEqual(batch, [legacy_recommendations(x, p) for x, p in zip(self.rows, self.probs)])
+
+
+# ===============================
+# migrations/0007 – input_data JSON <-> cột có kiểu
+# ===============================
+class HistoryColumnsMigrationTests(TransactionTestCase):
+    before = [("api", "0006_history_uid")]
+    after = [("api", "0007_history_typed_columns")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_forward_backward_round_trip(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model("api", "User").objects.create(username="migrate")
+        OldHistory = apps.get_model("api", "History")
+        recommendations = ["Khám định kỳ", "Huyết áp cao: giảm muối <5g/ngày, đi bộ nhanh 30 phút/ngày, kiểm soát stress."]
+        partial = dict(SAMPLE, ca=None, thal=None)
+        rows = [
+            OldHistory.objects.create(user=user, input_data=SAMPLE, probability=0.7, risk="cao",
+                                      recommendations=recommendations),
+            OldHistory.objects.create(user=user, input_data=partial, probability=0.2, risk="thấp",
+                                      recommendations=recommendations[::-1] + ["Khám định kỳ"]),
+            # giá trị kiểu chuỗi / "?" của client cũ được chuẩn hoá
+            OldHistory.objects.create(user=user, input_data=dict(SAMPLE, age="58", sex=1.0, ca="?"),
+                                      probability=0.5, risk="trung_binh", recommendations=[]),
+        ]
+        expected = [
+            (SAMPLE, recommendations),
+            (partial, recommendations[::-1] + ["Khám định kỳ"]),
+            (dict(SAMPLE, ca=None), []),
+        ]
+
+        apps = self.migrate(self.after)
+        NewHistory = apps.get_model("api", "History")
+        texts = dict(apps.get_model("api", "Recommendation").objects.values_list("id", "text"))
+        self.assertEqual(len(texts), 2)
+        for row, (data, recs) in zip(rows, expected):
+            new = NewHistory.objects.get(pk=row.pk)
+            self.assertEqual({f: getattr(new, f) for f in History.FEATURES}, data)
+            self.assertEqual([texts[i] for i in new.recommendation_ids], recs)
+
+        apps = self.migrate(self.before)
+        OldHistory = apps.get_model("api", "History")
+        for row, (data, recs) in zip(rows, expected):
+            old = OldHistory.objects.get(pk=row.pk)
+            self.assertEqual(old.input_data, data)
+            self.assertEqual(old.recommendations, recs)
+            self.assertEqual((old.probability, old.risk), (row.probability, row.risk))
+
+
+# ===============================
+# /api/metrics/ + profiler lấy mẫu
+# ===============================
+class MetricsAccessTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username="ops", is_staff=True)
+        self.user = User.objects.create(username="patient")
+
+    def bearer(self, user):
+        return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+    def test_requires_admin_or_metrics_token(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+        self.assertEqual(self.client.get("/api/metrics/", **self.bearer(self.user)).status_code, 403)
+        self.assertEqual(self.client.get("/api/metrics/", **self.bearer(self.admin)).status_code, 200)
+        with override_settings(METRICS_TOKEN="scrape-secret"):
+            self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape-secret").status_code, 200)
+            self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+
+class MultiprocessMetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        metrics.describe("heart_test_requests_total", "counter", "test")
+        metrics.describe("heart_test_inflight", "gauge", "test")
+        metrics.describe("heart_test_seconds", "histogram", "test", buckets=(0.1, 1.0))
+
+    def snapshot(self, pid, values, hist=()):
+        with open(os.path.join(self.dir, f"metrics-{pid}.json"), "w") as f:
+            json.dump({"values": values, "hist": list(hist)}, f)
+
+    def test_render_merges_all_workers(self):
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        live = os.getppid()
+        self.snapshot(live, [["heart_test_requests_total", [["view", "a"]], 5], ["heart_test_inflight", [], 7]],
+                      [["heart_test_seconds", [], [0, 1, 0, 0.5, 1]]])
+        self.snapshot(dead.pid, [["heart_test_requests_total", [["view", "a"]], 1], ["heart_test_inflight", [], 9]])
+        metrics.inc("heart_test_requests_total", 2, view="a")
+        metrics.set_gauge("heart_test_inflight", 3)
+        metrics.observe("heart_test_seconds", 0.05)
+
+        with override_settings(METRICS_MULTIPROCESS_DIR=self.dir):
+            lines = metrics.render().splitlines()
+        # counter / histogram cộng dồn (kể cả worker đã chết), gauge theo pid của worker còn sống
+        self.assertIn('heart_test_requests_total{view="a"} 8', lines)
+        self.assertEqual(sorted(l for l in lines if l.startswith("heart_test_inflight")),
+                         sorted([f'heart_test_inflight{{pid="{os.getpid()}"}} 3', f'heart_test_inflight{{pid="{live}"}} 7']))
+        self.assertIn('heart_test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('heart_test_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn("heart_test_seconds_count 2", lines)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, f"metrics-{os.getpid()}.json")))
+
+
+class SampledProfilerTests(SimpleTestCase):
+    def test_only_one_profiler_runs_at_a_time(self):
+        first, second = profiling._Profiler("cprofile"), profiling._Profiler("cprofile")
+        self.assertTrue(first.start())
+        try:
+            self.assertFalse(second.start())
+        finally:
+            first.stop()
+        self.assertTrue(second.start())
+        second.stop()
+
+
+# ===============================
+# registry.py
+# ===============================
+def copy_version(root, version, bad=False):
+    """Bản sao của api/model với model_version = `version`; bad=True đảo dấu hệ số (AUC < 0.5)"""
+    path = os.path.join(root, version)
+    shutil.copytree(MODEL_DIR, path)
+    for name in ("meta.json", os.path.join("engine", "manifest.json")):
+        with open(os.path.join(path, name)) as f:
+            doc = json.load(f)
+        doc["model_version"] = version
+        with open(os.path.join(path, name), "w") as f:
+            json.dump(doc, f)
+    if bad:
+        coef = os.path.join(path, "engine", "coef.npy")
+        np.save(coef, -np.load(coef))
+    return path
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        settings_override = override_settings(MODEL_REGISTRY_DIR=self.dir, MODEL_REGISTRY_POLL_SECONDS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(setattr, registry, "_current", registry._current)
+        self.addCleanup(setattr, registry, "_watcher", registry._watcher)
+        registry._current = None
+        registry._watcher = None
+
+    def restart(self):
+        # worker mới: chưa có mô hình trong bộ nhớ, chỉ có registry.json trên đĩa
+        registry._current = None
+        return registry.get_model()
+
+    def test_cold_start_rejects_bad_version_and_remembers_it(self):
+        copy_version(self.dir, "v2.0")
+        copy_version(self.dir, "v3.0", bad=True)
+        with self.assertLogs("api.registry", "ERROR"):
+            self.assertEqual(registry.get_model().version, "v2.0")
+        state = registry.read_state()
+        self.assertIn("golden-set AUC", state["rejected"]["v3.0"]["reason"])
+        self.assertEqual(state["last_good"], "v2.0")
+
+        # lần khởi động sau không nạp lại bản đã bị từ chối
+        with unittest.mock.patch.object(registry, "load_model", wraps=registry.load_model) as load:
+            self.assertEqual(self.restart().version, "v2.0")
+        self.assertEqual([c.args[0] for c in load.call_args_list], [os.path.join(self.dir, "v2.0")])
+        listed = {v["model_version"]: v for v in registry.list_versions()}
+        self.assertTrue(listed["v3.0"]["rejected"])
+        self.assertIsNone(listed["v2.0"]["rejected"])
+
+    def test_pin_and_rollback(self):
+        copy_version(self.dir, "v2.0")
+        self.assertEqual(registry.get_model().version, "v2.0")
+        registry.pin("v1.0")
+        self.assertEqual((registry.get_model().version, registry.read_state()["pinned"]), ("v1.0", "v1.0"))
+        self.assertEqual(self.restart().version, "v1.0")
+
+        registry.pin("v2.0")
+        self.assertEqual(registry.rollback().version, "v1.0")
+        self.assertEqual(registry.read_state()["history"], ["v1.0", "v2.0", "v1.0"])
+        registry.pin(None)
+        self.assertEqual(registry.get_model().version, "v2.0")
+        with self.assertRaises(KeyError):
+            registry.pin("v9.9")
+
+    def test_pinned_version_rejected_falls_back(self):
+        copy_version(self.dir, "v2.0", bad=True)
+        with self.assertRaises(registry.ValidationError), self.assertLogs("api.registry", "ERROR"):
+            registry.pin("v2.0")
+        self.assertEqual(registry.get_model().version, "v1.0")
+        self.assertNotEqual(registry.read_state().get("pinned"), "v2.0")
+
+    def test_watcher_swaps_to_new_version(self):
+        self.assertEqual(registry.get_model().version, "v1.0")
+        copy_version(self.dir, "v3.0", bad=True)
+        with self.assertLogs("api.registry", "ERROR"):
+            self.assertEqual(registry.refresh().version, "v1.0")
+
+        copy_version(self.dir, "v2.0")
+        watcher = registry.Watcher(0.01)
+        watcher.start()
+        try:
+            deadline = time.monotonic() + 10
+            while registry._current.version != "v2.0" and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            watcher.stopped.set()
+            watcher.join()
+        # v3.0 vẫn mới nhất nhưng đã bị từ chối: watcher đổi sang bản tốt mới nhất
+        self.assertEqual(registry._current.version, "v2.0")
+
+
+# ===============================
+# export.py
+# ===============================
+class HistoryExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username="exporter", is_staff=True)
+        self.rows = writebehind.save_histories([make_history(self.admin, p / 10) for p in range(5)])
+        self.auth = {"Authorization": f"Bearer {AccessToken.for_user(self.admin)}"}
+
+    def get(self, query=""):
+        r = self.client.get("/api/history/export/" + query, headers=self.auth)
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse(r.is_async)
+        return b"".join(r.streaming_content)
+
+    def test_csv_ndjson_and_after_id(self):
+        lines = self.get().decode().splitlines()
+        self.assertEqual(lines[0].split(","), list(export.COLUMNS))
+        self.assertEqual([int(l.split(",")[0]) for l in lines[1:]], [h.id for h in self.rows])
+
+        items = [json.loads(l) for l in self.get(f"?output=ndjson&after_id={self.rows[1].id}").splitlines()]
+        self.assertEqual([i["id"] for i in items], [h.id for h in self.rows[2:]])
+        self.assertEqual(items[0]["recommendations"], ["Khám định kỳ"])
+        self.assertEqual(self.client.get("/api/history/export/?output=xml", headers=self.auth).status_code, 400)
+
+    def test_gzip_matches_plain_stream(self):
+        plain = self.get("?output=ndjson&chunk_size=2")
+        self.assertEqual(gzip.decompress(self.get("?output=ndjson&chunk_size=2&gzip=1")), plain)
+
+    def test_resume_point_drops_partial_line(self):
+        for fmt in ("csv", "ndjson"):
+            body = self.get(f"?output={fmt}")
+            with tempfile.NamedTemporaryFile(suffix="." + fmt, delete=False) as f:
+                f.write(body[:-7])   # tiến trình chết giữa dòng cuối
+            self.addCleanup(os.remove, f.name)
+            self.assertEqual(export.resume_point(f.name, fmt), self.rows[-2].id)
+            with open(f.name, "rb") as fh:
+                self.assertEqual(fh.read(), body[:body.rstrip(b"\n").rfind(b"\n") + 1])
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+            f.write(body[:5])
+        self.addCleanup(os.remove, f.name)
+        self.assertIsNone(export.resume_point(f.name, "csv"))
+
+    async def test_asgi_streams_chunk_by_chunk(self):
+        r = await self.async_client.get("/api/history/export/?chunk_size=2", headers=self.auth)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.is_async)
+        chunks = [c async for c in r.streaming_content]
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(b"".join(chunks), await sync_to_async(self.get)("?chunk_size=2"))
+
+
+# ===============================
+# drift.py
+# ===============================
+class DriftSketchTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = np.column_stack([rng.normal(55, 9, 2000), rng.choice([1.0, 2.0, 3.0, 4.0], 2000)])
+        self.reference = drift.Reference(drift.build_reference(self.X, ["age", "cp"]))
+
+    def sketch(self, X):
+        sketch = drift.Sketch(self.reference.layout)
+        sketch.update(X)
+        return sketch
+
+    def test_update_merge_and_round_trip(self):
+        X = np.array([[40, 1], [50, 2], [np.nan, 9], [70, 4]], dtype=float)
+        whole = self.sketch(X)
+        self.assertEqual(whole.n, 4)
+        self.assertEqual(whole.missing.tolist(), [1, 0])
+        self.assertEqual(whole.lo.tolist(), [40, 1])
+        cp = slice(*self.reference.layout.offsets[1:3])
+        self.assertEqual(whole.counts[cp].tolist(), [1, 1, 0, 1, 1])   # 9 rơi vào ô "other"
+
+        merged = self.sketch(X[:1]).merge(self.sketch(X[1:]))
+        self.assertEqual(merged.to_dict(), whole.to_dict())
+        layout = self.reference.layout
+        self.assertEqual(drift.Sketch.from_dict(layout, json.loads(json.dumps(whole.to_dict()))).to_dict(),
+                         whole.to_dict())
+        with self.assertRaises(ValueError):
+            drift.Sketch.from_dict(layout, dict(whole.to_dict(), counts=[0]))
+
+    def test_compare_psi_and_ks(self):
+        same = drift.compare(self.reference, self.sketch(self.X[:1000]), min_samples=100)
+        self.assertEqual(same["age"]["status"], "ok")
+        self.assertLess(same["age"]["ks"], 0.1)
+        self.assertIsNone(same["age"]["tvd"])
+        self.assertIsNotNone(same["cp"]["tvd"])
+
+        shifted = self.X[:1000] + [15, 0]
+        report = drift.compare(self.reference, self.sketch(shifted), min_samples=100)
+        self.assertEqual(report["age"]["status"], "drift")
+        self.assertGreater(report["age"]["ks"], 0.5)
+        self.assertGreater(report["age"]["mean_shift"], 1.4)
+        self.assertEqual(report["cp"]["status"], "ok")
+
+        few = drift.compare(self.reference, self.sketch(shifted[:10]), min_samples=100)
+        self.assertEqual((few["age"]["psi"], few["age"]["status"]), (None, "insufficient_data"))
+
+
+class DriftCompactTests(TestCase):
+    def test_compact_merges_rows_of_same_bucket_and_version(self):
+        rng = np.random.default_rng(1)
+        X = np.column_stack([rng.integers(30, 80, 300), rng.choice([1.0, 2.0, 3.0], 300)]).astype(float)
+        reference = drift.Reference(drift.build_reference(X, ["age", "cp"]))
+        hour = bucket_of(timezone.now())
+        for i, part in enumerate(np.array_split(X, 4)):
+            sketch = drift.Sketch(reference.layout)
+            sketch.update(part)
+            DriftSketch.objects.create(bucket=hour - timedelta(hours=i // 3), model_version="v1.0",
+                                       count=sketch.n, sketch=sketch.to_dict())
+        before = drift.live_sketch(reference, "v1.0", include_pending=False).to_dict()
+
+        self.assertEqual(drift.compact(), (4, 2))
+        self.assertEqual(sorted(DriftSketch.objects.values_list("count", flat=True)), [75, 225])
+        self.assertEqual(drift.live_sketch(reference, "v1.0", include_pending=False).to_dict(), before)
+        self.assertEqual(drift.compact(), (2, 2))
+
+
+# ===============================
+# manage.py score_file – mô hình theo cơ sở
+# ===============================
+class ScoreFileCohortTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sklearn.linear_model import LogisticRegression
+
+        from .training import calibrated
+
+        cls.dir = tempfile.mkdtemp()
+        pipeline = joblib.load(os.path.join(MODEL_DIR, "best_model_calibrated.pkl"))
+        df = datasets.load_processed(DATA_DIR)
+        X, y = df[datasets.FEATURES], (df[datasets.TARGET] > 0).astype(int).to_numpy()
+        sites = np.array([cohorts.site_of(s) for s in df["source"]], dtype=object)
+        Z = pipeline.named_steps["pre"].transform(X)
+        names = ["cleveland", "hungarian"]
+        route_index = [datasets.FEATURES.index(f) for f in cohorts.ROUTE_FEATURES]
+        bundle = {
+            "names": names,
+            "models": [calibrated(LogisticRegression(max_iter=2000)).fit(Z[sites == s], y[sites == s]) for s in names],
+            "route_features": list(cohorts.ROUTE_FEATURES),
+            "route_table": cohorts.build_route_table(X.to_numpy(dtype=float), sites, names, route_index),
+        }
+        # cùng 1 mô hình: v9.1 phục vụ bằng engine NumPy, v9.2 bằng pipeline sklearn
+        for version, compiled in (("v9.1", True), ("v9.2", False)):
+            path = os.path.join(cls.dir, version)
+            shutil.copytree(MODEL_DIR, path, ignore=shutil.ignore_patterns("engine"))
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "meta.json"), "w") as f:
+                json.dump(dict(meta, model_version=version), f)
+            joblib.dump(bundle, os.path.join(path, "cohort_models.pkl"))
+            if compiled:
+                manifest, arrays = engine.compile_pipeline(pipeline, meta["feature_order"])
+                manifest["model_version"] = version
+                manifest["cohorts"], cohort_arrays = engine.compile_cohorts(
+                    bundle, meta["feature_order"], arrays["coef"].shape[1], len(arrays["coef"]))
+                arrays.update(cohort_arrays)
+                engine.save_engine(os.path.join(path, "engine"), manifest, arrays)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def score(self, version, source, *args):
+        out = os.path.join(self.dir, f"{version}-{len(args)}.csv")
+        with override_settings(MODEL_REGISTRY_DIR=self.dir):
+            call_command("score_file", source, out, "--model-version", version, *args, stdout=io.StringIO())
+        return pd.read_csv(out)
+
+    def test_engine_and_sklearn_route_by_site_identically(self):
+        source = os.path.join(DATA_DIR, "processed.hungarian.data")
+        served = registry.load_model(os.path.join(self.dir, "v9.2"))
+        self.assertEqual(served.backend, "sklearn")
+        compiled = self.score("v9.1", source)
+        self.assertEqual(compiled["model_version"].iloc[0], "v9.1")
+        sklearn = self.score("v9.2", source)
+        np.testing.assert_allclose(compiled["probability"], sklearn["probability"], atol=1e-9)
+
+        # site suy ra từ tên file = site ghi rõ của từng dòng
+        rows = [dict(zip(served.feature_order, x), site="hungarian")
+                for x in compiled[served.feature_order].to_numpy(dtype=float).tolist()]
+        np.testing.assert_allclose(compiled["probability"], served.predict_positive(rows), atol=1e-9)
+        self.assertEqual(set(served.cohort_of(rows)), {"hungarian"})
+
+        # --site thắng tên file, ở cả 2 đường
+        other = self.score("v9.1", source, "--site", "cleveland")
+        self.assertFalse(np.allclose(other["probability"], compiled["probability"]))
+        np.testing.assert_allclose(other["probability"], self.score("v9.2", source, "--site", "cleveland")["probability"],
+                                   atol=1e-9)
+
+
+# ===============================
+# shadow.py
+# ===============================
+class FakeCandidate:
+    def __init__(self, version, shift=0.0, threshold=0.5):
+        self.version, self.shift, self.threshold = version, shift, threshold
+
+    def predict_positive(self, rows):
+        return np.clip([r["p"] + self.shift for r in rows], 0, 1)
+
+
+class ShadowScorerTests(SimpleTestCase):
+    def scorer(self, **kwargs):
+        # workers=0: không có luồng nền, test tự gọi score()
+        scorer = shadow.ShadowScorer(["live", "cand", "cand-copy"], workers=0, **kwargs)
+        scorer._models = {"live": FakeCandidate("v1.0"), "cand": FakeCandidate("v2.0", shift=0.1),
+                          "cand-copy": FakeCandidate("v2.0", shift=0.3)}
+        return scorer
+
+    def test_full_queue_drops_and_attributes_to_candidates(self):
+        scorer = self.scorer(queue_size=1)
+        self.assertTrue(scorer.submit("v1.0", 0.5, [{"p": 0.2}], [0.2]))
+        self.assertFalse(scorer.submit("v1.0", 0.5, [{"p": 0.3}, {"p": 0.4}], [0.3, 0.4]))
+        pending = scorer.pending()
+        self.assertEqual(set(pending), {("v1.0", "v2.0")})
+        self.assertEqual((pending[("v1.0", "v2.0")].dropped, pending[("v1.0", "v2.0")].n), (2, 0))
+
+    def test_skips_live_model_and_duplicate_candidates(self):
+        scorer = self.scorer()
+        rows = [{"p": p} for p in (0.1, 0.45, 0.8)]
+        scorer.submit("v1.0", 0.5, rows, [r["p"] for r in rows])
+        scorer.score(scorer._take_batch(timeout=1))
+        stats = scorer.pending()
+        self.assertEqual(set(stats), {("v1.0", "v2.0")})
+        s = stats[("v1.0", "v2.0")]
+        # chỉ spec đầu tiên của v2.0 được chấm (Δ = +0.1), 0.45 -> 0.55 đổi nhãn
+        self.assertEqual((s.n, s.agree_label), (3, 2))
+        self.assertAlmostEqual(s.delta_sum, 0.3)
+        self.assertAlmostEqual(s.max_abs_delta, 0.1)
+
+    def test_stats_merge_and_dict_round_trip(self):
+        a, b = shadow.Stats(), shadow.Stats()
+        a.update(np.array([0.1, 0.6]), np.array([0.15, 0.4]), 0.5, 0.5, 0.002)
+        b.update(np.array([0.9]), np.array([0.95]), 0.5, 0.5, 0.001)
+        b.errors, b.dropped = 1, 4
+        merged = shadow.Stats().merge(a).merge(b)
+        self.assertEqual((merged.n, merged.errors, merged.dropped, merged.agree_label), (3, 1, 4, 2))
+        self.assertEqual(int(merged.tiers.sum()), 3)
+        self.assertAlmostEqual(merged.max_abs_delta, 0.2)
+
+        data = json.loads(json.dumps(merged.to_dict()))
+        self.assertEqual(shadow.Stats.from_dict(data).to_dict(), merged.to_dict())
+        with self.assertRaises(ValueError):
+            shadow.Stats.from_dict(dict(data, tiers=[[1]]))
@@ -0,0 +1,396 @@
+# ===============================
+# training.py – chọn mô hình + hiệu chỉnh + đóng gói (trích từ final/demo/test.ipynb)
+# ===============================
+#
+# Quy trình giống notebook: train/test split 80/20 (stratify, random_state=42),
+# tìm siêu tham số cho pipe_lr / pipe_svc / pipe_rf theo CV AUC (StratifiedKFold 5),
+# chọn họ tốt nhất, chọn ngưỡng tối ưu F1 trên xác suất out-of-fold, calibrate
+# isotonic cv=5 rồi ghi best_model_calibrated.pkl + meta.json.
+#
+# Khác notebook ở chỗ chạy nhanh hơn:
+#   - Pipeline(memory=...) cache ColumnTransformer đã fit theo từng fold: các ứng viên
+#     cùng fold không fit lại make_preprocess() từ đầu
+#   - mọi họ mô hình dùng chung 1 pool tiến trình (loky, joblib.parallel_config)
+#     thay vì mỗi GridSearchCV tự dựng pool với n_jobs=-1
+#   - search="halving": HalvingGridSearchCV loại dần ứng viên yếu trên tập con nhỏ,
+#     chỉ ứng viên tốt mới được fit trên toàn bộ dữ liệu
+#
+# Đầu "severity" (mức độ bệnh 0–4, như fit_eval_multiclass của final.ipynb) là LR
+# multinomial fit trên chính ma trận đã qua bước "pre" của mô hình nhị phân, nên lúc
+# phục vụ cả 2 đầu dùng chung 1 lần transform (api/engine.py, api/registry.py).
+#
+# Mô hình theo cơ sở (api/cohorts.py): cũng fit trên ma trận của bước "pre" dùng chung,
+# mỗi cơ sở 1 LR calibrate isotonic cv=5; chỉ giữ cơ sở nào có AUC out-of-fold không
+# kém mô hình chung trên chính các dòng của cơ sở đó.
+
+import os
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import sklearn
+from joblib import Memory, parallel_config
+from sklearn.base import clone
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import (
+    accuracy_score, brier_score_loss, f1_score, precision_recall_curve,
+    precision_score, recall_score, roc_auc_score,
+)
+from sklearn.model_selection import (
+    GridSearchCV, HalvingGridSearchCV, StratifiedKFold, cross_val_predict, train_test_split,
+)
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.svm import SVC
+
+from . import cohorts
+from .datasets import FEATURES, PROCESSED_FILES, TARGET, load_processed
+from .drift import build_reference, write_reference
+from .registry import COHORT_FILE, DRIFT_REFERENCE_FILE, SEVERITY_FILE
+
+NUM_COLS = ["age", "trestbps", "chol", "thalach", "oldpeak", "ca"]
+CAT_COLS = ["sex", "cp", "fbs", "restecg", "exang", "slope", "thal"]
+COHORT_MIN_CLASS = 10   # cơ sở có ít hơn số dòng này ở 1 lớp -> dùng mô hình chung
+
+
+def make_preprocess():
+    numeric_tf = Pipeline(steps=[
+        ("imputer", SimpleImputer(strategy="median")),
+        ("scaler", StandardScaler())
+    ])
+    categorical_tf = Pipeline(steps=[
+        ("imputer", SimpleImputer(strategy="most_frequent")),
+        ("onehot", OneHotEncoder(handle_unknown="ignore"))
+    ])
+    return ColumnTransformer(transformers=[
+        ("num", numeric_tf, NUM_COLS),
+        ("cat", categorical_tf, CAT_COLS)
+    ])
+
+
+# họ mô hình -> (classifier, lưới tham số, tài nguyên cho successive halving) như
+# demo.ipynb / test.ipynb.
+# SVC: roc_auc dùng decision_function nên không cần probability=True (Platt 5-fold
+# bên trong SVC) lúc tìm kiếm; xác suất cuối cùng lấy từ CalibratedClassifierCV.
+# RF: chi phí nằm ở số cây chứ không ở số dòng (~900), nên halving tăng dần
+# n_estimators (thay cho lưới [300, 400]); LR/SVC rẻ hơn chi phí của chính các vòng
+# halving nên luôn dùng lưới đầy đủ.
+FAMILIES = {
+    "lr": (LogisticRegression(max_iter=2000, class_weight="balanced"),
+           {"clf__C": [0.1, 0.5, 1.0, 3.0]}, None),
+    "svc": (SVC(kernel="rbf", random_state=42),
+            {"clf__C": [0.5, 1.0, 3.0], "clf__gamma": ["scale", 0.1, 0.01]}, None),
+    "rf": (RandomForestClassifier(random_state=42, class_weight="balanced"),
+           {"clf__n_estimators": [300, 400], "clf__max_features": ["sqrt", "log2"],
+            "clf__max_depth": [None, 8, 12]},
+           {"resource": "clf__n_estimators", "min_resources": "exhaust", "max_resources": 400}),
+}
+
+
+def pick_threshold_for_best_f1(y_true, y_score):
+    prec, rec, thr = precision_recall_curve(y_true, y_score)
+    f1s = 2 * prec * rec / (prec + rec + 1e-12)
+    i = np.nanargmax(f1s)
+    return max(thr[i - 1], 0.0) if i > 0 and i - 1 < len(thr) else 0.5
+
+
+def search_family(name, X, y, cv, search="halving", memory=None, seed=42):
+    """Tìm siêu tham số cho 1 họ mô hình; n_jobs lấy từ parallel_config bên ngoài"""
+    clf, grid, halving = FAMILIES[name]
+    pipe = Pipeline([("pre", make_preprocess()), ("clf", clone(clf))], memory=memory)
+    if search == "halving" and halving:
+        grid = {k: v for k, v in grid.items() if k != halving["resource"]}
+        gs = HalvingGridSearchCV(pipe, grid, scoring="roc_auc", cv=cv, factor=3,
+                                 random_state=seed, refit=False, **halving)
+    else:
+        gs = GridSearchCV(pipe, grid, scoring="roc_auc", cv=cv, refit=False)
+    t0 = time.perf_counter()
+    gs.fit(X, y)
+    return {
+        "family": name,
+        "best_params": gs.best_params_,
+        "cv_auc": float(gs.best_score_),
+        "n_candidates": len(gs.cv_results_["params"]),
+        "seconds": time.perf_counter() - t0,
+        "classifier": clone(clf).set_params(**{k[len("clf__"):]: v for k, v in gs.best_params_.items()}),
+    }
+
+
+def calibrated(clf):
+    return CalibratedClassifierCV(estimator=clone(clf), method="isotonic", cv=5)
+
+
+def fit_severity(pre, X_trainval, y_trainval, X_test, y_test, cv):
+    """
+    LR multinomial cho target 0..4 trên pre.transform(X) (pre đã fit, dùng chung với đầu
+    nhị phân). Trả về (clf, report) với Acc / F1-macro out-of-fold và trên tập test.
+    """
+    clf = LogisticRegression(max_iter=2000, class_weight="balanced")
+    Z = pre.transform(X_trainval)
+    oof = cross_val_predict(clf, Z, y_trainval, cv=cv, method="predict")
+    clf.fit(Z, y_trainval)
+    test_pred = clf.predict(pre.transform(X_test))
+    report = {
+        "classes": [int(c) for c in clf.classes_],
+        "val_accuracy": float(accuracy_score(y_trainval, oof)),
+        "val_f1_macro": float(f1_score(y_trainval, oof, average="macro")),
+        "test_accuracy": float(accuracy_score(y_test, test_pred)),
+        "test_f1_macro": float(f1_score(y_test, test_pred, average="macro")),
+    }
+    return clf, report
+
+
+def severity_for(pipeline, data_dir, files=PROCESSED_FILES, seed=42, test_size=0.2):
+    """
+    Fit đầu severity cho 1 pipeline đã có (vd. mô hình đóng gói từ notebook), dùng lại
+    bước "pre" đã fit của nó và cùng cách chia train/test như train().
+    """
+    df = load_processed(data_dir, files)
+    X = df[FEATURES]
+    y = (df[TARGET] > 0).astype(int)
+    X_trainval, X_test, _, _, y_multi_trainval, y_multi_test = train_test_split(
+        X, y, df[TARGET].astype(int), test_size=test_size, stratify=y, random_state=seed)
+    skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=seed)
+    clf, report = fit_severity(pipeline.named_steps["pre"], X_trainval, y_multi_trainval,
+                               X_test, y_multi_test, skf)
+    report["datasets"] = list(files)
+    return clf, report
+
+
+def fit_cohorts(pre, X_trainval, y_trainval, sites, oof_global, classifier, cv, min_class=COHORT_MIN_CLASS):
+    """
+    1 LR calibrate cho mỗi cơ sở trên pre.transform(X) (pre đã fit, dùng chung với mô hình
+    chung) + bảng route theo mẫu thiếu. Trả về (bundle hoặc None nếu không cơ sở nào được
+    giữ, report từng cơ sở).
+    AUC out-of-fold fit lại preprocessing trong từng fold như oof_global của train(): pre
+    đã thấy cả các dòng bị giữ lại nên chỉ dùng cho lần fit cuối.
+    """
+    Z = pre.transform(X_trainval)
+    y = np.asarray(y_trainval)
+    sites = np.asarray(sites, dtype=object)
+    names, models, report = [], [], {}
+    for site in cohorts.SITES:
+        mask = sites == site
+        counts = np.bincount(y[mask], minlength=2)
+        entry = report[site] = {"rows": int(mask.sum()), "positives": int(counts[1])}
+        if counts.min() < min_class:
+            entry["status"] = "too_few_rows"
+            continue
+        oof_pipe = Pipeline([("pre", make_preprocess()), ("clf", calibrated(classifier))])
+        with warnings.catch_warnings():
+            # cơ sở thiếu hẳn 1 biến (vd. ca ở VA) trong 1 fold: imputer bỏ cột đó, đúng ý
+            warnings.filterwarnings("ignore", "Skipping features without any observed values", UserWarning)
+            oof = cross_val_predict(oof_pipe, X_trainval[mask], y[mask], cv=cv, method="predict_proba")[:, 1]
+        entry["oof_auc"] = float(roc_auc_score(y[mask], oof))
+        entry["global_oof_auc"] = float(roc_auc_score(y[mask], oof_global[mask]))
+        entry["threshold"] = float(pick_threshold_for_best_f1(y[mask], oof))
+        if entry["oof_auc"] < entry["global_oof_auc"]:
+            entry["status"] = "global_better"
+            continue
+        entry["status"] = "cohort"
+        names.append(site)
+        models.append(calibrated(classifier).fit(Z[mask], y[mask]))
+    route_index = [FEATURES.index(f) for f in cohorts.ROUTE_FEATURES]
+    table = cohorts.build_route_table(X_trainval.to_numpy(dtype=float), sites, names, route_index)
+    if not names:
+        return None, report
+    bundle = {
+        "names": names,
+        "models": models,
+        "route_features": list(cohorts.ROUTE_FEATURES),
+        "route_table": table,
+    }
+    return bundle, report
+
+
+def evaluate_cohorts(pipeline, bundle, X_test, y_test, sites):
+    """AUC trên tập test của từng cơ sở: mô hình chung vs route theo site vs route theo mẫu thiếu"""
+    pre, clf = pipeline.named_steps["pre"], pipeline.named_steps["clf"]
+    X = X_test.to_numpy(dtype=float)
+    Z = pre.transform(X_test)
+    index = [FEATURES.index(f) for f in bundle["route_features"]]
+    routes = {
+        "by_site": cohorts.route(X, index, bundle["route_table"], bundle["names"], list(sites)),
+        "by_missingness": cohorts.route(X, index, bundle["route_table"], bundle["names"]),
+    }
+    p = {"global": clf.predict_proba(Z)[:, 1]}
+    for name, r in routes.items():
+        p[name] = cohorts.predict_routed(Z, r, clf, bundle["models"])
+    y, sites = np.asarray(y_test), np.asarray(sites, dtype=object)
+    out = {}
+    for site in cohorts.SITES:
+        mask = sites == site
+        if len(np.unique(y[mask])) < 2:
+            continue
+        out[site] = {"rows": int(mask.sum())}
+        out[site].update({f"{name}_auc": float(roc_auc_score(y[mask], q[mask])) for name, q in p.items()})
+        out[site]["routed_by_missingness"] = {
+            n: int(c) for n, c in zip(*np.unique(
+                np.asarray([cohorts.GLOBAL] + bundle["names"])[routes["by_missingness"][mask]],
+                return_counts=True))}
+    out["all"] = {f"{name}_auc": float(roc_auc_score(y, q)) for name, q in p.items()}
+    return out
+
+
+def train(data_dir, files=PROCESSED_FILES, families=("lr", "svc", "rf"), search="halving",
+          n_jobs=-1, cache_dir=None, seed=42, test_size=0.2, severity=True, cohort_models=True, log=print):
+    """
+    Huấn luyện + chọn mô hình. Trả về (pipeline đã calibrate, report, đầu severity hoặc None,
+    sketch tham chiếu của X_trainval cho api/drift.py, bundle mô hình theo cơ sở hoặc None).
+    cache_dir=None: cache preprocessing vào thư mục tạm; cache_dir=False: tắt cache.
+    """
+    timings = {}
+    t_start = time.perf_counter()
+
+    df = load_processed(data_dir, files)
+    X = df[FEATURES]
+    y = (df[TARGET] > 0).astype(int)
+    y_multi = df[TARGET].astype(int)
+    sites = df["source"].map(cohorts.site_of)
+    X_trainval, X_test, y_trainval, y_test, y_multi_trainval, y_multi_test, sites_trainval, sites_test = (
+        train_test_split(X, y, y_multi, sites, test_size=test_size, stratify=y, random_state=seed))
+    skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=seed)
+    timings["load"] = time.perf_counter() - t_start
+
+    tmp = None
+    if cache_dir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="heart-train-")
+        cache_dir = tmp.name
+    memory = Memory(cache_dir, verbose=0) if cache_dir else None
+
+    try:
+        with parallel_config(backend="loky", n_jobs=n_jobs):
+            results = []
+            for name in families:
+                res = search_family(name, X_trainval, y_trainval, skf, search, memory, seed)
+                log(f"[{name}] {res['best_params']} cv AUC={res['cv_auc']:.4f} "
+                    f"({res['n_candidates']} candidates, {res['seconds']:.1f}s)")
+                results.append(res)
+            timings["search"] = {r["family"]: r["seconds"] for r in results}
+            best = max(results, key=lambda r: r["cv_auc"])
+
+            # ngưỡng F1 trên xác suất out-of-fold của chính mô hình đã calibrate
+            t0 = time.perf_counter()
+            oof_pipe = Pipeline([("pre", make_preprocess()), ("clf", calibrated(best["classifier"]))],
+                                memory=memory)
+            oof = cross_val_predict(oof_pipe, X_trainval, y_trainval, cv=skf, method="predict_proba")[:, 1]
+            threshold = float(pick_threshold_for_best_f1(y_trainval.values, oof))
+            timings["threshold"] = time.perf_counter() - t0
+
+            # mô hình suy luận = preprocess đã fit + CalibratedClassifierCV (giống test.ipynb)
+            t0 = time.perf_counter()
+            pre = make_preprocess().fit(X_trainval, y_trainval)
+            cal = calibrated(best["classifier"]).fit(pre.transform(X_trainval), y_trainval)
+            pipeline = Pipeline([("pre", pre), ("clf", cal)])
+            timings["calibrate"] = time.perf_counter() - t0
+
+            severity_clf = severity_report = None
+            if severity:
+                t0 = time.perf_counter()
+                severity_clf, severity_report = fit_severity(
+                    pre, X_trainval, y_multi_trainval, X_test, y_multi_test, skf)
+                timings["severity"] = time.perf_counter() - t0
+                log(f"[severity] val F1-macro={severity_report['val_f1_macro']:.4f} "
+                    f"test F1-macro={severity_report['test_f1_macro']:.4f}")
+
+            bundle = cohort_report = None
+            if cohort_models and sites_trainval.nunique() > 1:
+                t0 = time.perf_counter()
+                # cohort phải là LR để xếp chồng được vào engine: dùng C đã chọn nếu có tìm họ "lr"
+                lr = next((r["classifier"] for r in results if r["family"] == "lr"), FAMILIES["lr"][0])
+                bundle, cohort_report = fit_cohorts(pre, X_trainval, y_trainval, sites_trainval.to_numpy(),
+                                                    oof, lr, skf)
+                timings["cohorts"] = time.perf_counter() - t0
+                for site, entry in cohort_report.items():
+                    log(f"[cohort {site}] {entry['status']} ({entry['rows']} rows"
+                        + (f", oof AUC={entry['oof_auc']:.4f} vs global {entry['global_oof_auc']:.4f}"
+                           if "oof_auc" in entry else "") + ")")
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    test_proba = pipeline.predict_proba(X_test)[:, 1]
+    test_pred = (test_proba >= threshold).astype(int)
+    timings["total"] = time.perf_counter() - t_start
+
+    report = {
+        "datasets": list(files),
+        "n_rows": int(len(df)),
+        "n_trainval": int(len(X_trainval)),
+        "n_test": int(len(X_test)),
+        "search": search,
+        "preprocess_cache": bool(memory),
+        "n_jobs": n_jobs,
+        "seed": seed,
+        "sklearn_version": sklearn.__version__,
+        "selected": best["family"],
+        "cv": [{k: v for k, v in r.items() if k != "classifier"} for r in results],
+        "oof_auc": float(roc_auc_score(y_trainval, oof)),
+        "test": {
+            "auc": float(roc_auc_score(y_test, test_proba)),
+            "accuracy": float(accuracy_score(y_test, test_pred)),
+            "precision": float(precision_score(y_test, test_pred, zero_division=0)),
+            "recall": float(recall_score(y_test, test_pred, zero_division=0)),
+            "f1": float(f1_score(y_test, test_pred, zero_division=0)),
+            "brier": float(brier_score_loss(y_test, test_proba)),
+        },
+        "threshold": threshold,
+        "severity": severity_report,
+        "cohorts": None if cohort_report is None else {
+            "fit": cohort_report,
+            "test": evaluate_cohorts(pipeline, bundle, X_test, y_test, sites_test) if bundle else None,
+        },
+        "timings": timings,
+    }
+    reference = build_reference(X_trainval.to_numpy(dtype=float), FEATURES,
+                                source=f"{'+'.join(files)} train split (seed={seed})")
+    return pipeline, report, severity_clf, reference, bundle
+
+
+def model_name(pipeline):
+    clf_name = pipeline.named_steps["clf"].estimator.__class__.__name__
+    return f"{clf_name}_calibrated_isotonic_cv5"
+
+
+def write_version(out_dir, version, pipeline, report, before_publish=None, severity=None, reference=None,
+                  cohort_bundle=None):
+    """
+    Ghi 1 thư mục phiên bản cho registry: best_model_calibrated.pkl (+ severity_model.pkl,
+    cohort_models.pkl, drift_reference.json) + meta.json.
+    before_publish(meta_tmp_path): chạy trước khi meta.json xuất hiện (vd. export engine).
+    """
+    import json
+    import joblib
+
+    os.makedirs(out_dir, exist_ok=True)
+    joblib.dump(pipeline, os.path.join(out_dir, "best_model_calibrated.pkl"))
+    meta = {
+        "model_name": model_name(pipeline),
+        "model_version": version,
+        "threshold": report["threshold"],
+        "feature_order": list(FEATURES),
+        "training": report,
+    }
+    if severity is not None:
+        joblib.dump(severity, os.path.join(out_dir, SEVERITY_FILE))
+        meta["severity"] = {"file": SEVERITY_FILE, "classes": [int(c) for c in severity.classes_]}
+    if cohort_bundle is not None:
+        joblib.dump(cohort_bundle, os.path.join(out_dir, COHORT_FILE))
+        meta["cohorts"] = {"file": COHORT_FILE, "names": list(cohort_bundle["names"]),
+                           "route_features": list(cohort_bundle["route_features"])}
+    if reference is not None:
+        write_reference(os.path.join(out_dir, DRIFT_REFERENCE_FILE), reference)
+    # ghi meta.json sau cùng: watcher của registry chỉ thấy phiên bản khi đã đủ file
+    tmp_path = os.path.join(out_dir, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    if before_publish is not None:
+        before_publish(tmp_path)
+    os.replace(tmp_path, os.path.join(out_dir, "meta.json"))
+    return meta
@@ -0,0 +1,204 @@
+# ===============================
+# triage.py – dự đoán tăng dần với input thiếu + chọn xét nghiệm kế tiếp theo chi phí
+# ===============================
+#
+# Logit của từng fold LR là tổng các đóng góp riêng của từng biến gốc:
+#     logit_k(x) = b_k + sum_j c_kj(x_j)
+# (biến số: w * (x - mean) / scale, biến category: trọng số của cột one-hot khớp).
+# Biến chưa đo -> đóng góp nằm trong [min_j, max_j] trên miền giá trị hợp lý (lấy từ dữ
+# liệu huấn luyện), isotonic đơn điệu nên khoảng xác suất là
+#     [mean_k iso_k(logit_lo_k), mean_k iso_k(logit_hi_k)].
+# Quyết định đã chắc chắn khi cả khoảng nằm 1 phía của ngưỡng meta.json["threshold"].
+#
+# Chọn xét nghiệm kế tiếp: với mỗi biến còn thiếu j và mỗi giá trị hỗ trợ v của nó
+# (phân vị / category của dữ liệu huấn luyện, có trọng số), tính lại khoảng khi biết
+# x_j = v; xác suất "quyết định được ngay" P_j = tổng trọng số các v làm khoảng không còn
+# chứa ngưỡng. Chọn j có P_j / chi phí lớn nhất; nếu không xét nghiệm nào tự quyết định
+# được thì chọn j thu hẹp khoảng kỳ vọng nhiều nhất trên 1 đơn vị chi phí.
+# Mọi bảng đóng góp được tính sẵn lúc nạp mô hình; mỗi bước chỉ là vài phép NumPy nhỏ.
+#
+# Chi phí lấy từ costs/heart-disease.expense (+ .delay, .group): xét nghiệm cùng nhóm
+# với 1 biến đã biết chỉ tính giá giảm (vd. thalach/exang/oldpeak/slope chung 1 lần
+# điện tâm đồ gắng sức).
+# Luôn dùng mô hình chung, không route theo cohort (api/cohorts.py): input thiếu ở đây là
+# bước trung gian của quy trình khám, không phải mẫu thiếu đặc trưng của 1 cơ sở.
+
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .explain import background_matrix
+
+COST_FILES = ("cost", "delay", "expense", "group")
+
+
+def costs_dir():
+    return str(getattr(settings, "TRIAGE_COSTS_DIR",
+                       os.path.join(settings.BASE_DIR.parent, "data", "heart+disease", "costs")))
+
+
+def _read_table(path):
+    """File dạng C4.5 "<test>:\t\t<giá trị>[, <giá trị>]." -> {test: [giá trị, ...]}"""
+    table = {}
+    with open(path) as f:
+        for line in f:
+            name, sep, value = line.partition(":")
+            if not sep:
+                continue
+            table[name.strip()] = [v.strip().rstrip(".") for v in value.split(",")]
+    return table
+
+
+def load_costs(directory=None):
+    """{biến: {"cost", "discount", "delay", "group"}} từ thư mục costs/"""
+    directory = directory or costs_dir()
+    tables = {}
+    for kind in COST_FILES:
+        path = os.path.join(directory, f"heart-disease.{kind}")
+        tables[kind] = _read_table(path) if os.path.exists(path) else {}
+    costs = {}
+    for name, (cost, *_) in tables["cost"].items():
+        expense = tables["expense"].get(name, [cost, cost])
+        costs[name] = {
+            "cost": float(expense[0]),
+            "discount": float(expense[-1]),
+            "delay": tables["delay"].get(name, ["immediate"])[0],
+            "group": tables["group"].get(name, [None])[0],
+        }
+    return costs
+
+
+class TriageModel:
+    """Bảng đóng góp theo biến của 1 CompiledModel, tính sẵn cho dự đoán với input thiếu."""
+
+    def __init__(self, engine, threshold, costs, background, n_grid=9):
+        self.engine = engine
+        self.threshold = float(threshold)
+        self.features = list(engine.feature_order)
+        F = len(self.features)
+
+        # G (n_out, F): cột transform -> biến gốc (giống explain.LinearExplainer)
+        G = np.zeros((engine.n_out, F))
+        G[np.arange(engine.n_num), engine.num_index] = 1.0
+        G[engine.n_num + np.arange(len(engine.cat_owner)), engine.cat_index[engine.cat_owner]] = 1.0
+        self.G = G
+
+        # giá trị hỗ trợ của từng biến: phân vị (biến số) hoặc category (kèm tần suất)
+        owner, values, weights = [], [], []
+        for j in range(F):
+            col = background[:, j]
+            col = col[~np.isnan(col)]
+            if j in engine.num_index:
+                v = np.quantile(col, np.linspace(0.0, 1.0, n_grid))
+                w = np.full(n_grid, 1.0 / n_grid)
+            else:
+                c = int(np.flatnonzero(engine.cat_index == j)[0])
+                v = np.asarray(engine.cat_values[engine.cat_offsets[c]:engine.cat_offsets[c + 1]], dtype=float)
+                w = np.array([(col == x).sum() for x in v], dtype=float) + 1.0   # làm trơn Laplace
+                w /= w.sum()
+            owner.append(np.full(len(v), j))
+            values.append(v)
+            weights.append(w)
+        self.owner = np.concatenate(owner)
+        self.weights = np.concatenate(weights)
+        support_values = np.concatenate(values)
+
+        # đóng góp (M, K) của từng giá trị hỗ trợ: đặt x_j = v, các biến khác lấy giá trị
+        # điền sẵn rồi chỉ giữ phần của biến j
+        X = np.full((len(self.owner), F), np.nan)
+        X[np.arange(len(self.owner)), self.owner] = support_values
+        self.support = self.contributions(X)[np.arange(len(self.owner)), :, self.owner]
+        self.lo = np.array([self.support[self.owner == j].min(axis=0) for j in range(F)])   # (F, K)
+        self.hi = np.array([self.support[self.owner == j].max(axis=0) for j in range(F)])
+
+        self.cost = np.array([costs.get(f, {}).get("cost", 0.0) for f in self.features])
+        self.discount = np.array([costs.get(f, {}).get("discount", 0.0) for f in self.features])
+        self.delay = [costs.get(f, {}).get("delay") for f in self.features]
+        self.group = [costs.get(f, {}).get("group") for f in self.features]
+
+    def contributions(self, X):
+        """(n, F) -> (n, K, F) đóng góp logit của từng biến cho từng fold"""
+        Z = self.engine.transform(X)
+        return np.einsum("nc,kc,cf->nkf", Z, self.engine.coef, self.G)
+
+    def step(self, x):
+        """
+        x: dict các biến đã biết (thiếu/None = chưa đo).
+        Trả về xác suất hiện tại (điền giá trị thiếu như mô hình), khoảng [lo, hi],
+        quyết định (nếu đã chắc chắn) và xét nghiệm nên làm tiếp.
+        """
+        row = np.array([[np.nan if x.get(f) is None else float(x[f]) for f in self.features]])
+        known = ~np.isnan(row[0])
+        Z = self.engine.transform(row)[0]
+        C = np.einsum("c,kc,cf->kf", Z, self.engine.coef, self.G)     # (K, F)
+        D = self.engine.intercept + C.sum(axis=1)
+        base = self.engine.intercept + C[:, known].sum(axis=1)
+        lo = base + self.lo[~known].sum(axis=0)
+        hi = base + self.hi[~known].sum(axis=0)
+
+        # khoảng khi biết thêm 1 biến: mọi (biến thiếu, giá trị hỗ trợ) cùng lúc
+        rows = ~known[self.owner]
+        owner = self.owner[rows]
+        lo2 = lo - self.lo[owner] + self.support[rows]
+        hi2 = hi - self.hi[owner] + self.support[rows]
+
+        # 1 lần calibrate cho tất cả: [điểm, lo, hi, lo2..., hi2...]
+        P = self.engine.calibrate(np.vstack([D, lo, hi, lo2, hi2])).mean(axis=1)
+        p, p_lo, p_hi = float(P[0]), float(P[1]), float(P[2])
+        q_lo, q_hi = P[3:3 + len(owner)], P[3 + len(owner):]
+
+        decision = None
+        if p_hi < self.threshold:
+            decision = "negative"
+        elif p_lo >= self.threshold:
+            decision = "positive"
+
+        features = self.features
+        result = {
+            "probability": p,
+            "interval": [p_lo, p_hi],
+            "threshold": self.threshold,
+            "decision": decision,
+            "known": [f for f, k in zip(features, known) if k],
+            "missing": [f for f, k in zip(features, known) if not k],
+            "next_test": None,
+            "candidates": [],
+        }
+        if decision is not None or known.all():
+            return result
+
+        w = self.weights[rows]
+        F = len(features)
+        p_decide = np.bincount(owner, w * ((q_hi < self.threshold) | (q_lo >= self.threshold)), minlength=F)
+        width = np.bincount(owner, w * (q_hi - q_lo), minlength=F)
+
+        # xét nghiệm cùng nhóm với 1 biến đã biết chỉ tính giá giảm
+        paid = {self.group[j] for j in np.flatnonzero(known)} - {None}
+        candidates = []
+        for j in np.flatnonzero(~known).tolist():
+            cost = float(self.discount[j] if self.group[j] in paid else self.cost[j])
+            candidates.append({
+                "feature": features[j],
+                "cost": cost,
+                "delay": self.delay[j],
+                "group": self.group[j],
+                "p_decide": float(p_decide[j]),
+                "expected_width": float(width[j]),
+            })
+        # có xét nghiệm tự quyết định được -> ưu tiên P(quyết định)/chi phí,
+        # không thì độ thu hẹp khoảng kỳ vọng / chi phí
+        current = p_hi - p_lo
+        candidates.sort(key=lambda c: (c["p_decide"] / max(c["cost"], 1e-9),
+                                       (current - c["expected_width"]) / max(c["cost"], 1e-9)),
+                        reverse=True)
+        result["candidates"] = candidates
+        result["next_test"] = candidates[0]["feature"]
+        return result
+
+
+def build_triage(model):
+    engine = model.compiled
+    if engine is None:
+        return None
+    return TriageModel(engine, model.threshold, load_costs(), background_matrix(engine.n_features))
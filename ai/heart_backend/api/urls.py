@@ -1,5 +1,9 @@
 from django.urls import path
-from .views import RegisterView, PredictView, HistoryView
+from .views import (
+    RegisterView, PredictView, PredictBatchView, TriageView, WhatIfView, HistoryView,
+    HistoryExportView, ModelListView, ModelPinView, ModelRollbackView, metrics_view, AnalyticsView, DriftView, ShadowView,
+)
+from .async_views import predict_async
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 # urlpatterns = [
@@ -17,5 +21,18 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     path('predict/', PredictView.as_view(), name='predict'),
+    path('predict/batch/', PredictBatchView.as_view(), name='predict_batch'),
+    path('predict/async/', predict_async, name='predict_async'),
+    path('predict/triage/', TriageView.as_view(), name='predict_triage'),
+    path('predict/whatif/', WhatIfView.as_view(), name='predict_whatif'),
     path('history/', HistoryView.as_view(), name='history'),
+    path('history/export/', HistoryExportView.as_view(), name='history_export'),
+
+    path('models/', ModelListView.as_view(), name='models'),
+    path('models/pin/', ModelPinView.as_view(), name='models_pin'),
+    path('models/rollback/', ModelRollbackView.as_view(), name='models_rollback'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('drift/', DriftView.as_view(), name='drift'),
+    path('shadow/', ShadowView.as_view(), name='shadow'),
 ]
\ No newline at end of file
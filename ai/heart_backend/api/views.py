@@ -3,27 +3,57 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
 from django.contrib.auth import get_user_model
-from .serializers import PredictSerializer, UserRegisterSerializer, HistorySerializer
-from .models import History, PredictionHistory
-from .personalize import personalize_recommendations, risk_tier
-import joblib, json
-import numpy as np
-import pandas as pd
-import os
+from .serializers import (PredictSerializer, PartialPredictSerializer, UserRegisterSerializer, HistorySerializer,
+                          WhatIfSerializer)
+from .models import History
+from .personalize import personalize_recommendations, personalize_batch, risk_tier, severity_level, severity_levels
+from .registry import get_model
+from .pagination import after_cursor, encode_cursor, page_etag
+from .writebehind import save_histories
+from .cache import cached_predict, history_on_hit
+from .profiling import stage
+from .authentication import ClaimsJWTAuthentication, IsAdminUserFromDB, staff_in_db
+from . import drift, export, metrics, registry, rollups, shadow, whatif
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, timedelta, timezone as dt_timezone
+import hmac
 
 User = get_user_model()
 
-# Load model AI
-MODEL_PATH = "api/model/best_model_calibrated.pkl"
-META_PATH = "api/model/meta.json"
 
-model = joblib.load(MODEL_PATH)
-meta = json.load(open(META_PATH))
+def wants_explanation(request):
+    """?explain=true hoặc "explain": true trong body"""
+    value = request.query_params.get("explain")
+    if value is None and isinstance(request.data, dict):
+        value = request.data.get("explain")
+    return str(value).lower() in ("1", "true", "yes")
 
-threshold = meta["threshold"]
-feature_order = meta["feature_order"]
+
+def wants_severity(request):
+    """?severity=true hoặc "severity": true trong body"""
+    value = request.query_params.get("severity")
+    if value is None and isinstance(request.data, dict):
+        value = request.data.get("severity")
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def severity_summary(distribution, classes, level):
+    """phân phối mức độ 0..4 của 1 bệnh nhân -> block "severity" của response"""
+    distribution = [float(q) for q in distribution]
+    return {
+        "distribution": {str(c): q for c, q in zip(classes, distribution)},
+        "expected": sum(c * q for c, q in zip(classes, distribution)),
+        "most_likely": classes[max(range(len(classes)), key=distribution.__getitem__)],
+        "level": level,
+    }
 
 class RegisterView(APIView):
     def post(self, request):
@@ -38,38 +68,474 @@ class PredictView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        serializer = PredictSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
-
-        # convert input -> DataFrame
-        df_input = pd.DataFrame([data])
-        prob = model.predict_proba(df_input)[0][1]
-        p = float(prob)
-
-        # risk level + recommendations
-        risk = risk_tier(p)
-        recommendations = personalize_recommendations(data, p=p)
-
-        # save history
-        history = History.objects.create(
-            user=request.user,
-            input_data=data,
-            probability=p,
-            risk=risk,
-            recommendations=recommendations
-        )
+        with stage("validate"):
+            serializer = PredictSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            data = serializer.validated_data
+
+        model = get_model()
+        explain = wants_explanation(request) and model.explainer is not None
+        # đầu severity (tùy chọn): chấm cùng lần transform với đầu nhị phân
+        severity = wants_severity(request) and model.has_severity
+        # sketch drift: đếm cả input trúng cache
+        drift.observe(model, [data])
+
+        def compute():
+            severity_info = level = None
+            with stage("predict"):
+                if severity:
+                    ps, S = model.predict_heads([data])
+                    p = float(ps[0])
+                    classes = model.severity_classes()
+                    level = severity_level(S[0], classes)
+                    severity_info = severity_summary(S[0], classes, level)
+                else:
+                    p = float(model.predict_positive([data])[0])
+            # SHAP (tùy chọn): top biến ảnh hưởng được đưa vào khuyến nghị
+            explanation = None
+            if explain:
+                with stage("explain"):
+                    explanation = model.explain([data])[0]
+            # risk level + recommendations
+            risk = risk_tier(p, level)
+            with stage("personalize"):
+                recommendations = personalize_recommendations(
+                    data, tier=risk, shap_top=explanation["top"] if explanation else None, severity=level)
+            return {"probability": p, "risk": risk, "recommendations": recommendations,
+                    "explanation": explanation, "severity": severity_info}
+
+        # giải thích SHAP không được cache, chỉ dùng cache cho request thường
+        if explain:
+            result, hit = compute(), False
+        else:
+            result, hit = cached_predict(model, data, compute, variant="severity" if severity else None)
+        # chấm bóng ứng viên (SHADOW_MODELS) ở luồng nền, không chờ
+        shadow.submit(model, [data], [result["probability"]])
+
+        body = {
+            "probability": result["probability"],
+            "risk": result["risk"],
+            "recommendations": result["recommendations"],
+            "history_id": None,
+            "history_uid": None,
+            "model_version": model.version,
+            "cached": hit
+        }
+        if explain:
+            body["explanation"] = result["explanation"]
+        if severity:
+            body["severity"] = result["severity"]
+        if model.has_cohorts:
+            # mô hình thực sự đã chấm: "global" hoặc tên cơ sở
+            body["cohort"] = model.cohort_of([data])[0]
+
+        # save history (HISTORY_WRITE_BEHIND: chưa có id, dùng history_uid)
+        if not hit or history_on_hit():
+            history = History(
+                user_id=request.user.pk,
+                input_data=data,
+                probability=result["probability"],
+                risk=result["risk"],
+                recommendations=result["recommendations"],
+                model_version=model.version
+            )
+            with stage("history"):
+                save_histories([history])
+            body["history_id"] = history.id
+            body["history_uid"] = history.uid
+
+        return Response(body, status=200)
+
+class PredictBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+    max_items = 10000
+
+    def post(self, request):
+        # body: [{...}, {...}] hoặc {"items": [{...}, ...]}
+        items = request.data
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list):
+            return Response({"detail": "Expected a list of patients or {'items': [...]}"}, status=400)
+        if len(items) > self.max_items:
+            return Response({"detail": f"Batch too large (max {self.max_items} items)"}, status=400)
+
+        # validate từng phần tử, lỗi của phần tử nào thì báo riêng phần tử đó
+        results = [None] * len(items)
+        valid_idx, valid_data = [], []
+        with stage("validate"):
+            for i, item in enumerate(items):
+                serializer = PredictSerializer(data=item)
+                if serializer.is_valid():
+                    valid_idx.append(i)
+                    valid_data.append(serializer.validated_data)
+                else:
+                    results[i] = {"index": i, "errors": serializer.errors}
+
+        if valid_data:
+            # 1 lần chấm điểm vectorized cho cả batch
+            model = get_model()
+            severity = wants_severity(request) and model.has_severity
+            drift.observe(model, valid_data)
+            levels = summaries = None
+            with stage("predict"):
+                if severity:
+                    probs, S = model.predict_heads(valid_data)
+                    classes = model.severity_classes()
+                    levels = severity_levels(S, classes)
+                    summaries = [severity_summary(s, classes, level) for s, level in zip(S.tolist(), levels)]
+                else:
+                    probs = model.predict_positive(valid_data)
+
+            probs = probs.tolist()
+            shadow.submit(model, valid_data, probs)
+            risks = [risk_tier(p, level) for p, level in zip(probs, levels or [None] * len(probs))]
+            explanations = None
+            if wants_explanation(request) and model.explainer:
+                with stage("explain"):
+                    explanations = model.explain(valid_data)
+            with stage("personalize"):
+                all_recommendations = personalize_batch(
+                    valid_data, tiers=risks, severities=levels,
+                    shap_top=[e["top"] for e in explanations] if explanations else None)
+
+            histories = []
+            for i, data, p, risk, recommendations in zip(valid_idx, valid_data, probs, risks, all_recommendations):
+                histories.append(History(
+                    user_id=request.user.pk,
+                    input_data=data,
+                    probability=p,
+                    risk=risk,
+                    recommendations=recommendations,
+                    model_version=model.version
+                ))
+                results[i] = {
+                    "index": i,
+                    "probability": p,
+                    "risk": risk,
+                    "recommendations": recommendations,
+                }
+            if explanations:
+                for i, explanation in zip(valid_idx, explanations):
+                    results[i]["explanation"] = explanation
+            if summaries:
+                for i, summary in zip(valid_idx, summaries):
+                    results[i]["severity"] = summary
+            if model.has_cohorts:
+                for i, cohort in zip(valid_idx, model.cohort_of(valid_data)):
+                    results[i]["cohort"] = cohort
 
+            # 1 câu INSERT cho cả batch (hoặc 1 lần ghi journal nếu write-behind)
+            with stage("history"):
+                histories = save_histories(histories)
+            for i, history in zip(valid_idx, histories):
+                results[i]["history_id"] = history.id
+                results[i]["history_uid"] = history.uid
+
+        # có phần tử lỗi -> 207 Multi-Status, kết quả/lỗi của từng phần tử nằm trong "results"
+        failed = len(items) - len(valid_data)
         return Response({
-            "probability": p,
-            "risk": risk,
-            "recommendations": recommendations,
-            "history_id": history.id
-        }, status=200)
+            "model_version": model.version if valid_data else None,
+            "count": len(items),
+            "succeeded": len(valid_data),
+            "failed": failed,
+            "results": results,
+        }, status=207 if failed else 200)
+
+class TriageView(APIView):
+    """
+    POST /api/predict/triage/ với input thiếu (chưa đo thì bỏ trống / null).
+    Trả về xác suất hiện tại + khoảng bất định và xét nghiệm nên làm tiếp (api/triage.py).
+    Chưa đủ input nên không lưu History.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = PartialPredictSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        model = get_model()
+        triage = model.triage
+        if triage is None:
+            return Response({"detail": f"Model {model.version} does not support triage"}, status=501)
+        with stage("triage"):
+            result = triage.step(serializer.validated_data)
+        result["risk"] = risk_tier(result["probability"])
+        result["model_version"] = model.version
+        return Response(result, status=200)
+
+class WhatIfView(APIView):
+    """
+    POST /api/predict/whatif/: bệnh nhân + "vary" (vd. {"chol": {"min": 150, "max": 300,
+    "step": 5}, "trestbps": {}}). Chấm cả lưới counterfactual trong 1 lần gọi, trả về bề mặt
+    xác suất và thay đổi nhỏ nhất để xuống từng tier thấp hơn ("surface": false để bỏ bề mặt).
+    Không lưu History.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        with stage("validate"):
+            serializer = WhatIfSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            data = dict(serializer.validated_data)
+            axes = data.pop("vary")
+            include_surface = data.pop("surface")
+
+        model = get_model()
+        with stage("predict"):
+            result = whatif.what_if(model, data, axes, include_surface=include_surface)
+        result["model_version"] = model.version
+        return Response(result, status=200)
 
 class HistoryView(APIView):
+    """
+    GET /api/history/?limit=50&cursor=...&fields=id,probability,risk_level,created_at
+    Body vẫn là list như trước; trang kế tiếp nằm ở header Link (rel="next") / X-Next-Cursor.
+    Hỗ trợ ETag / If-None-Match: trang không đổi -> 304, không đọc các cột JSON.
+    """
     permission_classes = [IsAuthenticated]
+    default_limit = 50
+    max_limit = 500
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get("limit", self.default_limit)), self.max_limit)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return Response({"detail": "limit must be a positive integer"}, status=400)
+
+        fields = request.query_params.get("fields")
+        fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        unknown = set(fields or ()) - set(HistorySerializer.Meta.fields)
+        if unknown:
+            return Response({"detail": f"Unknown fields: {', '.join(sorted(unknown))}"}, status=400)
+
+        cursor = request.query_params.get("cursor")
+        histories = History.objects.filter(user_id=request.user.pk)
+        if cursor:
+            try:
+                histories = after_cursor(histories, cursor)
+            except ValueError as exc:
+                return Response({"detail": str(exc)}, status=400)
+        histories = histories.order_by("-created_at", "-id")
+
+        # 1) chỉ đọc (id, created_at) từ index để tính ETag
+        keys = list(histories.values_list("id", "created_at")[:limit + 1])
+        has_next = len(keys) > limit
+        keys = keys[:limit]
+        etag = page_etag(keys, request.user.pk, cursor, limit, fields)
+        headers = {"ETag": etag}
+        if has_next:
+            next_cursor = encode_cursor(keys[-1][1], keys[-1][0])
+            params = request.query_params.copy()
+            params["cursor"] = next_cursor
+            headers["X-Next-Cursor"] = next_cursor
+            headers["Link"] = f'<{request.build_absolute_uri(request.path)}?{params.urlencode()}>; rel="next"'
+
+        if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+            return Response(status=304, headers=headers)
+
+        # 2) đọc đủ các cột cần cho trang này
+        serializer_fields = fields or HistorySerializer.Meta.fields
+        rows = History.objects.filter(id__in=[pk for pk, _ in keys]).order_by("-created_at", "-id")
+        return Response(HistorySerializer.page_data(rows, serializer_fields), headers=headers)
+
+
+class HistoryExportView(APIView):
+    """
+    GET /api/history/export/?output=csv|ndjson|parquet&gzip=1&start=...&end=...&user=...&after_id=...
+    Xuất History theo id tăng dần dạng luồng (api/export.py), không dựng cả bảng trong RAM.
+    Bị ngắt giữa chừng: gọi lại với after_id = id cuối cùng đã nhận.
+    """
+    permission_classes = [IsAdminUserFromDB]
+
+    def get(self, request):
+        params = request.query_params
+        fmt = params.get("output", "csv")
+        gzip = str(params.get("gzip", "")).lower() in ("1", "true", "yes")
+        try:
+            start = AnalyticsView.parse_time(params["start"]) if "start" in params else None
+            end = AnalyticsView.parse_time(params["end"]) if "end" in params else None
+            after_id = int(params["after_id"]) if "after_id" in params else None
+            chunk_size = min(max(int(params.get("chunk_size", export.DEFAULT_CHUNK_SIZE)), 1), 10000)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=400)
+
+        user_id = None
+        if "user" in params:
+            user = params["user"]
+            user_id = (int(user) if user.isdigit()
+                       else User.objects.filter(username=user).values_list("id", flat=True).first())
+            if user_id is None:
+                return Response({"detail": f"Unknown user {user!r}"}, status=404)
+
+        if fmt == "parquet" and not export.parquet_available():
+            return Response({"detail": "Parquet export requires pyarrow, which is not installed"}, status=501)
+        queryset = export.history_queryset(start, end, user_id, after_id)
+        try:
+            body = export.stream(fmt, queryset, gzip=gzip, chunk_size=chunk_size)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=400)
+        if isinstance(request._request, ASGIRequest):
+            body = export.aiter_stream(body)
+        content_type = "application/gzip" if gzip else export.FORMATS[fmt][0]
+        response = StreamingHttpResponse(body, content_type=content_type)
+        stamp = timezone.now().strftime("%Y%m%dT%H%M%SZ")
+        response["Content-Disposition"] = f'attachment; filename="{export.filename(fmt, gzip, stamp)}"'
+        return response
+
+
+class ShadowView(APIView):
+    """
+    GET /api/shadow/?hours=24 (hoặc start=/end=) [&version=v1.0]
+    Mức đồng thuận / chênh lệch xác suất / latency của các mô hình ứng viên (SHADOW_MODELS)
+    so với mô hình live trên các input được lấy mẫu (api/shadow.py).
+    """
+    permission_classes = [IsAdminUserFromDB]
+    default_hours = 24
+
+    def get(self, request):
+        try:
+            end = (AnalyticsView.parse_time(request.query_params["end"]) if "end" in request.query_params
+                   else timezone.now())
+            if "start" in request.query_params:
+                start = AnalyticsView.parse_time(request.query_params["start"])
+            else:
+                start = end - timedelta(hours=float(request.query_params.get("hours", self.default_hours)))
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=400)
+        return Response({
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            **shadow.status(),
+            "results": shadow.report(start, end, request.query_params.get("version")),
+        })
+
+class ModelListView(APIView):
+    permission_classes = [IsAdminUserFromDB]
+
+    def get(self, request):
+        return Response({
+            "active": get_model().stats(),
+            "state": registry.read_state(),
+            "versions": registry.list_versions(),
+        })
+
+
+class ModelPinView(APIView):
+    permission_classes = [IsAdminUserFromDB]
+
+    def post(self, request):
+        # {"version": "v1.1"} để pin, {"version": null} để quay lại theo bản mới nhất
+        version = request.data.get("version")
+        try:
+            model = registry.pin(version)
+        except KeyError:
+            return Response({"detail": f"Unknown model version {version!r}"}, status=404)
+        except registry.ValidationError as exc:
+            return Response({"detail": str(exc)}, status=409)
+        return Response({"active": model.stats(), "pinned": version})
+
+
+class ModelRollbackView(APIView):
+    permission_classes = [IsAdminUserFromDB]
+
+    def post(self, request):
+        try:
+            model = registry.rollback()
+        except KeyError as exc:
+            return Response({"detail": str(exc.args[0])}, status=409)
+        except registry.ValidationError as exc:
+            return Response({"detail": str(exc)}, status=409)
+        return Response({"active": model.stats(), "pinned": model.version})
+
+
+class AnalyticsView(APIView):
+    """
+    GET /api/analytics/?granularity=day&start=2026-01-01&end=2026-02-01
+    Phân bố risk, xác suất trung bình theo nhóm tuổi và tần suất khuyến nghị theo
+    từng bucket thời gian, đọc từ bảng rollup (api/rollups.py) chứ không quét History.
+    """
+    permission_classes = [IsAdminUserFromDB]
+    default_window = {"hour": timedelta(days=2), "day": timedelta(days=30),
+                      "week": timedelta(weeks=26), "month": timedelta(days=365)}
+
+    @staticmethod
+    def parse_time(value):
+        dt = parse_datetime(value)
+        if dt is None:
+            d = parse_date(value)
+            if d is None:
+                raise ValueError(f"Invalid date {value!r}")
+            dt = datetime.combine(d, datetime.min.time())
+        return dt if timezone.is_aware(dt) else timezone.make_aware(dt, dt_timezone.utc)
 
     def get(self, request):
-        histories = History.objects.filter(user=request.user).order_by("-created_at")
-        return Response(HistorySerializer(histories, many=True).data)
\ No newline at end of file
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in rollups.GRANULARITIES:
+            return Response({"detail": f"granularity must be one of {', '.join(rollups.GRANULARITIES)}"}, status=400)
+        try:
+            end = self.parse_time(request.query_params["end"]) if "end" in request.query_params else timezone.now()
+            start = (self.parse_time(request.query_params["start"]) if "start" in request.query_params
+                     else end - self.default_window[granularity])
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=400)
+        return Response({
+            "granularity": granularity,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "buckets": rollups.query(start, end, granularity),
+        })
+
+
+class DriftView(APIView):
+    """
+    GET /api/drift/?hours=24 (hoặc start=/end=) [&version=v1.0]
+    PSI / KS / độ lệch moment của input gần đây so với dữ liệu huấn luyện (api/drift.py).
+    """
+    permission_classes = [IsAdminUserFromDB]
+    default_hours = 24
+
+    def get(self, request):
+        version = request.query_params.get("version")
+        if version:
+            path = registry.discover_versions().get(version)
+            if path is None:
+                return Response({"detail": f"Unknown model version {version!r}"}, status=404)
+        else:
+            model = get_model()
+            version, path = model.version, model.path
+        try:
+            end = (AnalyticsView.parse_time(request.query_params["end"]) if "end" in request.query_params
+                   else timezone.now())
+            if "start" in request.query_params:
+                start = AnalyticsView.parse_time(request.query_params["start"])
+            else:
+                start = end - timedelta(hours=float(request.query_params.get("hours", self.default_hours)))
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=400)
+        result = drift.report(version, path, start, end)
+        if result is None:
+            return Response({"detail": f"Model {version} has no drift reference"}, status=501)
+        return Response({"start": start.isoformat(), "end": end.isoformat(), **result})
+
+
+def _metrics_allowed(request):
+    """METRICS_TOKEN (Authorization: Bearer <token>, cho Prometheus) hoặc JWT của admin"""
+    token = getattr(settings, "METRICS_TOKEN", None)
+    header = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+        return True
+    try:
+        result = ClaimsJWTAuthentication().authenticate(request)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return False
+    return bool(result) and staff_in_db(result[0])
+
+
+def metrics_view(request):
+    # có latency theo view/giai đoạn và thông tin mô hình: không mở công khai
+    if not _metrics_allowed(request):
+        return HttpResponse("Forbidden\n", status=403, content_type="text/plain")
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,155 @@
+# ===============================
+# whatif.py – "giảm biến nào, bao nhiêu thì nguy cơ giảm?" (/api/predict/whatif/)
+# ===============================
+#
+# Từ 1 bệnh nhân + các biến thay đổi được (mỗi biến 1 khoảng giá trị), dựng lưới
+# counterfactual đầy đủ và chấm điểm cả lưới trong 1 lần gọi vectorized
+# (CompiledModel.grid_positive: chỉ transform từng trục rồi cộng broadcast logit).
+# Trả về bề mặt xác suất và, với mỗi tier thấp hơn tier hiện tại, thay đổi nhỏ nhất
+# (tổng |Δ| theo đơn vị độ lệch chuẩn của dữ liệu huấn luyện) để xuống được tier đó.
+
+import numpy as np
+from django.conf import settings
+
+from .personalize import TIERS, risk_tier_index
+
+# biến thay đổi được -> khoảng mặc định (min, max, bước) hoặc danh sách giá trị
+MODIFIABLE = {
+    "chol": (120.0, 400.0, 10.0),
+    "trestbps": (90.0, 200.0, 5.0),
+    "thalach": (70.0, 210.0, 5.0),
+    "oldpeak": (0.0, 6.0, 0.2),
+    "fbs": [0, 1],
+    "exang": [0, 1],
+}
+
+
+def max_points():
+    return getattr(settings, "WHATIF_MAX_POINTS", 50000)
+
+
+def _axis_values(feature, spec):
+    default = MODIFIABLE[feature]
+    if spec is None or spec is True:
+        spec = default if isinstance(default, list) else dict(zip(("min", "max", "step"), default))
+    if isinstance(spec, list):
+        values = spec
+    elif isinstance(spec, dict) and "values" in spec:
+        values = spec["values"]
+    elif isinstance(spec, dict) and not isinstance(default, list):
+        lo, hi, step = (float(spec.get(k, d)) for k, d in zip(("min", "max", "step"), default))
+        if step <= 0 or hi < lo:
+            raise ValueError(f"{feature}: need min <= max and step > 0")
+        if (hi - lo) / step > max_points():
+            raise ValueError(f"{feature}: too many grid values")
+        # làm tròn để 0.1 + 0.2 không thành 0.30000000000000004 trong response
+        return np.round(np.arange(lo, hi + step / 2, step), 6)
+    else:
+        raise ValueError(f"{feature}: expected a list of values or {{min, max, step}}")
+    try:
+        values = np.unique(np.asarray(values, dtype=float))
+    except (TypeError, ValueError):
+        raise ValueError(f"{feature}: values must be numbers")
+    if not len(values) or np.isnan(values).any():
+        raise ValueError(f"{feature}: values must be non-empty numbers")
+    return values
+
+
+def parse_axes(vary):
+    """
+    "vary": ["chol", "trestbps"] (khoảng mặc định) hoặc
+            {"chol": {"min": 150, "max": 300, "step": 5}, "fbs": [0, 1]}
+    -> list (biến, mảng giá trị). ValueError nếu không hợp lệ / lưới quá lớn.
+    """
+    if isinstance(vary, (list, tuple)):
+        vary = dict.fromkeys(vary)
+    if not isinstance(vary, dict) or not vary:
+        raise ValueError("Expected a non-empty list or object of features to vary")
+    unknown = [f for f in vary if f not in MODIFIABLE]
+    if unknown:
+        raise ValueError(f"Cannot vary {', '.join(map(str, unknown))}; modifiable: {', '.join(MODIFIABLE)}")
+    axes = [(f, _axis_values(f, spec)) for f, spec in vary.items()]
+    points = int(np.prod([len(v) for _, v in axes]))
+    if points > max_points():
+        raise ValueError(f"Grid has {points} points (max {max_points()})")
+    return axes
+
+
+def _units(compiled, feature_order, axes):
+    """đơn vị khoảng cách của từng trục: độ lệch chuẩn (biến số) hoặc 1 (biến one-hot)"""
+    units = []
+    num = {int(col): float(s) for col, s in zip(compiled.num_index, compiled.num_scale)} if compiled else {}
+    for feature, _ in axes:
+        units.append(num.get(feature_order.index(feature), 1.0))
+    return units
+
+
+def surface(model, data, axes):
+    """Xác suất trên toàn lưới, shape (len(v1), len(v2), ...)"""
+    order = model.feature_order
+    x = np.array([data.get(f) for f in order], dtype=float)
+    compiled = model.compiled
+    if compiled is not None:
+        route = compiled.route(x, [data.get("site")])
+        return compiled.grid_positive(x, [(order.index(f), v) for f, v in axes],
+                                      route=None if route is None else int(route[0]))
+    # mô hình không biên dịch được (SVC/RF): chấm toàn bộ lưới 1 lần
+    grids = np.meshgrid(*[v for _, v in axes], indexing="ij")
+    X = np.repeat(x[None, :], grids[0].size, axis=0)
+    for (f, _), g in zip(axes, grids):
+        X[:, order.index(f)] = g.ravel()
+    return np.asarray(model.predict_matrix(X), dtype=float).reshape(grids[0].shape)
+
+
+def _point(axes, index, data, P, distance):
+    changes = {}
+    for (f, values), i in zip(axes, index):
+        to = float(values[i])
+        if to != data.get(f):
+            changes[f] = {"from": data.get(f), "to": to, "delta": to - float(data.get(f))}
+    p = float(P[index])
+    return {"probability": p, "risk": TIERS[int(risk_tier_index(p))], "changes": changes,
+            "distance": float(distance[index])}
+
+
+def what_if(model, data, axes, include_surface=True):
+    """Bề mặt nguy cơ + thay đổi nhỏ nhất để xuống từng tier thấp hơn"""
+    order = model.feature_order
+    P = surface(model, data, axes)
+    p0 = float(model.predict_positive([data])[0])
+    tier0 = int(risk_tier_index(p0))
+
+    # khoảng cách tới input hiện tại, cộng broadcast từng trục
+    distance = np.zeros([1] * len(axes))
+    for a, ((f, values), unit) in enumerate(zip(axes, _units(model.compiled, order, axes))):
+        view = [1] * len(axes)
+        view[a] = len(values)
+        distance = distance + (np.abs(values - float(data.get(f))) / unit).reshape(view)
+    distance = np.broadcast_to(distance, P.shape)
+    tiers = risk_tier_index(P)
+
+    targets = []
+    for t in range(tier0 - 1, -1, -1):
+        cost = np.where(tiers <= t, distance, np.inf)
+        best = cost.min()
+        if not np.isfinite(best):
+            targets.append({"risk": TIERS[t], "reachable": False})
+            continue
+        # cùng khoảng cách: chọn điểm có xác suất thấp nhất
+        candidates = np.flatnonzero(cost.ravel() <= best + 1e-12)
+        flat = candidates[np.argmin(P.ravel()[candidates])]
+        targets.append({"risk": TIERS[t], "reachable": True,
+                        **_point(axes, np.unravel_index(flat, P.shape), data, P, distance)})
+
+    result = {
+        "probability": p0,
+        "risk": TIERS[tier0],
+        "features": [f for f, _ in axes],
+        "values": {f: v.tolist() for f, v in axes},
+        "points": int(P.size),
+        "targets": targets,
+        "lowest": _point(axes, np.unravel_index(int(np.argmin(P)), P.shape), data, P, distance),
+    }
+    if include_surface:
+        result["surface"] = P.tolist()
+    return result
@@ -0,0 +1,268 @@
+# ===============================
+# writebehind.py – ghi History kiểu write-behind (HISTORY_WRITE_BEHIND=True)
+# ===============================
+#
+# Request chỉ append 1 dòng JSON vào journal cục bộ + đưa vào buffer trong RAM rồi trả
+# về ngay với uid (UUID sinh trong app, không cần chờ khóa chính của DB). Luồng nền
+# flush buffer xuống DB bằng bulk_create khi đủ HISTORY_FLUSH_BATCH dòng hoặc sau
+# HISTORY_FLUSH_SECONDS giây.
+#
+# Journal chia theo segment: journal-<pid>-<token>-<seq>.jsonl (token ngẫu nhiên cho mỗi
+# queue: container khởi động lại thường có cùng pid, token giữ cho queue mới không ghi nối
+# vào segment cũ). Khi flush, segment hiện tại được đóng lại (request mới ghi sang segment
+# mới), ghi DB xong mới xoá file. Worker chết giữa chừng -> segment còn lại trên đĩa,
+# worker khởi động sau (hoặc `manage.py replay_history_journal`) đọc lại và bulk_create
+# với ignore_conflicts trên uid (idempotent). Thư mục journal phải riêng cho từng máy /
+# container: pid của tiến trình khác chỉ có nghĩa trong cùng 1 không gian pid.
+# Việc replay chạy trên luồng flush (lúc nó khởi động), không trong request: get_queue()
+# có thể được gọi từ view async, nơi ORM đồng bộ bị cấm (SynchronousOnlyOperation).
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics, rollups
+from .models import History
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("heart_history_buffered", "gauge", "History rows waiting in the write-behind buffer")
+metrics.describe("heart_history_flushed_total", "counter", "History rows written by the write-behind flusher")
+metrics.describe("heart_history_flush_errors_total", "counter", "Failed write-behind flushes")
+metrics.describe("heart_history_replayed_total", "counter", "History rows replayed from orphaned journals")
+
+FIELDS = ("uid", "user_id", "input_data", "probability", "risk", "recommendations", "model_version", "created_at")
+
+
+def enabled():
+    return getattr(settings, "HISTORY_WRITE_BEHIND", False)
+
+
+def journal_dir():
+    return str(getattr(settings, "HISTORY_JOURNAL_DIR", os.path.join(settings.BASE_DIR, "var", "history_journal")))
+
+
+def _to_record(history):
+    return {
+        "uid": str(history.uid),
+        "user_id": history.user_id,
+        "input_data": history.input_data,
+        "probability": history.probability,
+        "risk": history.risk,
+        "recommendations": history.recommendations,
+        "model_version": history.model_version,
+        "created_at": history.created_at.isoformat(),
+    }
+
+
+def _from_record(rec):
+    rec = dict(rec)
+    rec["uid"] = uuid.UUID(rec["uid"])
+    rec["created_at"] = parse_datetime(rec["created_at"])
+    return History(**{k: rec[k] for k in FIELDS if k in rec})
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _write_rows(histories):
+    History.resolve_recommendations(histories)
+    # replay có thể gặp lại dòng đã ghi: bỏ qua để rollup không đếm 2 lần
+    existing = set(History.objects.filter(uid__in=[h.uid for h in histories]).values_list("uid", flat=True))
+    histories = [h for h in histories if h.uid not in existing]
+    with transaction.atomic():
+        History.objects.bulk_create(histories, batch_size=1000, ignore_conflicts=True)
+        rollups.record(histories)
+
+
+def _segment_owner(path):
+    """journal-<pid>-<token>-<seq>.jsonl -> (pid, token); bản cũ journal-<pid>-<seq>.jsonl -> (pid, None)"""
+    parts = os.path.basename(path)[:-len(".jsonl")].split("-")
+    pid = int(parts[1])
+    return pid, (parts[2] if len(parts) == 4 else None)
+
+
+def replay_orphans(directory=None, only_dead=True, live_token=None):
+    """
+    Ghi lại các segment journal không thuộc queue nào đang chạy. Trả về số dòng đã replay.
+    Segment cùng pid với tiến trình hiện tại nhưng khác token của queue đang chạy
+    (live_token, mặc định token của _queue) là của lần khởi động trước (container
+    restart -> pid 1 lần nữa): luôn replay.
+    """
+    directory = directory or journal_dir()
+    live = live_token
+    if live is None and _queue is not None and _queue.pid == os.getpid():
+        live = _queue.token
+    total = 0
+    for path in sorted(glob.glob(os.path.join(directory, "journal-*.jsonl"))):
+        try:
+            pid, token = _segment_owner(path)
+        except (IndexError, ValueError):
+            continue
+        if pid == os.getpid():
+            if live is not None and token == live:
+                continue
+        elif only_dead and _pid_alive(pid):
+            continue
+        histories = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    histories.append(_from_record(json.loads(line)))
+                except (ValueError, KeyError, TypeError):
+                    # dòng cuối có thể bị cắt ngang khi tiến trình chết
+                    logger.warning("Skipping corrupt journal line in %s", path)
+        if histories:
+            _write_rows(histories)
+        os.remove(path)
+        total += len(histories)
+        logger.info("Replayed %d History rows from %s", len(histories), path)
+    if total:
+        metrics.inc("heart_history_replayed_total", total)
+    return total
+
+
+class WriteBehindQueue:
+    def __init__(self, directory, batch_size=500, flush_seconds=1.0, fsync=False):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()         # buffer + segment hiện tại
+        self._flush_lock = threading.Lock()   # chỉ 1 lần flush tại 1 thời điểm
+        self._wake = threading.Event()
+        self._buffer = []
+        self._retired = []   # segment đã đóng, chờ flush thành công mới xoá
+        self._seq = 0
+        self.replayed = threading.Event()   # đã replay xong journal mồ côi lúc khởi động
+        os.makedirs(directory, exist_ok=True)
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="history-write-behind", daemon=True)
+        self._thread.start()
+
+    def _open_segment(self):
+        self._seq += 1
+        self._path = os.path.join(self.directory, f"journal-{self.pid}-{self.token}-{self._seq:06d}.jsonl")
+        self._file = open(self._path, "a", encoding="utf-8")
+
+    def submit(self, histories):
+        lines = "".join(json.dumps(_to_record(h), ensure_ascii=False) + "\n" for h in histories)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._buffer.extend(histories)
+            size = len(self._buffer)
+        metrics.set_gauge("heart_history_buffered", size)
+        if size >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch, self._buffer = self._buffer, []
+                # đóng segment hiện tại, request mới ghi sang segment mới
+                self._file.close()
+                self._retired.append(self._path)
+                self._open_segment()
+            try:
+                _write_rows(batch)
+            except Exception:
+                # giữ các segment cũ trên đĩa, đưa batch trở lại buffer để lần sau thử lại
+                metrics.inc("heart_history_flush_errors_total")
+                logger.exception("Write-behind flush of %d History rows failed", len(batch))
+                with self._lock:
+                    self._buffer[:0] = batch
+                return 0
+            for path in self._retired:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # `replay_history_journal --all` đã ghi và xoá segment này
+                    pass
+            self._retired = []
+            metrics.inc("heart_history_flushed_total", len(batch))
+            metrics.set_gauge("heart_history_buffered", len(self._buffer))
+            return len(batch)
+
+    def _replay(self):
+        try:
+            replay_orphans(self.directory, live_token=self.token)
+        except Exception:
+            logger.exception("Replaying orphaned History journals failed")
+        finally:
+            close_old_connections()
+            self.replayed.set()
+
+    def _run(self):
+        self._replay()
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flusher error")
+            finally:
+                close_old_connections()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    # thread flush không sống qua fork(): mỗi worker có queue/journal riêng theo pid
+    global _queue
+    if _queue is None or _queue.pid != os.getpid():
+        with _queue_lock:
+            if _queue is None or _queue.pid != os.getpid():
+                _queue = WriteBehindQueue(
+                    journal_dir(),
+                    batch_size=getattr(settings, "HISTORY_FLUSH_BATCH", 500),
+                    flush_seconds=getattr(settings, "HISTORY_FLUSH_SECONDS", 1.0),
+                    fsync=getattr(settings, "HISTORY_JOURNAL_FSYNC", False),
+                )
+                atexit.register(_queue.flush)
+    return _queue
+
+
+def save_histories(histories):
+    """
+    Lưu list History chưa save. Write-behind: đưa vào journal/buffer, chưa có id
+    (dùng uid); ngược lại: 1 câu bulk_create, có id ngay.
+    """
+    now = timezone.now()
+    for h in histories:
+        if h.created_at is None:
+            h.created_at = now
+    if enabled():
+        get_queue().submit(histories)
+        return histories
+    # bulk_create không gọi save(): tự đổi câu khuyến nghị -> id
+    History.resolve_recommendations(histories)
+    with transaction.atomic():
+        histories = History.objects.bulk_create(histories)
+        rollups.record(histories)
+    return histories
@@ -44,7 +44,9 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "api.User"
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # request.user dựng từ claim trong token, không SELECT api_user (api/authentication.py);
+        # "api.profiling.TimedJWTAuthentication" = JWTAuthentication tra DB mỗi request
+        "api.authentication.ClaimsJWTAuthentication",
     )
 }
 SIMPLE_JWT = {
@@ -56,10 +58,99 @@ SIMPLE_JWT = {
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,   # hoặc os.environ.get("SECRET_KEY")
     "AUTH_HEADER_TYPES": ("Bearer",),
+    # /api/login/ nhúng username/full_name/is_active/is_staff vào token
+    "TOKEN_OBTAIN_SERIALIZER": "api.serializers.ClaimsTokenObtainPairSerializer",
+    # /api/token/refresh/ đọc lại User từ DB, access token mới mang quyền hiện tại
+    "TOKEN_REFRESH_SERIALIZER": "api.serializers.ClaimsTokenRefreshSerializer",
 
     # mấy cái khác nếu có thì giữ, không có cũng không sao
 }
+# Mô hình AI (api/registry.py)
+MODEL_DIR = BASE_DIR / "api" / "model"
+# True: nạp mô hình ngay lúc khởi động (dùng với `gunicorn --preload` để các worker dùng chung bộ nhớ)
+MODEL_PRELOAD = False
+# True: memory-map các mảng .npy của engine (read-only, dùng chung page cache giữa các worker)
+MODEL_MMAP = True
+# Thư mục các phiên bản mô hình (mỗi phiên bản 1 thư mục con có meta.json), xem api/registry.py
+MODEL_REGISTRY_DIR = BASE_DIR.parent / "models"
+# Chu kỳ (giây) watcher quét MODEL_REGISTRY_DIR để hot-swap; 0 = tắt
+MODEL_REGISTRY_POLL_SECONDS = 30
+# Golden set dùng để kiểm tra phiên bản mới trước khi đổi
+MODEL_GOLDEN_PATH = BASE_DIR / "api" / "model" / "golden.json"
+MODEL_GOLDEN_MIN_AUC = 0.75
+
+# /api/predict/async/ (api/async_views.py, chạy qua ASGI: uvicorn backend.asgi:application)
+PREDICT_EXECUTOR = "thread"          # "thread" hoặc "process"
+PREDICT_EXECUTOR_WORKERS = 4
+# True: trả kết quả trước, INSERT History ở task nền (chỉ dùng khi chạy ASGI)
+PREDICT_ASYNC_DEFER_HISTORY = False
+
+# Write-behind cho History (api/writebehind.py): ghi journal cục bộ, flush bằng bulk_create
+HISTORY_WRITE_BEHIND = False
+HISTORY_FLUSH_BATCH = 500            # flush khi buffer đủ số dòng này
+HISTORY_FLUSH_SECONDS = 1.0          # ... hoặc sau chừng này giây
+HISTORY_JOURNAL_DIR = BASE_DIR / "var" / "history_journal"
+HISTORY_JOURNAL_FSYNC = False        # True: fsync mỗi lần ghi (an toàn cả khi mất điện, chậm hơn)
+
+# Cache kết quả /api/predict/ (api/cache.py): "local" (LRU trong tiến trình), "django" (CACHES), None = tắt
+PREDICT_CACHE = "local"
+PREDICT_CACHE_SIZE = 10000           # số phần tử tối đa của LRU cục bộ
+PREDICT_CACHE_ALIAS = "default"      # alias trong CACHES khi PREDICT_CACHE = "django"
+PREDICT_CACHE_TTL = None             # giây, None = không hết hạn (chỉ với "django")
+# False: cache hit không tạo thêm dòng History (history_id/history_uid = null)
+PREDICT_CACHE_HISTORY_ON_HIT = True
+
+# /api/predict/triage/ (api/triage.py): thư mục heart-disease.cost/.delay/.expense/.group
+TRIAGE_COSTS_DIR = BASE_DIR.parent / "data" / "heart+disease" / "costs"
+
+# Rollup cho /api/analytics/ (api/rollups.py): True = ghi delta cùng lúc INSERT History;
+# chạy `manage.py compact_rollups` định kỳ, `manage.py rebuild_rollups` để backfill
+HISTORY_ROLLUPS = True
+
+# /api/predict/whatif/ (api/whatif.py): số điểm tối đa của lưới counterfactual
+WHATIF_MAX_POINTS = 50000
+
+# Theo dõi input drift (api/drift.py): sketch trong RAM của mỗi worker được ghi xuống
+# bảng DriftSketch mỗi DRIFT_FLUSH_SECONDS giây; /api/drift/ và `manage.py drift_report`
+# chỉ tính PSI khi có ít nhất DRIFT_MIN_SAMPLES input trong khoảng thời gian
+DRIFT_MONITOR = True
+DRIFT_FLUSH_SECONDS = 300
+DRIFT_MIN_SAMPLES = 100
+
+# Chấm điểm bóng (api/shadow.py): phiên bản trong registry hoặc thư mục mô hình ứng viên
+# (có meta.json) được chấm trên SHADOW_SAMPLE_RATE phần input thật bởi SHADOW_WORKERS luồng
+# nền (gom lô tối đa SHADOW_BATCH_SECONDS giây); queue đầy (SHADOW_QUEUE_SIZE mẫu) thì bỏ
+# mẫu chứ không chặn request. Thống kê ghi xuống bảng ShadowAggregate mỗi
+# SHADOW_FLUSH_SECONDS giây, xem /api/shadow/
+SHADOW_MODELS = []
+SHADOW_SAMPLE_RATE = 0.1
+SHADOW_QUEUE_SIZE = 1000
+SHADOW_WORKERS = 1
+SHADOW_BATCH_SECONDS = 1.0
+SHADOW_FLUSH_SECONDS = 300
+
+# Cache user cục bộ của ClaimsJWTAuthentication (giây) cho token cũ chưa có claim; khi
+# AUTH_USER_CACHE_ALIAS là locmem/dummy đây cũng là tuổi tối đa (tính từ iat) của claim được tin
+AUTH_USER_CACHE_TTL = 300
+# Alias trong CACHES lưu trạng thái User mới (đổi quyền / khoá / xoá) để mọi worker thấy ngay;
+# nhiều worker thì alias này phải là cache dùng chung (redis, memcached, database), không phải locmem
+AUTH_USER_CACHE_ALIAS = "default"
+
+# Profiling (api/profiling.py): histogram latency theo view/giai đoạn + số câu SQL, xem /api/metrics/
+PROFILE_SAMPLE_RATE = 0.0            # phần request chạy profiler (0 = tắt, 0.01 = 1%)
+PROFILE_ENGINE = "cprofile"          # "cprofile" hoặc "pyinstrument" (nếu đã cài)
+PROFILE_SLOW_SECONDS = 1.0           # request được lấy mẫu chậm hơn ngưỡng này thì ghi profile
+PROFILE_DIR = BASE_DIR / "var" / "profiles"
+# /api/metrics/ chỉ cho admin (JWT) hoặc request có "Authorization: Bearer <METRICS_TOKEN>"
+# (đặt bearer_token trong scrape config của Prometheus); None = chỉ admin
+METRICS_TOKEN = None
+# Nhiều worker: thư mục cục bộ (dọn sạch mỗi lần deploy) để /api/metrics/ gộp số liệu của mọi
+# worker thay vì chỉ worker nhận scrape (api/metrics.py); None = số liệu của từng tiến trình
+METRICS_MULTIPROCESS_DIR = None
+METRICS_FLUSH_SECONDS = 5            # chu kỳ mỗi worker ghi snapshot vào thư mục trên
+
 MIDDLEWARE = [
+    "api.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
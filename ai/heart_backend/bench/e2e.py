@@ -0,0 +1,202 @@
+"""
+Load test đầu-cuối theo luồng người dùng thật:
+
+    register -> login -> predict × --predicts -> history
+
+Mỗi người dùng ảo là 1 kết nối HTTP/1.1 keep-alive; --users người dùng chạy đồng thời.
+Báo throughput (luồng/s, request/s) và p50/p95/p99 cho từng bước, ghi JSON vào --out.
+
+Hai cách chạy (từ ai/heart_backend):
+    # tự dựng server cục bộ với SQLite ở thư mục tạm (bench/settings_sqlite.py)
+    python bench/e2e.py --serve uvicorn --workers 2 --users 20 --out bench_e2e.json
+
+    # server có sẵn (vd. chạy với Postgres cục bộ)
+    python bench/e2e.py --base http://127.0.0.1:8000 --users 50
+
+    # so sánh với lần chạy trước, thoát mã 1 nếu chậm đi >20%
+    python bench/e2e.py --serve uvicorn --compare bench_e2e.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from load_predict import SAMPLE, Connection
+from results import compare, environment, latency_summary, write_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ("register", "login", "predict", "history")
+
+
+# -------------------------------
+# Server cục bộ
+# -------------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, proc, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not start listening on port {port} within {timeout:.0f}s")
+
+
+def start_server(kind, workers, settings_module, fast_hasher, workdir):
+    """migrate + chạy server trên cổng trống; trả về (base_url, Popen)"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module,
+               HEART_BENCH_DB=os.path.join(workdir, "db.sqlite3"))
+    if fast_hasher:
+        env["HEART_BENCH_FAST_HASHER"] = "1"
+    subprocess.run([sys.executable, "manage.py", "migrate", "--noinput", "-v", "0"],
+                   cwd=BACKEND_DIR, env=env, check=True)
+
+    port = _free_port()
+    if kind == "uvicorn":
+        cmd = [sys.executable, "-m", "uvicorn", "backend.asgi:application", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning", "--no-access-log"]
+    else:
+        cmd = [sys.executable, "manage.py", "runserver", f"127.0.0.1:{port}", "--noreload"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "server.log"), "w"))
+    try:
+        _wait_for_port(port, proc)
+    except Exception:
+        proc.terminate()
+        raise
+    return f"http://127.0.0.1:{port}", proc
+
+
+# -------------------------------
+# Người dùng ảo
+# -------------------------------
+async def user_flow(url, n_predicts, latencies, errors):
+    conn = Connection(url.hostname, url.port or 80)
+    json_headers = {"Content-Type": "application/json"}
+    username = f"bench_{uuid.uuid4().hex[:12]}"
+    password = "bench-Passw0rd!"
+
+    async def call(step, method, path, payload=None, headers=None, expect=200):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        t0 = time.perf_counter()
+        try:
+            status, data = await conn.request(method, path, body, headers)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            conn.close()
+            errors[step] += 1
+            return None
+        latencies[step].append(time.perf_counter() - t0)
+        if status != expect:
+            errors[step] += 1
+            return None
+        return json.loads(data) if data else {}
+
+    try:
+        if await call("register", "POST", "/api/register/",
+                      {"username": username, "password": password, "full_name": "Bench"}, json_headers) is None:
+            return False
+        tokens = await call("login", "POST", "/api/login/",
+                            {"username": username, "password": password}, json_headers)
+        if tokens is None:
+            return False
+        auth = {"Authorization": f"Bearer {tokens['access']}"}
+        for i in range(n_predicts):
+            # đổi tuổi theo từng lần để không chỉ đo cache kết quả của /api/predict/
+            payload = dict(SAMPLE, age=30 + (hash(username) + i) % 50)
+            await call("predict", "POST", "/api/predict/", payload, {**json_headers, **auth})
+        await call("history", "GET", "/api/history/", headers=auth)
+        return True
+    finally:
+        conn.close()
+
+
+async def run(base, users, n_predicts, rounds):
+    url = urlsplit(base)
+    latencies = {step: [] for step in STEPS}
+    errors = {step: 0 for step in STEPS}
+    t0 = time.perf_counter()
+    completed = 0
+    for _ in range(rounds):
+        done = await asyncio.gather(*(user_flow(url, n_predicts, latencies, errors) for _ in range(users)))
+        completed += sum(done)
+    elapsed = time.perf_counter() - t0
+
+    total = sum(len(v) for v in latencies.values())
+    results = {
+        "flow": {
+            "flows": completed,
+            "requests": total,
+            "errors": sum(errors.values()),
+            "seconds": elapsed,
+            "flows_per_s": completed / elapsed,
+            "rps": total / elapsed,
+        }
+    }
+    for step in STEPS:
+        results[step] = {**latency_summary(latencies[step]), "errors": errors[step]}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", help="URL của server có sẵn; bỏ trống thì dùng --serve")
+    parser.add_argument("--serve", choices=["uvicorn", "runserver"], default="uvicorn")
+    parser.add_argument("--settings", default="bench.settings_sqlite",
+                        help="DJANGO_SETTINGS_MODULE cho server tự dựng (vd. backend.settings = Postgres)")
+    parser.add_argument("--workers", type=int, default=1, help="số worker uvicorn")
+    parser.add_argument("--fast-hasher", action="store_true", help="MD5 cho mật khẩu (chỉ với bench.settings_sqlite)")
+    parser.add_argument("--users", type=int, default=20, help="số người dùng ảo chạy đồng thời")
+    parser.add_argument("--rounds", type=int, default=3, help="số lượt, mỗi lượt --users người dùng mới")
+    parser.add_argument("--predicts", type=int, default=20, help="số lần predict của mỗi người dùng")
+    parser.add_argument("--out", default="bench_e2e.json")
+    parser.add_argument("--compare", help="file JSON baseline để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    proc = None
+    tmp = None
+    base = args.base
+    if base is None:
+        tmp = tempfile.TemporaryDirectory(prefix="heart-bench-")
+        base, proc = start_server(args.serve, args.workers, args.settings, args.fast_hasher, tmp.name)
+    try:
+        results = asyncio.run(run(base, args.users, args.predicts, args.rounds))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+            tmp.cleanup()
+
+    flow = results["flow"]
+    print(f"{flow['flows']} flows, {flow['requests']} requests in {flow['seconds']:.1f}s: "
+          f"{flow['flows_per_s']:.2f} flows/s, {flow['rps']:.1f} req/s, errors={flow['errors']}")
+    for step in STEPS:
+        r = results[step]
+        print(f"  {step:9s} n={r['count']:<6d} p50={r['p50_ms']:8.2f}ms  p95={r['p95_ms']:8.2f}ms  "
+              f"p99={r['p99_ms']:8.2f}ms  errors={r['errors']}")
+
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else 0
+    write_results(args.out, "e2e", results, environment(
+        base=args.base or f"local {args.serve} ({args.settings}, workers={args.workers})",
+        users=args.users, rounds=args.rounds, predicts=args.predicts))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Load test so sánh /api/predict/ (sync, DRF) và /api/predict/async/ (ASGI).
+
+Chạy server trước, ví dụ:
+    gunicorn backend.wsgi -w 4                       # sync
+    uvicorn backend.asgi:application --workers 4     # async (cả 2 endpoint)
+rồi:
+    python bench/load_predict.py --base http://127.0.0.1:8000 --concurrency 1 50 500
+
+In ra requests/s, p50/p99 (ms) cho từng endpoint × mức đồng thời và ghi JSON vào --out.
+Chỉ dùng thư viện chuẩn (asyncio + HTTP/1.1 keep-alive tối giản).
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from urllib.parse import urlsplit
+
+SAMPLE = {
+    "age": 58, "sex": 1, "cp": 1, "trestbps": 148, "chol": 252, "fbs": 1,
+    "restecg": 1, "thalach": 112, "exang": 1, "oldpeak": 2.3, "slope": 2, "ca": 1, "thal": 7,
+}
+
+
+def _post_json(url, payload, token=None):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), method="POST",
+                                 headers={"Content-Type": "application/json"})
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    with urllib.request.urlopen(req) as res:
+        return json.loads(res.read())
+
+
+def get_token(base, username, password):
+    try:
+        _post_json(f"{base}/api/register/", {"username": username, "password": password, "full_name": "Bench"})
+    except urllib.error.HTTPError:
+        pass   # đã tồn tại
+    return _post_json(f"{base}/api/login/", {"username": username, "password": password})["access"]
+
+
+class Connection:
+    """1 kết nối HTTP/1.1 keep-alive"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 f"Content-Length: {len(body)}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        resp_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            resp_headers[k.strip().lower()] = v.strip()
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                data += await self.reader.readexactly(size)
+                await self.reader.readline()
+        else:
+            data = await self.reader.readexactly(int(resp_headers.get("content-length", 0)))
+
+        if resp_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[i]
+
+
+async def run_level(base, path, token, concurrency, total):
+    url = urlsplit(base)
+    body = json.dumps(SAMPLE).encode()
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+    latencies, errors = [], 0
+    remaining = total
+
+    async def client():
+        nonlocal remaining, errors
+        conn = Connection(url.hostname, url.port or 80)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                t0 = time.perf_counter()
+                try:
+                    status, _ = await conn.request("POST", path, body, headers)
+                except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    conn.close()
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - t0)
+                if status != 200:
+                    errors += 1
+        finally:
+            conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "path": path,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p95_ms": percentile(latencies, 95) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--paths", nargs="+", default=["/api/predict/", "/api/predict/async/"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 50, 500])
+    parser.add_argument("--requests", type=int, default=2000, help="số request cho mỗi mức đồng thời")
+    parser.add_argument("--username", default=f"bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--password", default="bench-Passw0rd!")
+    parser.add_argument("--out", default="bench_predict.json")
+    args = parser.parse_args()
+
+    token = get_token(args.base, args.username, args.password)
+    results = []
+    for path in args.paths:
+        for c in args.concurrency:
+            r = asyncio.run(run_level(args.base, path, token, c, max(args.requests, c)))
+            results.append(r)
+            print(f"{path:24s} c={c:<4d} {r['rps']:8.1f} req/s  p50={r['p50_ms']:7.2f}ms  "
+                  f"p99={r['p99_ms']:7.2f}ms  errors={r['errors']}")
+
+    with open(args.out, "w") as f:
+        json.dump({"base": args.base, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Micro-benchmark các đường nóng của API, chạy trong tiến trình (không cần server):
+
+    risk_tier, personalize_recommendations (+ personalize_batch),
+    PredictSerializer.is_valid, chấm điểm mô hình (batch 1 / 100 / 10000, kèm đầu severity,
+    route theo cơ sở nếu mô hình có cohort),
+    lưới what-if, sketch drift, giải thích SHAP và triage.step nếu mô hình hỗ trợ.
+
+Chạy từ ai/heart_backend:
+    python bench/micro.py --out bench_micro.json
+    python bench/micro.py --compare bench_micro.json --tolerance 0.2   # thoát mã 1 nếu chậm đi >20%
+
+Dữ liệu đầu vào lấy cố định (seed) từ processed.cleveland.data nên kết quả lặp lại được.
+Mỗi case: timeit autorange để chọn số vòng, lặp --repeat lần, báo median/min (µs/lần gọi)
+và items/s.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+
+from api.cohorts import SITES  # noqa: E402
+from api.drift import get_monitor  # noqa: E402
+from api.explain import background_matrix  # noqa: E402
+from api.personalize import personalize_batch, personalize_recommendations, risk_tier  # noqa: E402
+from api.registry import get_model  # noqa: E402
+from api.serializers import PredictSerializer  # noqa: E402
+from api.whatif import parse_axes, what_if  # noqa: E402
+from results import compare, environment, write_results  # noqa: E402
+
+INT_FEATURES = {"age", "sex", "cp", "trestbps", "chol", "fbs", "restecg", "thalach", "exang", "slope", "ca", "thal"}
+BATCH_SIZES = (1, 100, 10000)
+
+
+def make_records(feature_order, n, seed=0):
+    """n bệnh nhân lấy mẫu (có lặp) từ các dòng đầy đủ của dữ liệu Cleveland"""
+    X = background_matrix(len(feature_order))
+    X = X[~np.isnan(X).any(axis=1)]
+    rows = X[np.random.default_rng(seed).integers(len(X), size=n)]
+    return [
+        {f: (int(v) if f in INT_FEATURES else float(v)) for f, v in zip(feature_order, row)}
+        for row in rows
+    ]
+
+
+def measure(func, items=1, repeat=5):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    median = runs[len(runs) // 2]
+    return {
+        "items": items,
+        "number": number,
+        "median_us": median * 1e6,
+        "min_us": runs[0] * 1e6,
+        "items_per_s": items / median,
+    }
+
+
+def cases(model):
+    records = make_records(model.feature_order, max(BATCH_SIZES))
+    one = records[0]
+    payload = {k: str(v) for k, v in one.items()}   # như JSON từ form, cần ép kiểu
+    ps = model.predict_positive(records[:100]).tolist()
+
+    yield "risk_tier", (lambda: risk_tier(0.42)), 1
+    # cùng 1 input: trúng cache tra cứu của RuleEngine; 100 input khác nhau: gần với thực tế hơn
+    yield "personalize_recommendations[same]", (lambda: personalize_recommendations(one, tier="cao")), 1
+    yield "personalize_recommendations[100]", (
+        lambda: [personalize_recommendations(r, tier=risk_tier(p)) for r, p in zip(records, ps)]), 100
+    yield "personalize_batch[100]", (lambda: personalize_batch(records[:100], p=ps)), 100
+    yield "PredictSerializer.is_valid", (lambda: PredictSerializer(data=payload).is_valid()), 1
+    for n in BATCH_SIZES:
+        batch = records[:n]
+        yield f"predict_positive[{n}]", (lambda batch=batch: model.predict_positive(batch)), n
+    if model.has_severity:
+        # đầu nhị phân + severity trên cùng 1 lần transform
+        for n in BATCH_SIZES:
+            batch = records[:n]
+            yield f"predict_heads[{n}]", (lambda batch=batch: model.predict_heads(batch)), n
+    if model.has_cohorts:
+        # mỗi dòng 1 site: route theo từng dòng thay vì 1 route chung cho cả batch
+        for n in BATCH_SIZES[1:]:
+            mixed = [dict(r, site=SITES[i % len(SITES)]) for i, r in enumerate(records[:n])]
+            yield f"predict_positive[{n},mixed sites]", (lambda mixed=mixed: model.predict_positive(mixed)), n
+    for name, vary in (("whatif[chol,trestbps]", ["chol", "trestbps"]),
+                       ("whatif[chol,trestbps,thalach]", ["chol", "trestbps", "thalach"])):
+        axes = parse_axes(vary)
+        n = int(np.prod([len(v) for _, v in axes]))
+        yield f"{name}={n}", (lambda axes=axes: what_if(model, one, axes, include_surface=False)), n
+    monitor = get_monitor(model)
+    if monitor is not None:
+        yield "drift.observe[1]", (lambda: monitor.observe([one])), 1
+        yield "drift.observe[100]", (lambda: monitor.observe(records[:100])), 100
+    if model.explainer is not None:
+        for n in (1, 100):
+            batch = records[:n]
+            yield f"explain[{n}]", (lambda batch=batch: model.explain(batch)), n
+    if model.triage is not None:
+        partial = {k: v for k, v in one.items() if k in ("age", "sex", "cp", "trestbps")}
+        yield "triage.step", (lambda: model.triage.step(partial)), 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_micro.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="chỉ chạy các case có tên bắt đầu bằng ...")
+    parser.add_argument("--compare", help="file JSON baseline để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    model = get_model()
+    results = {}
+    for name, func, items in cases(model):
+        if args.only and not name.startswith(tuple(args.only)):
+            continue
+        r = measure(func, items, args.repeat)
+        results[name] = r
+        print(f"{name:40s} {r['median_us']:12.2f} us/call  {r['items_per_s']:14.0f} items/s")
+
+    # so sánh trước khi ghi: --out có thể trùng với file baseline
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else 0
+    write_results(args.out, "micro", results, environment(
+        model_version=model.version, engine=model.engine is not None))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
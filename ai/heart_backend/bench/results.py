@@ -0,0 +1,105 @@
+"""
+Tiện ích chung cho bench/: thông tin môi trường, percentile, ghi file JSON kết quả và
+so sánh với 1 file baseline để phát hiện hồi quy hiệu năng.
+
+File kết quả:
+    {"suite": "micro" | "e2e", "environment": {...}, "results": {tên: {metric: giá trị}}}
+
+So sánh (--compare baseline.json): mỗi metric có chiều "nhỏ hơn là tốt" (latency, *_us,
+*_ms) hoặc "lớn hơn là tốt" (*_per_s, rps); metric nào xấu đi quá --tolerance (tỉ lệ)
+thì báo REGRESSION và script thoát với mã 1, dùng được trong CI.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HIGHER_IS_BETTER = ("_per_s", "rps")
+LOWER_IS_BETTER = ("_us", "_ms")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[i]
+
+
+def latency_summary(latencies, prefix=""):
+    """list giây -> {count, p50_ms, p95_ms, p99_ms, mean_ms}"""
+    values = sorted(latencies)
+    return {
+        f"{prefix}count": len(values),
+        f"{prefix}p50_ms": percentile(values, 50) * 1e3,
+        f"{prefix}p95_ms": percentile(values, 95) * 1e3,
+        f"{prefix}p99_ms": percentile(values, 99) * 1e3,
+        f"{prefix}mean_ms": (sum(values) / len(values) * 1e3) if values else float("nan"),
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment(**extra):
+    import numpy
+
+    env = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+    }
+    try:
+        import sklearn
+        env["sklearn"] = sklearn.__version__
+    except ImportError:
+        pass
+    env.update(extra)
+    return env
+
+
+def write_results(path, suite, results, env):
+    with open(path, "w") as f:
+        json.dump({"suite": suite, "environment": env, "results": results}, f, indent=2, ensure_ascii=False)
+
+
+def _direction(metric):
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(results, baseline_path, tolerance, out=sys.stdout):
+    """In bảng so sánh với baseline; trả về số metric bị hồi quy"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = 0
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:40s} (new)", file=out)
+            continue
+        for metric, value in metrics.items():
+            direction = _direction(metric)
+            old = base.get(metric)
+            if not direction or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            worse = -direction * change > tolerance
+            regressions += worse
+            print(f"{name:40s} {metric:14s} {old:12.3f} -> {value:12.3f} ({change:+7.1%})"
+                  f"{'  REGRESSION' if worse else ''}", file=out)
+    return regressions
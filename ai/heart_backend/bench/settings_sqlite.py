@@ -0,0 +1,25 @@
+"""
+Settings cho bench/e2e.py --serve: giống backend.settings nhưng dùng SQLite ở file tạm
+(HEART_BENCH_DB) thay cho Postgres, và tắt DEBUG (DEBUG=True giữ lại mọi câu SQL
+trong connection.queries, làm sai số đo).
+
+HEART_BENCH_FAST_HASHER=1: băm mật khẩu bằng MD5 để register/login không bị PBKDF2
+chiếm hết thời gian khi chỉ muốn đo predict/history.
+"""
+
+import os
+
+from backend.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("HEART_BENCH_DB", os.path.join(BASE_DIR, "var", "bench.sqlite3")),  # noqa: F405
+        "OPTIONS": {"timeout": 30},   # nhiều worker cùng ghi: chờ khoá thay vì lỗi "database is locked"
+    }
+}
+
+if os.environ.get("HEART_BENCH_FAST_HASHER") == "1":
+    PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]